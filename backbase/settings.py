@@ -30,6 +30,9 @@ SECRET_KEY = 'django-insecure-cjt0phjy@(w_uca0hd&jr7q8zu!z6a+ot=_492o8uirvp9r+bm
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# 'off', 'warn' or 'raise'; see main.query_budget.
+QUERY_BUDGET_MODE = 'warn' if DEBUG else 'off'
+
 ALLOWED_HOSTS = []
 
 CORS_ORIGIN_ALLOW_ALL = True
@@ -51,13 +54,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main.middleware.QueryBudgetMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.middleware.FetchRoleMiddleware',
 ]
 
 ROOT_URLCONF = 'backbase.urls'
@@ -82,6 +88,7 @@ TEMPLATES = [
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
@@ -148,6 +155,18 @@ CONSTANCE_CONFIG = OrderedDict(
         ("CACHE_TIMEOUT", (86400, "Cache timeout in seconds (1 day)")),
         ("API_REQUEST_TIMEOUT", (10, "API request timeout in second")),
         ('MAX_RETRIES', (3, 'Maximum number of retries for API requests')),
+        ('TIMESERIES_WINDOW_DAYS', (365, 'Number of days fetched per timeseries request')),
+        ('TIMESERIES_MAX_WORKERS', (4, 'Maximum number of timeseries windows fetched concurrently')),
+        ('ANCHOR_CURRENCY', ('USD', 'Currency every rate snapshot is fetched against; other pairs are derived as cross rates')),
+        ('PROVIDER_STRATEGY', ('failover', 'How providers are consulted: failover, hedged or quorum')),
+        ('PROVIDER_HEDGE_DELAY', (0.5, 'Seconds to wait on a provider before also asking the next one (hedged strategy)')),
+        ('PROVIDER_QUORUM', (2, 'Number of providers that must agree on a rate (quorum strategy)')),
+        ('CIRCUIT_FAILURE_THRESHOLD', (5, 'Consecutive provider failures that open its circuit')),
+        ('CIRCUIT_RESET_TIMEOUT', (30, 'Seconds an open circuit skips the provider before a probe call')),
+        ('NEGATIVE_CACHE_TIMEOUT', (60, 'Seconds a pair no provider could resolve is not asked for again')),
+        ('PREFETCH_BASE_CURRENCIES', ('USD,EUR', 'Comma separated base currencies whose daily snapshot is prefetched')),
+        ('MAX_RATE_AGE_DAYS', (7, 'Days a stored rate may be used as the latest one before a fresh rate is fetched (0: no limit)')),
+        ('BULK_FETCH_MAX_WORKERS', (4, 'Maximum number of (source, date) groups of a bulk conversion fetched concurrently')),
     ]
 )
 
@@ -160,7 +179,29 @@ CONSTANCE_CONFIG_FIELDSETS = OrderedDict(
                 'CURRENCY_BEACON_API_KEY',
                 'CACHE_TIMEOUT',
                 'API_REQUEST_TIMEOUT',
-                'MAX_RETRIES'
+                'MAX_RETRIES',
+                'TIMESERIES_WINDOW_DAYS',
+                'TIMESERIES_MAX_WORKERS',
+                'ANCHOR_CURRENCY',
+                'MAX_RATE_AGE_DAYS'
+            )
+        ),
+        (
+            "Providers",
+            (
+                'PROVIDER_STRATEGY',
+                'PROVIDER_HEDGE_DELAY',
+                'PROVIDER_QUORUM',
+                'CIRCUIT_FAILURE_THRESHOLD',
+                'CIRCUIT_RESET_TIMEOUT',
+                'NEGATIVE_CACHE_TIMEOUT',
+                'BULK_FETCH_MAX_WORKERS'
+            )
+        ),
+        (
+            "Prefetch",
+            (
+                'PREFETCH_BASE_CURRENCIES',
             )
         )
     ]
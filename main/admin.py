@@ -1,25 +1,63 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.db.models import Q
 from django.http import HttpResponseRedirect
 from django.urls import path, reverse
+from django.utils.dateparse import parse_date
 
 from main.models import Currency, CurrencyExchangeRate, Provider
+from main.paginators import EstimatedCountPaginator
 
 
+SEEK_VAR = 'before'
+# The ordering the seek cursor follows, the default one, whether or not chosen from the header.
+SEEK_ORDERING = ('-valuation_date', '-id')
+
 
 class CurrencyAdmin(admin.ModelAdmin):
     model = Currency
     fields = ['name', 'code', 'symbol']
     list_display =  ['name', 'code', 'symbol']
+    search_fields = ['code', 'name']
 
 
 class CurrencyExchangeRateAdmin(admin.ModelAdmin):
+    """
+    Built for a table of millions of rows: currencies are joined rather than fetched per
+    row, pages are counted with an estimate, and ?before=<date>:<id> seeks past a row
+    (exchange_rate_seek_idx) instead of using an ever larger OFFSET.
+    """
     change_list_template = 'admin/currencyexchangerate/change_list.html'
 
     model = CurrencyExchangeRate
     fields = ['source_currency', 'exchanged_currency', 'valuation_date', 'rate_value']
     list_display = ['source_currency', 'exchanged_currency', 'valuation_date', 'rate_value']
+    list_select_related = ['source_currency', 'exchanged_currency']
+    list_filter = ['source_currency', 'exchanged_currency']
+    date_hierarchy = 'valuation_date'
+    ordering = ['-valuation_date', '-id']
+    autocomplete_fields = ['source_currency', 'exchanged_currency']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        # ChangeList rejects query parameters that are not lookups, so take the cursor out first.
+        request.GET = request.GET.copy()
+        request.seek_cursor = parse_seek_cursor(request.GET.pop(SEEK_VAR, [None])[0])
+        response = super().changelist_view(request, extra_context)
+
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        older_cursor = changelist.get_older_cursor() if isinstance(changelist, SeekChangeList) else None
+        if older_cursor:
+            query = request.GET.copy()
+            query.pop('p', None)
+            query[SEEK_VAR] = older_cursor
+            response.context_data['seek_next_url'] = f"?{query.urlencode()}"
+        return response
+
+    def get_changelist(self, request, **kwargs):
+        return SeekChangeList
 
-    
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
@@ -31,6 +69,87 @@ class CurrencyExchangeRateAdmin(admin.ModelAdmin):
         return HttpResponseRedirect(reverse('currency_converter'))
 
 
+class SeekChangeList(ChangeList):
+    """
+    Applies the seek cursor under the orderings it follows only, and keeps it in the filter,
+    date hierarchy and page links; sort links drop it.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.seek_cursor = getattr(request, 'seek_cursor', None)
+        self.seek_ordering = False
+        super().__init__(request, *args, **kwargs)
+
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        self.seek_ordering = get_effective_ordering(queryset.query.order_by) == SEEK_ORDERING
+        if self.seek_ordering and self.seek_cursor:
+            queryset = queryset.filter(get_seek_filter(*self.seek_cursor))
+        return queryset
+
+    def get_query_string(self, new_params=None, remove=None):
+        new_params = dict(new_params or {})
+        if self.seek_ordering and self.seek_cursor and ORDER_VAR not in new_params:
+            new_params.setdefault(SEEK_VAR, format_seek_cursor(*self.seek_cursor))
+        return super().get_query_string(new_params, remove)
+
+    def get_older_cursor(self):
+        """
+        The cursor past the last row shown, or None when no older row follows it. A short
+        page is the last one; a full page costs one indexed EXISTS query.
+        """
+        if not self.seek_ordering or not self.result_list:
+            return None
+        if len(self.result_list) < self.list_per_page:
+            return None
+        last_rate = self.result_list[len(self.result_list) - 1]
+        if not self.queryset.filter(get_seek_filter(last_rate.valuation_date, last_rate.pk)).exists():
+            return None
+        return format_seek_cursor(last_rate.valuation_date, last_rate.pk)
+
+
+def get_effective_ordering(order_by):
+    """
+    The fields rows are actually sorted on: ChangeList appends the default ordering after
+    the chosen one, so only the first mention of a field counts.
+    """
+    ordering, seen = [], set()
+    for field in order_by:
+        if not isinstance(field, str):
+            return None
+        name = field.lstrip('-')
+        name = 'id' if name == 'pk' else name
+        if name not in seen:
+            seen.add(name)
+            ordering.append(f"-{name}" if field.startswith('-') else name)
+    return tuple(ordering)
+
+
+def get_seek_filter(valuation_date, pk):
+    return Q(valuation_date__lt=valuation_date) | Q(valuation_date=valuation_date, pk__lt=pk)
+
+
+def format_seek_cursor(valuation_date, pk):
+    return f"{valuation_date.isoformat()}:{pk}"
+
+
+def parse_seek_cursor(value):
+    """
+    Returns (date, id) from a "<YYYY-MM-DD>:<id>" cursor, or None when it is missing or invalid.
+    """
+    if not value:
+        return None
+    raw_date, _, raw_pk = value.partition(':')
+    try:
+        valuation_date = parse_date(raw_date)
+        pk = int(raw_pk)
+    except ValueError:
+        return None
+    if valuation_date is None:
+        return None
+    return valuation_date, pk
+
+
 class ProviderAdmin(admin.ModelAdmin):
     model = Provider
     list_display = ['name', 'class_path', 'priority', 'active']
@@ -0,0 +1,206 @@
+import math
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+from main.history import fill_timeseries_gaps, parse_symbols
+from main.series_store import NO_RATE, SCALE_DIGITS, series_store
+
+
+DEFAULT_WINDOW = 30
+MAX_WINDOW = 365
+PERIODS = ('week', 'month', 'year')
+SCALE = 10 ** SCALE_DIGITS
+
+
+def get_period_key(day, period):
+    if period == 'week':
+        iso_year, iso_week, _ = day.isocalendar()
+        return f"{iso_year}-W{iso_week:02d}"
+    if period == 'month':
+        return f"{day.year}-{day.month:02d}"
+    return str(day.year)
+
+
+def get_next_period_start(day, period):
+    if period == 'week':
+        return day + timedelta(days=7 - day.weekday())
+    if period == 'month':
+        return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    return date(day.year + 1, 1, 1)
+
+
+def get_period_boundaries(first_ordinal, last_ordinal, period):
+    """
+    Returns [(first ordinal of the period, key)] for the periods overlapping the range.
+    """
+    boundaries = []
+    ordinal = first_ordinal
+    while ordinal <= last_ordinal:
+        day = date.fromordinal(ordinal)
+        boundaries.append((ordinal, get_period_key(day, period)))
+        ordinal = get_next_period_start(day, period).toordinal()
+    return boundaries
+
+
+def to_rate(value):
+    return Decimal(value).scaleb(-SCALE_DIGITS)
+
+
+def get_rate_analytics(source_currency, from_date, to_date, symbols=None, window=DEFAULT_WINDOW, period='month'):
+    """
+    Statistics per symbol over the stored history of the range, filling its gaps first
+    exactly as the timeseries endpoint does. Returns None for symbols with no rates.
+    """
+    to_date = min(to_date, timezone.now().date())
+    symbols = parse_symbols(symbols)
+    if from_date <= to_date:
+        fill_timeseries_gaps(source_currency, from_date, to_date, symbols)
+    slices = series_store.get_slices(source_currency, from_date, to_date, symbols) if from_date <= to_date else []
+
+    return {
+        'base': source_currency,
+        'from_date': from_date.isoformat(),
+        'to_date': to_date.isoformat(),
+        'window': window,
+        'period': period,
+        'rates': {code: summarize_series(first_ordinal, values, window, period) for code, first_ordinal, values in slices},
+    }
+
+
+def summarize_series(first_ordinal, values, window, period):
+    """
+    One pass over the fixed-point values of a series, doing only arithmetic per point:
+    running sums give the mean, standard deviation and volatility (standard deviation of
+    log returns), overall and over the last window observations, while min, max and the
+    period opens and closes are tracked as the pass goes. Rolling statistics are reported
+    at every period close. Days without a rate are skipped, so windows count observations.
+    """
+    boundaries = get_period_boundaries(first_ordinal, first_ordinal + len(values) - 1, period)
+    boundary_index = 0
+    next_boundary = first_ordinal
+    periods = []
+    period_open = previous_close = None
+
+    count = 0
+    first = last = minimum = maximum = None
+    first_offset = last_offset = minimum_offset = maximum_offset = None
+    total = total_squares = 0.0
+    return_sum = return_squares = 0.0
+    # Observed rates and log returns; the rolling sums cover their last window entries.
+    rates, returns = [], []
+    window_sums = [0.0, 0.0, 0.0, 0.0]
+    log = math.log
+
+    for offset, value in enumerate(values):
+        if value == NO_RATE:
+            continue
+
+        if first_ordinal + offset >= next_boundary:
+            if period_open is not None:
+                periods.append(close_period(
+                    boundaries[boundary_index][1], period_open, last, previous_close or period_open,
+                    window, rates, returns, window_sums
+                ))
+                previous_close = last
+            while boundary_index + 1 < len(boundaries) and boundaries[boundary_index + 1][0] <= first_ordinal + offset:
+                boundary_index += 1
+            next_boundary = boundaries[boundary_index + 1][0] if boundary_index + 1 < len(boundaries) else math.inf
+            period_open = value
+
+        rate = value / SCALE
+        if first is None:
+            first = minimum = maximum = value
+            first_offset = minimum_offset = maximum_offset = offset
+        else:
+            log_return = log(value / last)
+            return_sum += log_return
+            return_squares += log_return * log_return
+            returns.append(log_return)
+            window_sums[2] += log_return
+            window_sums[3] += log_return * log_return
+            if len(returns) > window:
+                dropped = returns[-window - 1]
+                window_sums[2] -= dropped
+                window_sums[3] -= dropped * dropped
+            if value < minimum:
+                minimum, minimum_offset = value, offset
+            elif value > maximum:
+                maximum, maximum_offset = value, offset
+        last, last_offset = value, offset
+        count += 1
+        total += rate
+        total_squares += rate * rate
+        rates.append(rate)
+        window_sums[0] += rate
+        window_sums[1] += rate * rate
+        if count > window:
+            dropped = rates[-window - 1]
+            window_sums[0] -= dropped
+            window_sums[1] -= dropped * dropped
+
+    if first is None:
+        return None
+    periods.append(close_period(
+        boundaries[boundary_index][1], period_open, last, previous_close or period_open, window, rates, returns, window_sums
+    ))
+
+    def get_date(offset):
+        return date.fromordinal(first_ordinal + offset).isoformat()
+
+    mean = total / count
+    return_count = count - 1
+    daily_volatility = get_std(return_squares, return_sum / return_count, return_count) if return_count > 1 else None
+    span_days = last_offset - first_offset
+    observations_per_year = return_count / span_days * 365.25 if span_days else None
+
+    return {
+        'points': count,
+        'first': {'date': get_date(first_offset), 'rate': to_rate(first)},
+        'last': {'date': get_date(last_offset), 'rate': to_rate(last)},
+        'min': {'date': get_date(minimum_offset), 'rate': to_rate(minimum)},
+        'max': {'date': get_date(maximum_offset), 'rate': to_rate(maximum)},
+        'mean': round(mean, SCALE_DIGITS),
+        'std': round(get_std(total_squares, mean, count), SCALE_DIGITS),
+        'change': to_rate(last - first),
+        'change_pct': round((last - first) / first * 100, 4),
+        'volatility': {
+            'daily': round(daily_volatility, SCALE_DIGITS) if daily_volatility is not None else None,
+            'annualized': (
+                round(daily_volatility * math.sqrt(observations_per_year), SCALE_DIGITS)
+                if daily_volatility is not None and observations_per_year else None
+            ),
+        },
+        'periods': periods,
+    }
+
+
+def close_period(key, open_value, close_value, reference, window, rates, returns, window_sums):
+    """
+    A period's open and close, its change from reference (the previous period's close, or
+    its own open for the first one) and the rolling statistics as of its close.
+    """
+    rolling_mean = rolling_std = rolling_volatility = None
+    if len(rates) >= window:
+        rolling_mean = window_sums[0] / window
+        rolling_std = get_std(window_sums[1], rolling_mean, window)
+    if len(returns) >= window:
+        rolling_volatility = get_std(window_sums[3], window_sums[2] / window, window)
+    return {
+        'period': key,
+        'open': to_rate(open_value),
+        'close': to_rate(close_value),
+        'change_pct': round((close_value - reference) / reference * 100, 4),
+        'rolling_mean': round(rolling_mean, SCALE_DIGITS) if rolling_mean is not None else None,
+        'rolling_std': round(rolling_std, SCALE_DIGITS) if rolling_std is not None else None,
+        'rolling_volatility': round(rolling_volatility, SCALE_DIGITS) if rolling_volatility is not None else None,
+    }
+
+
+def get_std(sum_of_squares, mean, count):
+    """
+    Population standard deviation from a sum of squares, clamped against rounding below 0.
+    """
+    return math.sqrt(max(sum_of_squares / count - mean * mean, 0.0))
@@ -0,0 +1,168 @@
+import json
+
+from asgiref.sync import sync_to_async
+from datetime import datetime
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from main.cache import cached_config, tiered_cache
+from main.conditional import conditional_response, make_etag, set_cache_headers
+from main.forms import CurrencyConverterForm
+from main.history import aiter_timeseries_rates
+from main.models import CurrencyExchangeRate
+from main.renderers import CSVRenderer, NDJSONRenderer
+from main.services import afetch_rates, aget_rates
+from main.utils import atransform_data, get_currency_registry
+from main.views import (
+    get_conversion_result, get_exchange_rate_data, get_rate_cache_policy, parse_valuation_date, validate_currency_codes
+)
+
+
+# Async counterparts of the exchange-rate, converter and timeseries endpoints, served under
+# /api/async/. Under ASGI a request waiting on a provider holds no thread, so one worker
+# keeps as many upstream calls in flight as the provider's connection pool allows.
+
+STREAM_RENDERERS = {renderer.format: renderer for renderer in (NDJSONRenderer(), CSVRenderer())}
+
+
+def read_json_body(request):
+    if not request.body:
+        return {}
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class AsyncExchangeRateView(View):
+    query_budget = {'GET': 1}
+
+    async def get(self, request, source_currency, exchanged_currency, valuation_date=None):
+        source_currency, exchanged_currency = source_currency.upper(), exchanged_currency.upper()
+        error = validate_currency_codes([source_currency, exchanged_currency])
+        if error:
+            return JsonResponse({"status": "failed", "error": error}, status=400)
+
+        currency_registry = await sync_to_async(get_currency_registry)()
+        source_currency_data = currency_registry.get(source_currency)
+        exchanged_currency_data = currency_registry.get(exchanged_currency)
+        if source_currency_data is None or exchanged_currency_data is None:
+            return JsonResponse({"status": "failed", "error": "Currency not found"}, status=404)
+
+        valuation_date = parse_valuation_date(valuation_date)
+        if valuation_date is None:
+            return JsonResponse({"status": "failed", "error": "Invalid date format"}, status=400)
+        cache_timeout = await cached_config.aget('CACHE_TIMEOUT')
+        max_age, immutable = get_rate_cache_policy(valuation_date, cache_timeout)
+
+        cache_key = f"{source_currency}_{exchanged_currency}_{valuation_date.isoformat()}"
+        cached_data = await sync_to_async(tiered_cache.get, thread_sensitive=False)(cache_key, namespace='exchange_rate')
+        if cached_data:
+            etag = make_etag(cache_key, cached_data['rate_value'])
+            response = conditional_response(request, etag) or JsonResponse(cached_data)
+            return set_cache_headers(response, etag, max_age, immutable)
+
+        rate_value = await CurrencyExchangeRate.objects.filter(
+            source_currency_id=source_currency_data['id'],
+            exchanged_currency_id=exchanged_currency_data['id'],
+            valuation_date=valuation_date
+        ).values_list('rate_value', flat=True).afirst()
+
+        created = rate_value is None
+        if created:
+            rates = await afetch_rates(source_currency, [exchanged_currency], valuation_date)
+            rate_value = rates.get(exchanged_currency)
+            if rate_value is None:
+                return JsonResponse({"error": "Unable to fetch exchange rate"}, status=400)
+
+        data = get_exchange_rate_data(source_currency_data, exchanged_currency_data, valuation_date, rate_value, created)
+        etag = make_etag(cache_key, data['rate_value'])
+        if created:
+            response = JsonResponse(data, status=201)
+        else:
+            await sync_to_async(tiered_cache.set, thread_sensitive=False)(
+                cache_key, data, timeout=cache_timeout, namespace='exchange_rate'
+            )
+            response = conditional_response(request, etag) or JsonResponse(data)
+        return set_cache_headers(response, etag, max_age, immutable)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCurrencyConverterView(View):
+    """
+    JSON only: {"source_currency": "USD", "target_currencies": ["EUR", ...], "amount": "10"}.
+    """
+    query_budget = {'POST': 2}
+
+    async def post(self, request):
+        data = read_json_body(request)
+        if data is None:
+            return JsonResponse({'status': 'failed', 'error': 'Invalid JSON body.'}, status=400)
+
+        source_currency_code = str(data.get('source_currency') or '').upper()
+        target_currency_codes = [str(code).strip().upper() for code in data.get('target_currencies') or []]
+
+        currency_registry = await sync_to_async(get_currency_registry)()
+        if source_currency_code not in currency_registry:
+            return JsonResponse(
+                {"source_currency": [f"Currency with code '{source_currency_code}' does not exist."]}, status=400
+            )
+        for code in target_currency_codes:
+            if code not in currency_registry:
+                return JsonResponse({"target_currencies": [f"Currency with code '{code}' does not exist."]}, status=400)
+        if not target_currency_codes:
+            return JsonResponse({"target_currencies": ["This field is required."]}, status=400)
+
+        try:
+            amount = CurrencyConverterForm.base_fields['amount'].clean(data.get('amount'))
+        except ValidationError as e:
+            return JsonResponse({'amount': e.messages}, status=400)
+
+        rates = await aget_rates(source_currency_code, target_currency_codes)
+        conversion_results = [
+            get_conversion_result(
+                currency_registry[code]['name'], currency_registry[code]['symbol'], amount, rates.get(code)
+            )
+            for code in target_currency_codes
+        ]
+        return JsonResponse({'conversion_results': conversion_results})
+
+
+class AsyncTimeseriesCurrencyRate(View):
+    """
+    Same input as TimeseriesCurrencyRate. ?format=ndjson|csv streams the rows from the async
+    ORM; anything else returns a JSON list.
+    """
+
+    async def get(self, request):
+        data = read_json_body(request)
+        if data is None:
+            return JsonResponse({'status': 'failed', 'error': 'Invalid JSON body.'}, status=400)
+        data = {**request.GET.dict(), **data}
+
+        source_currency = data.get('source_currency')
+        from_date = data.get('from_date')
+        to_date = data.get('to_date')
+        symbols = data.get('symbols')
+
+        if not (source_currency and from_date and to_date):
+            return JsonResponse({'status': 'failed', 'error': 'Invalid input parameters.'}, status=400)
+
+        try:
+            from_date = datetime.strptime(from_date, "%Y-%m-%d").date()
+            to_date = datetime.strptime(to_date, "%Y-%m-%d").date()
+        except ValueError:
+            return JsonResponse({'status': 'failed', 'error': 'Invalid date format'}, status=400)
+
+        source_currency = source_currency.upper()
+        rows = atransform_data(aiter_timeseries_rates(source_currency, from_date, to_date, symbols), source_currency)
+
+        renderer = STREAM_RENDERERS.get(request.GET.get('format'))
+        if renderer is not None:
+            content_type = f"{renderer.media_type}; charset={renderer.charset}"
+            return StreamingHttpResponse(renderer.astream(rows), content_type=content_type)
+        return JsonResponse([row async for row in rows], safe=False)
@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from constance import config
+from django.core.cache import cache
+
+
+L1_MAX_ENTRIES = 2048
+L1_TIMEOUT = 60
+VERSION_CHECK_INTERVAL = 5
+
+MISSING = object()
+
+
+class TieredCache:
+    """
+    Bounded, TTL-aware in-process LRU (L1) in front of the Django cache (L2).
+
+    Entries stored under a namespace ('currency', 'provider', 'constance', ...) are keyed by
+    the namespace's version, kept in L2 and re-read at most every VERSION_CHECK_INTERVAL
+    seconds, so invalidate(namespace) reaches every worker within that interval and the
+    current process at once.
+    """
+
+    def __init__(self, max_entries=L1_MAX_ENTRIES, l1_timeout=L1_TIMEOUT):
+        self.max_entries = max_entries
+        self.l1_timeout = l1_timeout
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.counters = {'l1': {'hits': 0, 'misses': 0}, 'l2': {'hits': 0, 'misses': 0}}
+
+    def get(self, key, default=None, namespace=None):
+        return self.get_many([key], namespace).get(key, default)
+
+    def get_many(self, keys, namespace=None):
+        keys = list(keys)
+        full_keys = {self.make_key(key, namespace): key for key in keys}
+        found = {}
+        missing = []
+
+        now = time.monotonic()
+        with self.lock:
+            for full_key, key in full_keys.items():
+                entry = self.entries.get(full_key)
+                if entry and entry[0] > now:
+                    self.entries.move_to_end(full_key)
+                    found[key] = entry[1]
+                else:
+                    missing.append(full_key)
+            self.count('l1', len(found), len(missing))
+
+        if missing:
+            l2_values = cache.get_many(missing)
+            with self.lock:
+                self.count('l2', len(l2_values), len(missing) - len(l2_values))
+            self.store_local(l2_values, self.l1_timeout)
+            found.update({full_keys[full_key]: value for full_key, value in l2_values.items()})
+        return found
+
+    def set(self, key, value, timeout, namespace=None, local_only=False):
+        self.set_many({key: value}, timeout, namespace, local_only)
+
+    def set_many(self, mapping, timeout, namespace=None, local_only=False):
+        mapping = {self.make_key(key, namespace): value for key, value in mapping.items()}
+        if not local_only:
+            cache.set_many(mapping, timeout=timeout)
+        self.store_local(mapping, min(timeout, self.l1_timeout) if timeout else self.l1_timeout)
+
+    def get_or_set(self, key, loader, timeout, namespace=None, local_only=False):
+        full_key = self.make_key(key, namespace)
+        if local_only:
+            value = self.get_local(full_key)
+        else:
+            value = self.get_many([key], namespace).get(key, MISSING)
+
+        if value is MISSING:
+            value = loader()
+            self.set(key, value, timeout, namespace, local_only)
+        return value
+
+    def get_local(self, full_key):
+        with self.lock:
+            entry = self.entries.get(full_key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(full_key)
+                value = entry[1]
+            else:
+                value = MISSING
+            self.count('l1', value is not MISSING, value is MISSING)
+        return value
+
+    def get_fresh_local(self, key, namespace):
+        """
+        L1 value of a namespaced key without any I/O, or MISSING when it is not in L1 or the
+        namespace version is due for a check in L2.
+        """
+        checked_at, version = self.versions.get(namespace, (0, None))
+        if time.monotonic() - checked_at > VERSION_CHECK_INTERVAL:
+            return MISSING
+        return self.get_local(f"{namespace}:{version}:{key}")
+
+    def store_local(self, mapping, timeout):
+        expires_at = time.monotonic() + timeout
+        with self.lock:
+            for full_key, value in mapping.items():
+                self.entries[full_key] = (expires_at, value)
+                self.entries.move_to_end(full_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def make_key(self, key, namespace=None):
+        if namespace is None:
+            return key
+        return f"{namespace}:{self.get_version(namespace)}:{key}"
+
+    def get_version(self, namespace):
+        checked_at, version = self.versions.get(namespace, (0, None))
+        if time.monotonic() - checked_at > VERSION_CHECK_INTERVAL:
+            version = cache.get(f"cache_version:{namespace}")
+            self.versions[namespace] = (time.monotonic(), version)
+        return version
+
+    def invalidate(self, namespace):
+        version = time.time_ns()
+        cache.set(f"cache_version:{namespace}", version, timeout=None)
+        self.versions[namespace] = (time.monotonic(), version)
+
+    def count(self, tier, hits, misses):
+        # Callers hold self.lock, so concurrent reads do not lose updates.
+        counters = self.counters[tier]
+        counters['hits'] += hits
+        counters['misses'] += misses
+
+    def stats(self):
+        with self.lock:
+            return {tier: dict(counters) for tier, counters in self.counters.items()}
+
+    def clear_local(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+
+class CachedConfig:
+    """
+    Read-through view of constance config served from L1; constance itself keeps the values
+    in the database and L2, so every attribute read would otherwise be a network call.
+    """
+
+    def __getattr__(self, name):
+        return tiered_cache.get_or_set(
+            name, lambda: load_config_value(name), tiered_cache.l1_timeout, namespace='constance', local_only=True
+        )
+
+    async def aget(self, name):
+        """
+        cached_config.<name> for coroutines. Values not in L1 under a current version are read
+        in a worker thread, so the event loop never waits on the cache or the database.
+        """
+        value = tiered_cache.get_fresh_local(name, namespace='constance')
+        if value is MISSING:
+            value = await sync_to_async(getattr, thread_sensitive=False)(self, name)
+        return value
+
+
+config_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='config')
+
+
+def load_config_value(name):
+    """
+    Inside a running event loop constance returns an awaitable proxy instead of the value;
+    the read is then made from a worker thread so L1 only ever holds plain values.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return getattr(config, name)
+    return config_executor.submit(getattr, config, name).result()
+
+
+tiered_cache = TieredCache()
+cached_config = CachedConfig()
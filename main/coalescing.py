@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from concurrent.futures import Future, TimeoutError
+from contextvars import ContextVar
+
+from django.core.cache import cache
+
+from main.cache import cached_config
+
+
+LOCK_TIMEOUT = 60
+RESULT_TIMEOUT = 10
+POLL_INTERVAL = 0.05
+
+MISSING = object()
+
+fetch_role = ContextVar('fetch_role', default=None)
+
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+
+class CoalescedFetchError(Exception):
+    """
+    Raised to the followers of a fetch that failed; the leader already reported the failure.
+    """
+
+
+def get_fetch_role():
+    """
+    'leader' if this request made an upstream call, 'follower' if it reused another
+    request's call, None if it needed neither.
+    """
+    return fetch_role.get()
+
+
+def record_fetch_role(role):
+    # A leader role is never downgraded by a later coalesced fetch in the same request.
+    if fetch_role.get() != 'leader':
+        fetch_role.set(role)
+
+
+def single_flight(key, fetch):
+    """
+    Call fetch() once per key however many threads or workers ask for it at the same time.
+    Threads of this process wait on a shared future; other workers wait on a lock in the
+    cache and pick the leader's result up from there. Followers give up after
+    API_REQUEST_TIMEOUT seconds and fetch for themselves. If the leader's fetch raises, its
+    followers in this process get a CoalescedFetchError instead.
+    """
+    with in_flight_lock:
+        future = in_flight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = in_flight[key] = Future()
+
+    if not is_leader:
+        try:
+            result = future.result(timeout=cached_config.API_REQUEST_TIMEOUT)
+            record_fetch_role('follower')
+            return result
+        except TimeoutError:
+            record_fetch_role('leader')
+            return fetch()
+        except Exception as e:
+            raise CoalescedFetchError(f"Coalesced fetch of {key} failed") from e
+
+    try:
+        result = coalesce_across_workers(key, fetch)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with in_flight_lock:
+            in_flight.pop(key, None)
+
+
+def coalesce_across_workers(key, fetch):
+    lock_key = f"single_flight:{key}:lock"
+    result_key = f"single_flight:{key}:result"
+
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        record_fetch_role('leader')
+        try:
+            result = fetch()
+            cache.set(result_key, result, timeout=RESULT_TIMEOUT)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + cached_config.API_REQUEST_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        result = cache.get(result_key, MISSING)
+        if result is not MISSING:
+            record_fetch_role('follower')
+            return result
+        if cache.get(lock_key) is None:
+            break
+
+    record_fetch_role('leader')
+    return fetch()
+
+
+async def asingle_flight(key, afetch):
+    """
+    single_flight for coroutines, sharing its in-flight futures so sync and async callers
+    of this process coalesce together. Followers wait without holding a thread and the
+    cache calls of the cross-worker lock are made from worker threads.
+    """
+    with in_flight_lock:
+        future = in_flight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = in_flight[key] = Future()
+    request_timeout = await cached_config.aget('API_REQUEST_TIMEOUT')
+
+    if not is_leader:
+        try:
+            # Shielded, so a follower timing out does not cancel the leader's future.
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=request_timeout)
+            record_fetch_role('follower')
+            return result
+        except TimeoutError:
+            record_fetch_role('leader')
+            return await afetch()
+        except Exception as e:
+            raise CoalescedFetchError(f"Coalesced fetch of {key} failed") from e
+
+    try:
+        result = await acoalesce_across_workers(key, afetch, request_timeout)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with in_flight_lock:
+            in_flight.pop(key, None)
+
+
+async def acoalesce_across_workers(key, afetch, request_timeout):
+    lock_key = f"single_flight:{key}:lock"
+    result_key = f"single_flight:{key}:result"
+
+    if await sync_to_async(cache.add, thread_sensitive=False)(lock_key, 1, timeout=LOCK_TIMEOUT):
+        record_fetch_role('leader')
+        try:
+            result = await afetch()
+            await sync_to_async(cache.set, thread_sensitive=False)(result_key, result, timeout=RESULT_TIMEOUT)
+            return result
+        finally:
+            await sync_to_async(cache.delete, thread_sensitive=False)(lock_key)
+
+    deadline = time.monotonic() + request_timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        result = await sync_to_async(cache.get, thread_sensitive=False)(result_key, MISSING)
+        if result is not MISSING:
+            record_fetch_role('follower')
+            return result
+        if await sync_to_async(cache.get, thread_sensitive=False)(lock_key) is None:
+            break
+
+    record_fetch_role('leader')
+    return await afetch()
@@ -0,0 +1,45 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from main.cache import tiered_cache
+
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def get_currency_version():
+    """
+    Version of the 'currency' cache namespace, bumped on every Currency save or delete.
+    A version is minted when the cache has none, so a flushed cache never brings back an
+    ETag an older currency table was served with.
+    """
+    version = tiered_cache.get_version('currency')
+    if version is None:
+        tiered_cache.invalidate('currency')
+        version = tiered_cache.get_version('currency')
+    return version
+
+
+def conditional_response(request, etag, last_modified=None):
+    """
+    Returns the 304 (or 412) response the request's validators call for, or None when the
+    full response has to be sent.
+    """
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_cache_headers(response, etag, max_age, immutable=False, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    if immutable:
+        patch_cache_control(response, public=True, max_age=max_age, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
@@ -0,0 +1,128 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+
+from main.services import fetch_rate_groups, get_dated_rates, get_latest_rates
+from main.utils import get_currency_registry
+
+
+MAX_BULK_ROWS = 100000
+
+
+class ConversionRow:
+    __slots__ = ('index', 'source_currency', 'target_currency', 'amount', 'valuation_date', 'error')
+
+    def __init__(self, index, source_currency, target_currency, amount, valuation_date, error=None):
+        self.index = index
+        self.source_currency = source_currency
+        self.target_currency = target_currency
+        self.amount = amount
+        self.valuation_date = valuation_date
+        self.error = error
+
+
+def parse_rows(raw_rows, currency_registry):
+    """
+    Validate the raw {source_currency, target_currency, amount, valuation_date?} rows. Rows
+    that cannot be converted keep their error instead of failing the whole batch.
+    """
+    rows = []
+    for index, raw_row in enumerate(raw_rows):
+        source_code = str(raw_row.get('source_currency') or '').strip().upper()
+        target_code = str(raw_row.get('target_currency') or '').strip().upper()
+        raw_date = raw_row.get('valuation_date')
+        row = ConversionRow(index, currency_registry.get(source_code), currency_registry.get(target_code), None, None)
+
+        if row.source_currency is None:
+            row.error = f"Currency with code '{source_code}' does not exist."
+        elif row.target_currency is None:
+            row.error = f"Currency with code '{target_code}' does not exist."
+
+        try:
+            row.amount = Decimal(str(raw_row.get('amount')))
+            if not row.amount.is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            row.error = row.error or "Invalid amount."
+
+        if raw_date:
+            try:
+                row.valuation_date = datetime.strptime(str(raw_date), "%Y-%m-%d").date()
+            except ValueError:
+                row.error = row.error or "Invalid date format."
+
+        rows.append(row)
+    return rows
+
+
+def convert_rows(raw_rows):
+    """
+    Convert every {source_currency, target_currency, amount, valuation_date?} row. Rates are
+    resolved for the whole batch at once: one query for dated rows, one set for latest
+    rates, and provider calls, run concurrently, only for (source, date) groups with nothing
+    stored.
+    """
+    currency_registry = get_currency_registry()
+    rows = parse_rows(raw_rows, currency_registry)
+    valid_rows = [row for row in rows if row.error is None]
+    today = timezone.now().date()
+
+    dated_keys = {
+        (row.source_currency['id'], row.target_currency['id'], row.valuation_date)
+        for row in valid_rows if row.valuation_date
+    }
+    latest_keys = {
+        (row.source_currency['id'], row.target_currency['id'])
+        for row in valid_rows if not row.valuation_date
+    }
+    dated_rates = get_dated_rates(dated_keys)
+    latest_rates = get_latest_rates(latest_keys)
+
+    missing = {}
+    for row in valid_rows:
+        source_id, target_id = row.source_currency['id'], row.target_currency['id']
+        if row.valuation_date:
+            is_missing = (source_id, target_id, row.valuation_date) not in dated_rates
+        else:
+            is_missing = (source_id, target_id) not in latest_rates
+        if is_missing:
+            missing.setdefault((row.source_currency['code'], row.valuation_date or today), set()).add(row.target_currency['code'])
+    fetched_rates = {}
+    for (source_code, valuation_date), rates in fetch_rate_groups(
+        {group: sorted(target_codes) for group, target_codes in missing.items()}
+    ).items():
+        fetched_rates.update({(source_code, code, valuation_date): rate for code, rate in rates.items()})
+
+    results = []
+    for row in rows:
+        result = {
+            'source_currency': row.source_currency['code'] if row.source_currency else None,
+            'target_currency': row.target_currency['code'] if row.target_currency else None,
+            'amount': str(row.amount) if row.amount is not None else None,
+            'valuation_date': None,
+            'rate_value': "N/A",
+            'converted_amount': "N/A",
+        }
+        if row.error is None:
+            source_id, target_id = row.source_currency['id'], row.target_currency['id']
+            if row.valuation_date:
+                rate_date = row.valuation_date
+                rate = dated_rates.get((source_id, target_id, rate_date))
+            else:
+                rate_date, rate = latest_rates.get((source_id, target_id), (today, None))
+            if rate is None:
+                rate = fetched_rates.get((row.source_currency['code'], row.target_currency['code'], rate_date))
+
+            if rate is None:
+                row.error = "Unable to fetch exchange rate"
+            else:
+                result.update({
+                    'valuation_date': rate_date.isoformat(),
+                    'rate_value': str(round(rate, 6)),
+                    'converted_amount': str(round(row.amount * rate, 2)),
+                })
+        result['error'] = row.error
+        results.append(result)
+
+    return results
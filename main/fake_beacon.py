@@ -0,0 +1,121 @@
+import hashlib
+import json
+import random
+import threading
+import time
+
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from main.iso4217 import ISO_4217_CODES
+
+
+class FakeCurrencyBeaconServer:
+    """
+    Local stand-in for the CurrencyBeacon API serving /latest, /historical and /timeseries
+    with deterministic rates, for benchmarks and local runs without an API key.
+
+    latency is added to every response (seconds), error_rate is the share of requests
+    answered with a 500, and symbol_count is how many currencies the snapshot publishes.
+    Every request is counted per path in calls.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, symbol_count=30, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.symbols = sorted(ISO_4217_CODES)[:symbol_count]
+        self.random = random.Random(seed)
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def start(self):
+        handler = type('FakeCurrencyBeaconHandler', (FakeCurrencyBeaconHandler,), {'fake': self})
+        self.server = FakeHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, path):
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            return self.random.random() < self.error_rate
+
+    def get_calls(self):
+        with self.lock:
+            return dict(self.calls)
+
+    @staticmethod
+    def get_rate(base_currency, symbol, valuation_date):
+        if base_currency == symbol:
+            return 1.0
+        digest = hashlib.md5(f"{base_currency}:{symbol}:{valuation_date}".encode()).digest()
+        return round(0.5 + int.from_bytes(digest[:4], 'big') / 2 ** 32 * 100, 6)
+
+    def get_rates(self, base_currency, symbols, valuation_date):
+        return {symbol: self.get_rate(base_currency, symbol, valuation_date) for symbol in symbols}
+
+    def respond(self, path, params):
+        base_currency = params.get('base', 'USD')
+        symbols = [symbol for symbol in params.get('symbols', '').split(',') if symbol] or self.symbols
+        symbols = [symbol for symbol in symbols if symbol in self.symbols]
+
+        if path.endswith('/timeseries'):
+            start_date = date.fromisoformat(params['start_date'])
+            end_date = date.fromisoformat(params['end_date'])
+            response = {}
+            while start_date <= end_date:
+                response[start_date.isoformat()] = self.get_rates(base_currency, symbols, start_date.isoformat())
+                start_date += timedelta(days=1)
+            return response
+
+        if path.endswith('/historical'):
+            valuation_date = params['date']
+        elif path.endswith('/latest'):
+            valuation_date = date.today().isoformat()
+        else:
+            return None
+        return {'date': valuation_date, 'base': base_currency, 'rates': self.get_rates(base_currency, symbols, valuation_date)}
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+
+class FakeCurrencyBeaconHandler(BaseHTTPRequestHandler):
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        failed = self.fake.count(url.path)
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+
+        response = None if failed else self.fake.respond(url.path, params)
+        if failed:
+            self.send_json(500, {'meta': {'code': 500, 'error_type': 'server_error'}})
+        elif response is None:
+            self.send_json(404, {'meta': {'code': 404, 'error_type': 'not_found'}})
+        else:
+            self.send_json(200, {'meta': {'code': 200}, 'response': response})
+
+    def send_json(self, status_code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
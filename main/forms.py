@@ -1,16 +1,33 @@
 from django import forms
-from main.models import Currency
+from main.utils import get_currency_registry
 
 class CurrencyConverterForm(forms.Form):
-    source_currency = forms.ModelChoiceField(queryset=Currency.objects.all(), label="Source Currency")
-    target_currencies = forms.ModelMultipleChoiceField(queryset=Currency.objects.all(), label="Target Currencies")
+    source_currency = forms.TypedChoiceField(coerce=int, label="Source Currency")
+    target_currencies = forms.TypedMultipleChoiceField(coerce=int, label="Target Currencies")
     amount = forms.DecimalField(max_digits=12, decimal_places=2, label="Amount to Convert")
 
     def __init__(self, *args, **kwargs):
         super(CurrencyConverterForm, self).__init__(*args, **kwargs)
+        # Choices come from the cached currency registry, so neither rendering nor
+        # validating the form queries the database. Cleaned currencies are registry entries.
+        self.currencies_by_id = {currency['id']: currency for currency in get_currency_registry().values()}
+        source_currency_id = None
         if 'source_currency' in self.data:
             try:
                 source_currency_id = int(self.data.get('source_currency'))
-                self.fields['target_currencies'].queryset = Currency.objects.exclude(id=source_currency_id)
             except (ValueError, TypeError):
                 pass
+
+        self.fields['source_currency'].choices = [('', '---------')] + [
+            (currency_id, currency['code']) for currency_id, currency in self.currencies_by_id.items()
+        ]
+        self.fields['target_currencies'].choices = [
+            (currency_id, currency['name']) for currency_id, currency in self.currencies_by_id.items()
+            if currency_id != source_currency_id
+        ]
+
+    def clean_source_currency(self):
+        return self.currencies_by_id[self.cleaned_data['source_currency']]
+
+    def clean_target_currencies(self):
+        return [self.currencies_by_id[currency_id] for currency_id in self.cleaned_data['target_currencies']]
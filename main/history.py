@@ -0,0 +1,268 @@
+from asgiref.sync import sync_to_async
+from datetime import datetime, timedelta
+
+from django.db.models import Count, Exists, OuterRef
+from django.utils import timezone
+
+from main.cache import cached_config
+from main.models import Currency, CurrencyExchangeRate, MissingExchangeRate
+from main.providers.provider_manager import ProviderManager
+from main.series_store import iter_slice_windows, series_store
+from main.utils import get_currency_registry, get_date_windows, save_timeseries_rates
+
+
+# Missing dates closer together than this are fetched in one timeseries call; re-reading a
+# few stored days is cheaper than another upstream round-trip. Stored rates are never
+# overwritten by what comes back for them.
+GAP_MERGE_DAYS = 7
+
+
+def parse_symbols(symbols):
+    """
+    Accepts a comma separated string or a list of codes; None or empty means every symbol.
+    """
+    if not symbols:
+        return None
+    if isinstance(symbols, str):
+        symbols = symbols.split(',')
+    return sorted({symbol.strip().upper() for symbol in symbols if symbol.strip()})
+
+
+def get_expected_symbols(source_currency, symbols):
+    if symbols:
+        return set(symbols)
+    return set(Currency.objects.exclude(code=source_currency).values_list('code', flat=True))
+
+
+def get_stored_queryset(source_currency, from_date, to_date, symbols=None):
+    queryset = CurrencyExchangeRate.objects.filter(
+        source_currency__code=source_currency,
+        valuation_date__range=(from_date, to_date)
+    )
+    if symbols:
+        queryset = queryset.filter(exchanged_currency__code__in=symbols)
+    return queryset
+
+
+def get_missing_queryset(source_currency, from_date, to_date, symbols=None):
+    """
+    MissingExchangeRate markers of the range, leaving out those a rate was stored for since.
+    """
+    queryset = MissingExchangeRate.objects.filter(
+        source_currency__code=source_currency,
+        valuation_date__range=(from_date, to_date)
+    ).exclude(Exists(CurrencyExchangeRate.objects.filter(
+        source_currency=OuterRef('source_currency'),
+        exchanged_currency=OuterRef('exchanged_currency'),
+        valuation_date=OuterRef('valuation_date')
+    )))
+    if symbols:
+        queryset = queryset.filter(exchanged_currency__code__in=symbols)
+    return queryset
+
+
+def get_incomplete_dates(source_currency, from_date, to_date, symbols, expected_symbols):
+    """
+    Returns {date: stored codes} for every date in the range missing an expected symbol,
+    codes marked missing counting as stored. Complete dates are only counted, never
+    loaded, so the check stays cheap on long ranges.
+    """
+    queryset = get_stored_queryset(source_currency, from_date, to_date, symbols)
+    missing_queryset = get_missing_queryset(source_currency, from_date, to_date, symbols)
+    stored_counts = dict(
+        queryset.order_by().values('valuation_date').annotate(stored=Count('id')).values_list('valuation_date', 'stored')
+    )
+    for valuation_date, missing in missing_queryset.order_by().values('valuation_date').annotate(
+        missing=Count('id')
+    ).values_list('valuation_date', 'missing'):
+        stored_counts[valuation_date] = stored_counts.get(valuation_date, 0) + missing
+
+    partial_dates = [
+        valuation_date for valuation_date, stored in stored_counts.items()
+        if stored < len(expected_symbols)
+    ]
+    incomplete_dates = {valuation_date: set() for valuation_date in partial_dates}
+    if partial_dates:
+        for stored_queryset in (queryset, missing_queryset):
+            for valuation_date, code in stored_queryset.filter(valuation_date__in=partial_dates).values_list(
+                'valuation_date', 'exchanged_currency__code'
+            ):
+                incomplete_dates[valuation_date].add(code)
+
+    valuation_date = from_date
+    while valuation_date <= to_date:
+        if valuation_date not in stored_counts:
+            incomplete_dates[valuation_date] = set()
+        valuation_date += timedelta(days=1)
+
+    return incomplete_dates
+
+
+def get_missing_ranges(incomplete_dates, expected_symbols):
+    """
+    Groups the incomplete dates into [start, end, symbols] ranges to fetch. symbols is None
+    when the whole snapshot is wanted.
+    """
+    missing_ranges = []
+
+    for valuation_date in sorted(incomplete_dates):
+        missing_symbols = expected_symbols - incomplete_dates[valuation_date] if expected_symbols else None
+
+        last_range = missing_ranges[-1] if missing_ranges else None
+        if last_range and (valuation_date - last_range[1]).days <= GAP_MERGE_DAYS:
+            last_range[1] = valuation_date
+            if last_range[2] is not None:
+                last_range[2] = None if missing_symbols is None else last_range[2] | missing_symbols
+        else:
+            missing_ranges.append([valuation_date, valuation_date, missing_symbols])
+
+    return missing_ranges
+
+
+def get_new_rates(incomplete_dates, fetched_rates):
+    """
+    Drops every fetched (date, code) already stored, past rates being immutable.
+    """
+    new_rates = {}
+    for date, rates in fetched_rates.items():
+        stored_codes = incomplete_dates.get(datetime.strptime(date, "%Y-%m-%d").date())
+        if stored_codes is None:
+            continue
+        rates = {code: rate for code, rate in rates.items() if rate is not None and code not in stored_codes}
+        if rates:
+            new_rates[date] = rates
+    return new_rates
+
+
+def remember_missing_rates(source_currency, incomplete_dates, expected_symbols, fetched_codes, from_date, to_date,
+                           unanswered_ranges=()):
+    """
+    Marks the expected symbols the providers left out on the incomplete past dates of the
+    range, so they are not asked for again. Dates of the unanswered ranges are left alone.
+    """
+    last_date = min(to_date, timezone.now().date() - timedelta(days=1))
+    currency_registry = get_currency_registry()
+    source_currency_data = currency_registry.get(source_currency)
+    if source_currency_data is None:
+        return
+
+    MissingExchangeRate.objects.bulk_create([
+        MissingExchangeRate(
+            source_currency_id=source_currency_data['id'],
+            exchanged_currency_id=currency_registry[code]['id'],
+            valuation_date=valuation_date
+        )
+        for valuation_date, stored_codes in incomplete_dates.items() if from_date <= valuation_date <= last_date
+        if not any(range_from <= valuation_date <= range_to for range_from, range_to in unanswered_ranges)
+        for code in expected_symbols - stored_codes - fetched_codes.get(valuation_date, set())
+        if code in currency_registry
+    ], ignore_conflicts=True)
+
+
+def fill_timeseries_gaps(source_currency, from_date, to_date, symbols=None):
+    """
+    Fetch and store whatever the stored history lacks for the range, with one provider
+    call per gap (a /historical call when the gap is a single date). Every date up to the
+    last one returned was answered, bar the ranges no provider did; the expected symbols
+    missing on those past dates are remembered as MissingExchangeRate markers.
+    """
+    symbols = parse_symbols(symbols)
+    expected_symbols = get_expected_symbols(source_currency, symbols)
+    incomplete_dates = get_incomplete_dates(source_currency, from_date, to_date, symbols, expected_symbols)
+    provider_manager = ProviderManager.get_instance()
+
+    for start_date, end_date, missing_symbols in get_missing_ranges(incomplete_dates, expected_symbols):
+        missing_symbols = sorted(missing_symbols) if missing_symbols else None
+        unanswered_ranges = []
+
+        if start_date == end_date:
+            rates = provider_manager.get_historical_rates(source_currency, start_date, missing_symbols)
+            fetched_windows = [{start_date.isoformat(): rates}] if rates else []
+        else:
+            fetched_windows = provider_manager.iter_timeseries_rates(
+                source_currency, start_date, end_date, missing_symbols, unanswered_ranges
+            )
+
+        fetched_codes = {}
+        for fetched_rates in fetched_windows:
+            new_rates = get_new_rates(incomplete_dates, fetched_rates)
+            if new_rates:
+                save_timeseries_rates(source_currency, new_rates)
+            for valuation_date, rates in fetched_rates.items():
+                fetched_codes[datetime.strptime(valuation_date, "%Y-%m-%d").date()] = {
+                    code for code, rate in rates.items() if rate is not None
+                }
+
+        if fetched_codes:
+            remember_missing_rates(
+                source_currency, incomplete_dates, expected_symbols, fetched_codes, start_date, max(fetched_codes),
+                unanswered_ranges
+            )
+
+
+def iter_stored_timeseries(source_currency, from_date, to_date, symbols=None):
+    """
+    Yields one {date string: {code: Decimal}} window per stored date, in date order, sliced
+    from the in-process series store rather than read row by row.
+    """
+    slices = series_store.get_slices(source_currency, from_date, to_date, parse_symbols(symbols))
+    return iter_slice_windows(slices)
+
+
+async def aiter_stored_timeseries(source_currency, from_date, to_date, symbols=None):
+    """
+    Async iter_stored_timeseries: only loading and refreshing the store needs a thread.
+    """
+    slices = await sync_to_async(series_store.get_slices)(source_currency, from_date, to_date, parse_symbols(symbols))
+    for window in iter_slice_windows(slices):
+        yield window
+
+
+def get_stream_chunks(from_date, to_date):
+    """
+    Splits the range, capped at today, into chunks of TIMESERIES_MAX_WORKERS provider
+    windows, so filling one chunk keeps every timeseries worker busy.
+    """
+    chunk_days = cached_config.TIMESERIES_WINDOW_DAYS * cached_config.TIMESERIES_MAX_WORKERS
+    return get_date_windows(from_date, min(to_date, timezone.now().date()), chunk_days)
+
+
+def iter_timeseries_rates(source_currency, from_date, to_date, symbols=None):
+    """
+    Stream the range a chunk of provider windows at a time: each chunk's gaps are filled,
+    its windows fetched concurrently, then its stored dates yielded from the series store
+    before the next chunk is fetched. The first bytes of a streamed response thus only wait
+    on the first chunk.
+    """
+    for chunk_from, chunk_to in get_stream_chunks(from_date, to_date):
+        fill_timeseries_gaps(source_currency, chunk_from, chunk_to, symbols)
+        yield from iter_stored_timeseries(source_currency, chunk_from, chunk_to, symbols)
+
+
+async def aiter_timeseries_rates(source_currency, from_date, to_date, symbols=None):
+    """
+    Async iter_timeseries_rates.
+    """
+    for chunk_from, chunk_to in await sync_to_async(get_stream_chunks)(from_date, to_date):
+        await sync_to_async(fill_timeseries_gaps)(source_currency, chunk_from, chunk_to, symbols)
+        async for window in aiter_stored_timeseries(source_currency, chunk_from, chunk_to, symbols):
+            yield window
+
+
+def get_timeseries_rates(source_currency, from_date, to_date, symbols=None):
+    """
+    Returns {date string: {code: Decimal}} in date order for the range.
+    """
+    timeseries = {}
+    for window in iter_timeseries_rates(source_currency, from_date, to_date, symbols):
+        timeseries.update(window)
+    return timeseries
+
+
+def get_historical_rates(source_currency, valuation_date, symbols=None):
+    """
+    Returns {code: Decimal} for valuation_date, asking the providers only for the symbols
+    not stored yet. Stored past rates are never re-fetched.
+    """
+    timeseries = get_timeseries_rates(source_currency, valuation_date, valuation_date, symbols)
+    return timeseries.get(valuation_date.isoformat(), {})
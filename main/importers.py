@@ -0,0 +1,182 @@
+import csv
+import gzip
+import json
+import re
+
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+
+# Streaming readers for rate history files. Every reader yields records, one per input
+# row or JSON element, each a list of (base, code, date string, rate string) tuples: a
+# long-format row gives one rate, a wide row (ECB) or a provider snapshot gives many.
+# Only the current record and the read buffer are held in memory.
+
+IMPORT_FORMATS = ('csv', 'ndjson', 'json')
+READ_SIZE = 1 << 16
+JSON_SEPARATORS = re.compile(r'[\s,]*')
+MISSING_VALUES = ('', 'N/A', 'NA', 'NULL', 'NONE')
+
+LONG_COLUMNS = {
+    'base': ('base', 'source_currency', 'source', 'from'),
+    'code': ('currency', 'target_currency', 'exchanged_currency', 'symbol', 'to'),
+    'date': ('date', 'valuation_date'),
+    'rate': ('rate', 'rate_value', 'value'),
+}
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = name.rsplit('.', 1)[-1].lower()
+    if extension in ('ndjson', 'jsonl'):
+        return 'ndjson'
+    if extension in IMPORT_FORMATS:
+        return extension
+    return None
+
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8-sig', newline='')
+    return open(path, encoding='utf-8-sig', newline='')
+
+
+def iter_records(stream, file_format, base=None):
+    if file_format == 'csv':
+        return iter_csv_records(stream, base)
+    if file_format == 'ndjson':
+        return (get_element_rates(json.loads(line, parse_float=Decimal), base) for line in stream if line.strip())
+    return iter_json_records(stream, base)
+
+
+def get_column(columns, name):
+    for alias in LONG_COLUMNS[name]:
+        if alias in columns:
+            return columns.index(alias)
+    return None
+
+
+def iter_csv_records(stream, base=None):
+    """
+    Long format has a rate column (and base, currency and date columns, base defaulting to
+    the --base option); anything else is read as wide format, the ECB layout: a date
+    column followed by one column per currency quoted against base.
+    """
+    reader = csv.reader(stream)
+    header = [column.strip() for column in next(reader, [])]
+    columns = [column.lower() for column in header]
+    rate_index = get_column(columns, 'rate')
+
+    if rate_index is not None:
+        base_index, code_index, date_index = (get_column(columns, name) for name in ('base', 'code', 'date'))
+        if code_index is None or date_index is None or (base_index is None and not base):
+            raise ValueError(f"Missing columns in CSV header: {', '.join(header)}")
+        for row in reader:
+            if not row:
+                continue
+            row_base = row[base_index] if base_index is not None else base
+            yield [(row_base, row[code_index], row[date_index], row[rate_index])]
+        return
+
+    if not base:
+        raise ValueError("Wide CSV files need the base currency (--base)")
+    codes = [column.upper() for column in header[1:]]
+    for row in reader:
+        if row:
+            yield [(base, code, row[0], rate) for code, rate in zip(codes, row[1:]) if code]
+
+
+def iter_json_records(stream, base=None):
+    """
+    A JSON array is decoded one element at a time with raw_decode over a sliding buffer. A
+    single object (a provider snapshot or timeseries dump) is small enough to load whole.
+    """
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    buffer = stream.read(READ_SIZE)
+    pos = JSON_SEPARATORS.match(buffer).end()
+    if buffer[pos:pos + 1] == '{':
+        yield from get_dump_records(json.loads(buffer + stream.read(), parse_float=Decimal), base)
+        return
+    if buffer[pos:pos + 1] != '[':
+        raise ValueError("Expected a JSON array or object")
+
+    pos += 1
+    eof = False
+    while True:
+        pos = JSON_SEPARATORS.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unterminated JSON array")
+            buffer, pos = stream.read(READ_SIZE), 0
+            eof = not buffer
+            continue
+        if buffer[pos] == ']':
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+            # A number at the very end of the buffer may continue in the next read.
+            complete = end < len(buffer) or eof
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError(f"Invalid JSON element at: {buffer[pos:pos + 80]!r}")
+            complete = False
+        if not complete:
+            chunk = stream.read(READ_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        yield get_element_rates(element, base)
+        pos = end
+
+
+def get_element_rates(element, base=None):
+    """
+    Rates of one JSON element: a snapshot ({"base", "date", "rates": {code: rate}}) or a
+    long-format row with the same keys as the CSV columns.
+    """
+    if not isinstance(element, dict):
+        raise ValueError(f"Expected a JSON object, got: {element!r}")
+    if isinstance(element.get('rates'), dict):
+        element_base = element.get('base') or base
+        return [(element_base, code, element.get('date'), rate) for code, rate in element['rates'].items()]
+
+    keys = {key.lower(): value for key, value in element.items()}
+    values = {}
+    for name, aliases in LONG_COLUMNS.items():
+        values[name] = next((keys[alias] for alias in aliases if alias in keys), None)
+    return [(values['base'] or base, values['code'], values['date'], values['rate'])]
+
+
+def get_dump_records(dump, base=None):
+    """
+    Records of a single JSON object: a snapshot, or a timeseries dump whose "rates" (or
+    "response", as CurrencyBeacon returns it) maps dates to {code: rate}.
+    """
+    if isinstance(dump.get('response'), dict) and 'rates' in dump['response']:
+        dump = dump['response']
+    dump_base = dump.get('base') or base
+    series = dump.get('response') if isinstance(dump.get('response'), dict) else dump.get('rates')
+    if isinstance(series, dict) and series and all(isinstance(rates, dict) for rates in series.values()):
+        for valuation_date, rates in series.items():
+            yield [(dump_base, code, valuation_date, rate) for code, rate in rates.items()]
+    else:
+        yield get_element_rates(dump, base)
+
+
+def parse_rate(base, code, valuation_date, rate):
+    """
+    Returns (base, code, date, Decimal) from raw record values, or None when a value is
+    missing or invalid, e.g. the N/A of currencies the ECB no longer quotes.
+    """
+    if not base or not code or not valuation_date or rate is None or str(rate).strip().upper() in MISSING_VALUES:
+        return None
+    try:
+        rate = Decimal(str(rate).strip())
+        valuation_date = date.fromisoformat(str(valuation_date).strip()[:10])
+    except (InvalidOperation, ValueError):
+        return None
+    if not rate.is_finite() or rate <= 0:
+        return None
+    return str(base).strip().upper(), str(code).strip().upper(), valuation_date, rate
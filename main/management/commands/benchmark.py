@@ -0,0 +1,221 @@
+import json
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from constance import config
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.utils import timezone
+
+from main.cache import tiered_cache
+from main.fake_beacon import FakeCurrencyBeaconServer
+from main.models import Currency, CurrencyExchangeRate, Provider
+from main.providers.provider_manager import ProviderManager
+from main.rate_engine import rate_engine
+from main.series_store import series_store
+
+
+SCENARIOS = ['currencies', 'exchange_rate', 'converter', 'timeseries']
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the rate endpoints against a local fake CurrencyBeacon server in a throwaway "
+        "test database and print a JSON report per scenario and concurrency level."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated scenarios to run')
+        parser.add_argument('--concurrency', default='1,8,32', help='Comma separated concurrency levels')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and concurrency level')
+        parser.add_argument('--latency', type=float, default=0.05, help='Fake upstream latency in seconds')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of upstream requests failing with a 500')
+        parser.add_argument('--symbols', type=int, default=30, help='Currencies published by the fake upstream')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            self.stderr.write(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+            return
+        concurrency_levels = [int(level) for level in options['concurrency'].split(',')]
+
+        self.fake = FakeCurrencyBeaconServer(
+            latency=options['latency'], error_rate=options['error_rate'], symbol_count=options['symbols']
+        ).start()
+        setup_test_environment()
+        old_database_name = self.create_test_database()
+        try:
+            results = [
+                self.run_scenario(scenario, concurrency, options['requests'])
+                for scenario in scenarios
+                for concurrency in concurrency_levels
+            ]
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            self.fake.stop()
+
+        report = json.dumps({
+            'settings': {
+                'requests': options['requests'],
+                'latency': options['latency'],
+                'error_rate': options['error_rate'],
+                'symbols': options['symbols'],
+                'database': connection.vendor,
+                'cache': settings.CACHES['default']['BACKEND'],
+            },
+            'results': results,
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(report)
+        else:
+            self.stdout.write(report)
+
+    def create_test_database(self):
+        # A file, not SQLite's shared in-memory database, which locks whole tables
+        # under concurrent writers.
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            connection.settings_dict['TEST']['NAME'] = f"benchmark_{uuid.uuid4().hex}.sqlite3"
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        return old_database_name
+
+    @contextmanager
+    def isolated_state(self):
+        """
+        Every run starts with no stored rates, empty in-process caches and its own cache key
+        prefix, so runs are comparable and the real cache is never read or written.
+        """
+        cache_settings = {**settings.CACHES['default'], 'KEY_PREFIX': f"benchmark-{uuid.uuid4().hex}"}
+        with override_settings(CACHES={**settings.CACHES, 'default': cache_settings}):
+            # constance keeps a reference to the cache it was created with.
+            config._setup()
+            tiered_cache.clear_local()
+            rate_engine.snapshots.clear()
+            series_store.clear()
+            ProviderManager._instance = None
+
+            CurrencyExchangeRate.objects.all().delete()
+            Provider.objects.all().delete()
+            Currency.objects.all().delete()
+            Currency.objects.bulk_create([Currency(code=code, name=code) for code in self.fake.symbols])
+            Provider.objects.create(
+                name='fake-currency-beacon', class_path='main.providers.currency_beacon.CurrencyBeaconProvider', priority=1
+            )
+            config.BEACON_BASE_URL = self.fake.base_url
+            config.CURRENCY_BEACON_API_KEY = 'benchmark'
+            yield
+        config._setup()
+
+    def run_scenario(self, scenario, concurrency, request_count):
+        send_request = getattr(self, f'request_{scenario}')
+
+        def run_worker(indexes):
+            client = Client()
+            samples = []
+            try:
+                for index in indexes:
+                    with CaptureQueriesContext(connection) as queries:
+                        started_at = time.perf_counter()
+                        response = send_request(client, index)
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                        elapsed = time.perf_counter() - started_at
+                    samples.append((elapsed, len(queries), response.status_code))
+            finally:
+                connection.close()
+            return samples
+
+        with self.isolated_state():
+            calls_before = self.fake.get_calls()
+            started_at = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                worker_samples = list(executor.map(
+                    run_worker, [range(worker, request_count, concurrency) for worker in range(concurrency)]
+                ))
+            duration = time.perf_counter() - started_at
+            calls_after = self.fake.get_calls()
+
+        samples = [sample for samples in worker_samples for sample in samples]
+        latencies = sorted(elapsed for elapsed, _, _ in samples)
+        query_count = sum(queries for _, queries, _ in samples)
+        upstream_calls = {
+            path: calls_after[path] - calls_before.get(path, 0)
+            for path in calls_after if calls_after[path] - calls_before.get(path, 0)
+        }
+
+        return {
+            'scenario': scenario,
+            'concurrency': concurrency,
+            'requests': len(samples),
+            'errors': sum(1 for _, _, status_code in samples if status_code >= 400),
+            'duration_s': round(duration, 4),
+            'throughput_rps': round(len(samples) / duration, 2) if duration else None,
+            'latency_ms': {
+                'p50': get_percentile(latencies, 50),
+                'p95': get_percentile(latencies, 95),
+                'p99': get_percentile(latencies, 99),
+                'max': round(latencies[-1] * 1000, 3) if latencies else None,
+            },
+            'db_queries': {
+                'total': query_count,
+                'per_request': round(query_count / len(samples), 2) if samples else None,
+            },
+            'upstream_calls': {
+                'total': sum(upstream_calls.values()),
+                'by_path': upstream_calls,
+            },
+        }
+
+    def request_currencies(self, client, index):
+        if index % 2:
+            return client.get(f"/api/currencies/{self.fake.symbols[index % len(self.fake.symbols)]}/")
+        return client.get('/api/currencies/')
+
+    def request_exchange_rate(self, client, index):
+        symbols = self.fake.symbols
+        source_currency = symbols[index % 3]
+        exchanged_currency = symbols[(index // 3 + 3) % len(symbols)]
+        if index % 3 == 2:
+            valuation_date = timezone.now().date() - timedelta(days=1 + index % 30)
+            return client.get(f"/api/exchange-rate/{source_currency}/{exchanged_currency}/{valuation_date.isoformat()}/")
+        return client.get(f"/api/exchange-rate/{source_currency}/{exchanged_currency}/")
+
+    def request_converter(self, client, index):
+        symbols = self.fake.symbols
+        body = {
+            'source_currency': symbols[index % 3],
+            'target_currencies': symbols[3:13],
+            'amount': str(100 + index),
+        }
+        return client.post('/api/converter/', json.dumps(body), content_type='application/json')
+
+    def request_timeseries(self, client, index):
+        to_date = timezone.now().date() - timedelta(days=1 + index % 10)
+        body = {
+            'source_currency': self.fake.symbols[index % 3],
+            'from_date': (to_date - timedelta(days=29)).isoformat(),
+            'to_date': to_date.isoformat(),
+            'symbols': ','.join(self.fake.symbols[3:8]),
+        }
+        return client.generic('GET', '/api/currency-rates-list/', json.dumps(body), content_type='application/json')
+
+
+def get_percentile(sorted_values, percentile):
+    """
+    Nearest-rank percentile of an ascending list, in milliseconds.
+    """
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(percentile / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[rank] * 1000, 3)
@@ -0,0 +1,135 @@
+import json
+import os
+import time
+
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.cache import tiered_cache
+from main.importers import IMPORT_FORMATS, detect_format, iter_records, open_text, parse_rate
+from main.iso4217 import ISO_4217_CODES
+from main.models import Currency
+from main.utils import get_or_create_currencies, quantize_rate, upsert_rate_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Import rate history from a CSV (long or ECB wide format), NDJSON or JSON file, "
+        "optionally gzipped, in chunks of one transaction each. Existing rates are updated. "
+        "An interrupted import continues from its last committed chunk with --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Input format (default: from the file extension)')
+        parser.add_argument('--base', help='Base currency of rows without one, e.g. EUR for the ECB history file')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Input records per transaction')
+        parser.add_argument('--resume', action='store_true', help='Skip the records committed by a previous run')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or detect_format(path)
+        if file_format is None:
+            raise CommandError("Unable to tell the format from the file name; pass --format")
+        if not os.path.exists(path):
+            raise CommandError(f"No such file: {path}")
+        base = options['base'].upper() if options['base'] else None
+        chunk_size = max(1, options['chunk_size'])
+
+        checkpoint_path = f"{path}.checkpoint"
+        skip_records = self.read_checkpoint(checkpoint_path, path) if options['resume'] else 0
+        if skip_records:
+            self.stdout.write(f"Resuming after {skip_records} records")
+
+        self.currency_ids = dict(Currency.objects.values_list('code', 'id'))
+        imported = skipped = 0
+        committed_records = skip_records
+        started_at = time.perf_counter()
+
+        try:
+            with open_text(path) as stream:
+                records = islice(iter_records(stream, file_format, base), skip_records, None)
+                while True:
+                    chunk = list(islice(records, chunk_size))
+                    if not chunk:
+                        break
+                    with transaction.atomic():
+                        chunk_imported, chunk_skipped = self.import_chunk(chunk)
+                    committed_records += len(chunk)
+                    self.write_checkpoint(checkpoint_path, path, committed_records)
+
+                    imported += chunk_imported
+                    skipped += chunk_skipped
+                    elapsed = time.perf_counter() - started_at
+                    self.stdout.write(
+                        f"{committed_records} records, {imported} rates imported, {skipped} skipped, "
+                        f"{imported / elapsed:,.0f} rates/s"
+                    )
+        except (ValueError, UnicodeDecodeError) as e:
+            raise CommandError(f"Import stopped after {committed_records} records: {e}")
+        finally:
+            # Rates were written behind the cache's back.
+            tiered_cache.invalidate('exchange_rate')
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} rates from {committed_records - skip_records} records in {elapsed:.1f}s "
+            f"({skipped} skipped)"
+        ))
+
+    def import_chunk(self, records):
+        """
+        Upsert the rates of a chunk of records. Rates repeated within the chunk keep their
+        last value, as a single upsert cannot update the same row twice.
+        """
+        rates = {}
+        skipped = 0
+        for record in records:
+            for raw_rate in record:
+                rate = parse_rate(*raw_rate)
+                if rate is None:
+                    skipped += 1
+                    continue
+                base, code, valuation_date, value = rate
+                rates[(base, code, valuation_date)] = value
+
+        unknown_codes = {
+            currency_code for base, code, _ in rates for currency_code in (base, code)
+            if currency_code not in self.currency_ids and currency_code in ISO_4217_CODES
+        }
+        if unknown_codes:
+            currencies = get_or_create_currencies(unknown_codes)
+            self.currency_ids.update({code: currency.id for code, currency in currencies.items()})
+
+        rows = []
+        for (base, code, valuation_date), value in rates.items():
+            source_id, target_id = self.currency_ids.get(base), self.currency_ids.get(code)
+            if source_id is None or target_id is None or source_id == target_id:
+                skipped += 1
+                continue
+            rows.append((source_id, target_id, valuation_date, quantize_rate(value)))
+        upsert_rate_rows(rows)
+        return len(rows), skipped
+
+    def read_checkpoint(self, checkpoint_path, path):
+        if not os.path.exists(checkpoint_path):
+            return 0
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get('size') != os.path.getsize(path):
+            raise CommandError(f"{path} changed since the checkpoint was written; delete {checkpoint_path} to start over")
+        return checkpoint['records']
+
+    def write_checkpoint(self, checkpoint_path, path, records):
+        """
+        Written after each commit and swapped in atomically. A crash between the two only
+        re-imports one chunk, which the upsert makes harmless.
+        """
+        temporary_path = f"{checkpoint_path}.tmp"
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump({'records': records, 'size': os.path.getsize(path)}, checkpoint_file)
+        os.replace(temporary_path, checkpoint_path)
@@ -0,0 +1,154 @@
+import threading
+import time
+
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from main.cache import tiered_cache
+
+
+# Per-process metrics in the Prometheus text format. Recording is a dict lookup and an
+# increment under a lock, cheap enough to leave on in production; every worker process
+# exposes its own counters, so scrape each one (or sum them) as with any multi-process app.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+request_stats = ContextVar('request_stats', default=None)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def format_labels(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            values = dict(self.values)
+        lines.extend(self.render_samples(values))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render_samples(self, values):
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{self.format_labels(labels)} {value}"
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def render_samples(self, values):
+        for labels, (bucket_counts, count, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{self.format_labels(labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{self.format_labels(labels, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_count{self.format_labels(labels)} {count}"
+            yield f"{self.name}_sum{self.format_labels(labels)} {total}"
+
+
+registry = []
+
+upstream_latency = Histogram(
+    'rates_upstream_request_seconds', 'Latency of calls to rate providers.', ('provider', 'method', 'status')
+)
+provider_fallbacks = Counter(
+    'rates_provider_fallbacks_total', 'Calls made to a provider after a higher-priority one did not answer in full.',
+    ('provider',)
+)
+circuit_skips = Counter(
+    'rates_circuit_open_skips_total', 'Provider calls skipped because the circuit was open.', ('provider',)
+)
+rate_sources = Counter(
+    'rates_resolved_total', 'Rates resolved by the rate service, by where they came from.', ('source',)
+)
+request_latency = Histogram(
+    'rates_http_request_seconds', 'Request latency per endpoint.', ('endpoint', 'method', 'status')
+)
+request_queries = Histogram(
+    'rates_db_queries_per_request', 'Database queries made per request.', ('endpoint',), buckets=QUERY_COUNT_BUCKETS
+)
+request_query_time = Counter(
+    'rates_db_query_seconds_total', 'Time spent in database queries per endpoint.', ('endpoint',)
+)
+request_errors = Counter(
+    'rates_http_request_errors_total', 'Requests answered with a 500 after an unexpected error.', ('endpoint',)
+)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper attributing every query to the current request, if any.
+    """
+    stats = request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started_at
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+
+    lines.append("# HELP rates_cache_requests_total Tiered cache lookups per tier and result.")
+    lines.append("# TYPE rates_cache_requests_total counter")
+    for tier, counters in sorted(tiered_cache.stats().items()):
+        lines.append(f'rates_cache_requests_total{{tier="{tier}",result="hit"}} {counters["hits"]}')
+        lines.append(f'rates_cache_requests_total{{tier="{tier}",result="miss"}} {counters["misses"]}')
+    return '\n'.join(lines) + '\n'
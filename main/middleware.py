@@ -0,0 +1,158 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+
+from main.coalescing import fetch_role
+from main.metrics import RequestStats, request_latency, request_queries, request_query_time, request_stats
+from main.query_budget import (
+    BUDGETED_STATUS_CODES, QueryLog, check_queries, get_query_budget, get_query_budget_mode, recorded_queries,
+    report_problems
+)
+
+
+class FetchRoleMiddleware:
+    """
+    Report through the X-Rate-Fetch header whether the request led an upstream fetch or
+    followed one already in flight, to verify cache-miss coalescing.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = fetch_role.set(None)
+        try:
+            response = self.get_response(request)
+            role = fetch_role.get()
+            if role:
+                response['X-Rate-Fetch'] = role
+            return response
+        finally:
+            fetch_role.reset(token)
+
+    async def __acall__(self, request):
+        token = fetch_role.set(None)
+        try:
+            response = await self.get_response(request)
+            role = fetch_role.get()
+            if role:
+                response['X-Rate-Fetch'] = role
+            return response
+        finally:
+            fetch_role.reset(token)
+
+
+class MetricsMiddleware:
+    """
+    Record per-endpoint latency and the number and duration of database queries each
+    request made. Endpoints are labelled by URL name to keep the label set bounded.
+    Streamed responses are measured up to the first byte.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started_at)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started_at)
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        resolver_match = getattr(request, 'resolver_match', None)
+        endpoint = (resolver_match.view_name if resolver_match else None) or 'unmatched'
+        request_latency.observe(elapsed, endpoint, request.method, str(response.status_code))
+        request_queries.observe(stats.queries, endpoint)
+        request_query_time.inc(endpoint, amount=stats.query_time)
+
+
+class QueryBudgetMiddleware:
+    """
+    Check each request against the query budget its view declares and flag repeated query
+    shapes; see main.query_budget. Only read responses (200 and 304) that did not have to
+    fetch and store rates are held to the budget. The count is reported in the
+    X-Query-Count header.
+
+    Placed after AuthenticationMiddleware: the session and user are loaded before
+    recording starts, so authenticating a request counts against no view's budget.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.mode = get_query_budget_mode()
+        if self.mode == 'off':
+            raise MiddlewareNotUsed
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if hasattr(request, 'user'):
+            request.user.is_authenticated
+        queries = QueryLog()
+        token = recorded_queries.set(queries)
+        try:
+            response = self.get_response(request)
+        finally:
+            recorded_queries.reset(token)
+        return self.check(request, response, queries)
+
+    async def __acall__(self, request):
+        if hasattr(request, 'auser'):
+            await request.auser()
+        queries = QueryLog()
+        token = recorded_queries.set(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            recorded_queries.reset(token)
+        return self.check(request, response, queries)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func, request.method)
+
+    def check(self, request, response, queries):
+        response['X-Query-Count'] = str(len(queries))
+        budget = getattr(request, 'query_budget', None)
+        if response.status_code not in BUDGETED_STATUS_CODES:
+            budget = None
+        report_problems(check_queries(f"{request.method} {request.path}", queries, budget), self.mode)
+        return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:48
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_exchange_rates(apps, schema_editor):
+    """
+    Keep only the most recently inserted row per (source, exchanged, date) so the unique
+    constraint can be created on databases that already hold duplicates.
+    """
+    CurrencyExchangeRate = apps.get_model('main', 'CurrencyExchangeRate')
+    latest_ids = (
+        CurrencyExchangeRate.objects
+        .values('source_currency', 'exchanged_currency', 'valuation_date')
+        .annotate(latest_id=Max('id'))
+        .values('latest_id')
+    )
+    CurrencyExchangeRate.objects.exclude(id__in=latest_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_exchange_rates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='currencyexchangerate',
+            name='rate_value',
+            field=models.DecimalField(decimal_places=6, max_digits=18),
+        ),
+        migrations.AddIndex(
+            model_name='currencyexchangerate',
+            index=models.Index(fields=['source_currency', 'exchanged_currency', '-valuation_date'], name='exchange_rate_latest_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='currencyexchangerate',
+            constraint=models.UniqueConstraint(fields=('source_currency', 'exchanged_currency', 'valuation_date'), name='unique_exchange_rate_per_date'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:05
+
+from django.db import migrations
+
+
+PREFETCH_TASK_NAME = 'Prefetch daily exchange rate snapshots'
+
+
+def create_prefetch_schedule(apps, schema_editor):
+    """
+    Schedule the snapshot prefetch shortly after the providers publish the new day's rates.
+    The time can be changed afterwards from the Periodic tasks admin.
+    """
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute='5',
+        hour='0',
+        day_of_week='*',
+        day_of_month='*',
+        month_of_year='*',
+        timezone='UTC',
+    )
+    PeriodicTask.objects.get_or_create(
+        name=PREFETCH_TASK_NAME,
+        defaults={'task': 'Prefetch Daily Snapshots', 'crontab': schedule},
+    )
+
+
+def delete_prefetch_schedule(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name=PREFETCH_TASK_NAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_exchange_rate_unique_and_latest_index'),
+        ('django_celery_beat', '0018_improve_crontab_helptext'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefetch_schedule, delete_prefetch_schedule),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_prefetch_daily_snapshots_schedule'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='currencyexchangerate',
+            index=models.Index(fields=['-valuation_date', '-id'], name='exchange_rate_seek_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_exchange_rate_seek_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MissingExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valuation_date', models.DateField()),
+                ('exchanged_currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.currency')),
+                ('source_currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.currency')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('source_currency', 'valuation_date', 'exchanged_currency'), name='unique_missing_rate_per_date')],
+            },
+        ),
+    ]
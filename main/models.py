@@ -18,12 +18,45 @@ class CurrencyExchangeRate(models.Model):
     source_currency = models.ForeignKey(Currency, related_name='exchanges', on_delete=models.CASCADE)
     exchanged_currency = models.ForeignKey(Currency, on_delete=models.CASCADE)
     valuation_date = models.DateField(db_index=True)
-    rate_value = models.DecimalField(max_digits=18, decimal_places=6, db_index=True)
-    
+    rate_value = models.DecimalField(max_digits=18, decimal_places=6)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['source_currency', 'exchanged_currency', 'valuation_date'],
+                name='unique_exchange_rate_per_date'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['source_currency', 'exchanged_currency', '-valuation_date'], name='exchange_rate_latest_idx'),
+            models.Index(fields=['-valuation_date', '-id'], name='exchange_rate_seek_idx'),
+        ]
+
     def __str__(self):
         return f"{self.source_currency} to {self.exchanged_currency} on {self.valuation_date}"
 
 
+class MissingExchangeRate(models.Model):
+    """
+    A past rate the providers answered for without publishing it. Gap filling counts it as
+    stored, so a currency no provider quotes does not make its dates incomplete forever.
+    """
+    source_currency = models.ForeignKey(Currency, related_name='+', on_delete=models.CASCADE)
+    exchanged_currency = models.ForeignKey(Currency, related_name='+', on_delete=models.CASCADE)
+    valuation_date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['source_currency', 'valuation_date', 'exchanged_currency'],
+                name='unique_missing_rate_per_date'
+            ),
+        ]
+
+    def __str__(self):
+        return f"No {self.source_currency} to {self.exchanged_currency} on {self.valuation_date}"
+
+
 class Provider(models.Model):
     name = models.CharField(max_length=100)
     class_path = models.CharField(max_length=255, help_text="Full import path of the provider class (e.g., 'myapp.providers.CurrencyBeaconProvider')")
@@ -0,0 +1,51 @@
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs a full COUNT(*). An unfiltered table reports the planner's
+    row estimate where the database keeps one (PostgreSQL, MySQL); anything else is counted
+    up to COUNT_LIMIT rows, enough to page through while keeping the count bounded.
+    """
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = get_estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None:
+                return estimate
+        return queryset[:self.COUNT_LIMIT].count()
+
+
+def get_estimated_row_count(model, using):
+    """
+    The database's own estimate of the number of rows in model's table, or None when it
+    has none.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql, params = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)", [table]
+    elif connection.vendor == 'mysql':
+        sql, params = (
+            "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+            [table]
+        )
+    else:
+        return None
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError as e:
+        print(f"Unable to estimate the row count of {table}: {e}")
+        return None
+    # reltuples is -1 on PostgreSQL until the table is first analyzed.
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
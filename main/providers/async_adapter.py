@@ -0,0 +1,31 @@
+from asgiref.sync import sync_to_async
+
+
+class AsyncProviderAdapter:
+    """
+    Gives a synchronous provider (e.g. MockProvider) the async interface by running its
+    calls in a worker thread, so async callers can await every provider the same way.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def __str__(self):
+        return str(self.provider)
+
+    async def aget_exchange_rate_data(self, source_currency, exchanged_currency, valuation_date=None):
+        rates = await self.aget_exchange_rates(source_currency, [exchanged_currency], valuation_date)
+        return rates.get(exchanged_currency)
+
+    async def aget_exchange_rates(self, source_currency, symbols, valuation_date=None):
+        from main.providers.provider_manager import request_provider_rates
+
+        return await sync_to_async(request_provider_rates, thread_sensitive=False)(
+            self.provider, source_currency, symbols, valuation_date
+        )
+
+
+def get_async_provider(provider):
+    if hasattr(provider, 'aget_exchange_rates'):
+        return provider
+    return AsyncProviderAdapter(provider)
@@ -0,0 +1,69 @@
+import time
+
+from django.core.cache import cache
+
+from main.cache import cached_config
+
+
+CLOSED = 'closed'
+DEGRADED = 'degraded'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker whose state lives in the shared cache, so every worker sees
+    the same circuit.
+
+    closed: calls go through; CIRCUIT_FAILURE_THRESHOLD consecutive failures open it.
+    open: calls are skipped without touching the provider for CIRCUIT_RESET_TIMEOUT seconds.
+    half_open: a single probe call is let through; success closes the circuit, failure
+    opens it again.
+    """
+
+    def __init__(self, name):
+        self.failures_key = f"circuit:{name}:failures"
+        self.opened_at_key = f"circuit:{name}:opened_at"
+        self.probe_key = f"circuit:{name}:probe"
+
+    def state(self):
+        values = cache.get_many([self.failures_key, self.opened_at_key])
+        return self.get_state(values.get(self.failures_key), values.get(self.opened_at_key))
+
+    def get_state(self, failures, opened_at):
+        if opened_at is not None:
+            if time.time() - opened_at < cached_config.CIRCUIT_RESET_TIMEOUT:
+                return OPEN
+            return HALF_OPEN
+        return DEGRADED if failures else CLOSED
+
+    def before_call(self):
+        """
+        Returns the state to hand to record_success/record_failure, or None when the call
+        must be skipped.
+        """
+        state = self.state()
+        if state == OPEN:
+            return None
+        if state == HALF_OPEN and not cache.add(self.probe_key, 1, timeout=cached_config.API_REQUEST_TIMEOUT):
+            return None
+        return state
+
+    def record_success(self, state):
+        if state != CLOSED:
+            cache.delete_many([self.failures_key, self.opened_at_key, self.probe_key])
+
+    def record_failure(self, state):
+        if state == HALF_OPEN:
+            cache.set(self.opened_at_key, time.time(), timeout=None)
+            cache.delete(self.probe_key)
+            return
+
+        cache.add(self.failures_key, 0, timeout=cached_config.CIRCUIT_RESET_TIMEOUT)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            failures = 1
+        if failures >= cached_config.CIRCUIT_FAILURE_THRESHOLD:
+            cache.set(self.opened_at_key, time.time(), timeout=None)
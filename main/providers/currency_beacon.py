@@ -1,48 +1,238 @@
+import asyncio
 import requests
-from constance import config
-from django.core.cache import cache
+import threading
+import weakref
+
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.utils import timezone
 from requests.adapters import HTTPAdapter
 from rest_framework import status
 from rest_framework.response import Response
 from urllib3 import Retry
 
+from main.cache import cached_config, tiered_cache
+from main.coalescing import asingle_flight, single_flight
+from main.utils import get_date_windows
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# Connections the async client keeps open at once; each in-flight call only costs a socket.
+ASYNC_MAX_CONNECTIONS = 500
+
+
 class CurrencyBeaconProviderException(Exception):
     pass
 
 
+class TimeseriesWindowsFailed(CurrencyBeaconProviderException):
+    """
+    Raised after every window that did arrive was yielded; failed_windows lists the
+    (start, end) ranges left to fetch elsewhere.
+    """
+
+    def __init__(self, failed_windows, error):
+        super().__init__(f"{len(failed_windows)} timeseries windows failed, last: {error}")
+        self.failed_windows = failed_windows
+
+
+def check_response_status(status_code):
+    """
+    Anything but a 200 is a failure, left to the circuit breaker and failover: a 429 or a
+    rejected API key says nothing about which symbols exist, so an empty answer would get
+    every requested symbol negative-cached.
+    """
+    if status_code != 200:
+        raise CurrencyBeaconProviderException(f"Failed to get the exchange rates: status {status_code}")
+
+
 class CurrencyBeaconProvider:
 
     def __init__(self, base_url=None, api_key=None, ):
-        self.base_url = base_url or config.BEACON_BASE_URL
-        self.api_key = api_key or config.CURRENCY_BEACON_API_KEY 
+        self.base_url = base_url or cached_config.BEACON_BASE_URL
+        self.api_key = api_key or cached_config.CURRENCY_BEACON_API_KEY
         self.session = requests.Session()
-        retries = Retry(total=config.MAX_RETRIES, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
+        retries = Retry(total=cached_config.MAX_RETRIES, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+        # The only retry layer: requests made through the session are not retried again.
+        adapter = HTTPAdapter(max_retries=retries)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.async_clients_lock = threading.Lock()
+
+    def get_exchange_rate_data(self, source_currency, exchanged_currency, valuation_date=None):
+        rates = self.get_exchange_rates(source_currency, [exchanged_currency], valuation_date)
+        return rates.get(exchanged_currency)
+
+    def get_exchange_rates(self, source_currency, symbols, valuation_date=None):
+        """
+        Fetch the rates for every symbol against source_currency in a single upstream call.
+        Symbols already present in the cache are not requested again. Passing symbols=None
+        returns the full snapshot the provider publishes for source_currency.
+        """
+        date_key = self.get_date_key(valuation_date)
+        rates = {}
+        missing_symbols = None
+
+        if symbols is not None:
+            cache_keys = {self.get_cache_key(source_currency, symbol, date_key): symbol for symbol in symbols}
+            cached_rates = tiered_cache.get_many(cache_keys.keys())
 
-    def get_exchange_rate_data(self, source_currency, exchanged_currency):
-        cache_key = f"{source_currency}_{exchanged_currency}_'latest'"
-        cached_rate = cache.get(cache_key)
+            rates = {cache_keys[key]: rate for key, rate in cached_rates.items() if rate}
+            missing_symbols = [symbol for symbol in symbols if symbol not in rates]
+            if not missing_symbols:
+                return rates
 
-        if cached_rate:
-            return cached_rate
+        # Concurrent misses for the same key share one upstream call.
+        flight_symbols = '*' if missing_symbols is None else ','.join(missing_symbols)
+        flight_key = self.get_cache_key(source_currency, flight_symbols, date_key)
+        rates.update(single_flight(
+            flight_key, lambda: self.fetch_exchange_rates(source_currency, missing_symbols, date_key)
+        ))
+        return rates
 
+    def fetch_exchange_rates(self, source_currency, symbols, date_key):
         params = {
             'api_key': self.api_key,
             'base': source_currency,
-            'symbols': exchanged_currency,
         }
+        if symbols is not None:
+            params['symbols'] = ','.join(symbols)
 
-        try:
+        if date_key == 'latest':
             uri = self.base_url + "/latest"
-            response = self.session.get(uri, params=params, timeout=config.API_REQUEST_TIMEOUT )
-            if response.status_code == 200:
-                rate = response.json()['response']['rates'].get(exchanged_currency)
-                cache.set(cache_key, rate, timeout=config.CACHE_TIMEOUT)
-                return rate
-        except CurrencyBeaconProviderException as ex:
-            print(f"Failed to get the exchange rate: {ex}")
-            return None
-    
+        else:
+            uri = self.base_url + "/historical"
+            params['date'] = date_key
+
+        response = self.session.get(uri, params=params, timeout=cached_config.API_REQUEST_TIMEOUT)
+        check_response_status(response.status_code)
+
+        fetched_rates = {
+            symbol: rate for symbol, rate in response.json()['response']['rates'].items()
+            if rate and (symbols is None or symbol in symbols)
+        }
+        tiered_cache.set_many(
+            {self.get_cache_key(source_currency, symbol, date_key): rate for symbol, rate in fetched_rates.items()},
+            timeout=cached_config.CACHE_TIMEOUT
+        )
+        return fetched_rates
+
+    async def aget_exchange_rate_data(self, source_currency, exchanged_currency, valuation_date=None):
+        rates = await self.aget_exchange_rates(source_currency, [exchanged_currency], valuation_date)
+        return rates.get(exchanged_currency)
+
+    async def aget_exchange_rates(self, source_currency, symbols, valuation_date=None):
+        """
+        Async get_exchange_rates over httpx, sharing its cache keys and coalescing with
+        concurrent sync and async misses. Without httpx installed the sync call is run in a
+        worker thread instead.
+        """
+        if httpx is None:
+            return await sync_to_async(self.get_exchange_rates, thread_sensitive=False)(
+                source_currency, symbols, valuation_date
+            )
+
+        date_key = self.get_date_key(valuation_date)
+        rates = {}
+        missing_symbols = None
+
+        if symbols is not None:
+            cache_keys = {self.get_cache_key(source_currency, symbol, date_key): symbol for symbol in symbols}
+            cached_rates = await sync_to_async(tiered_cache.get_many, thread_sensitive=False)(cache_keys.keys())
+
+            rates = {cache_keys[key]: rate for key, rate in cached_rates.items() if rate}
+            missing_symbols = [symbol for symbol in symbols if symbol not in rates]
+            if not missing_symbols:
+                return rates
+
+        flight_symbols = '*' if missing_symbols is None else ','.join(missing_symbols)
+        flight_key = self.get_cache_key(source_currency, flight_symbols, date_key)
+        rates.update(await asingle_flight(
+            flight_key, lambda: self.afetch_exchange_rates(source_currency, missing_symbols, date_key)
+        ))
+        return rates
+
+    async def afetch_exchange_rates(self, source_currency, symbols, date_key):
+        params = {
+            'api_key': self.api_key,
+            'base': source_currency,
+        }
+        if symbols is not None:
+            params['symbols'] = ','.join(symbols)
+
+        if date_key == 'latest':
+            uri = self.base_url + "/latest"
+        else:
+            uri = self.base_url + "/historical"
+            params['date'] = date_key
+
+        client = await self.get_async_client()
+        response = await client.get(uri, params=params)
+        check_response_status(response.status_code)
+
+        fetched_rates = {
+            symbol: rate for symbol, rate in response.json()['response']['rates'].items()
+            if rate and (symbols is None or symbol in symbols)
+        }
+        await sync_to_async(tiered_cache.set_many, thread_sensitive=False)(
+            {self.get_cache_key(source_currency, symbol, date_key): rate for symbol, rate in fetched_rates.items()},
+            timeout=await cached_config.aget('CACHE_TIMEOUT')
+        )
+        return fetched_rates
+
+    async def get_async_client(self):
+        """
+        One httpx.AsyncClient per event loop, as a client is bound to the loop it was first
+        used on. Each client is closed with its loop: the loop's shutdown_asyncgens(), which
+        asyncio.run (and so async_to_sync) awaits before closing it, finalizes the generator
+        suspended in close_with_loop. A WSGI worker running an async view per request loop
+        thus closes that request's client instead of leaking it.
+        """
+        loop = asyncio.get_running_loop()
+        with self.async_clients_lock:
+            entry = self.async_clients.get(loop)
+        if entry is not None:
+            return entry[0]
+
+        timeout = await cached_config.aget('API_REQUEST_TIMEOUT')
+        retries = await cached_config.aget('MAX_RETRIES')
+        with self.async_clients_lock:
+            entry = self.async_clients.get(loop)
+            lifespan = None
+            if entry is None:
+                limits = httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_MAX_CONNECTIONS)
+                client = httpx.AsyncClient(
+                    timeout=timeout, transport=httpx.AsyncHTTPTransport(retries=retries, limits=limits)
+                )
+                lifespan = self.close_with_loop(loop, client)
+                entry = self.async_clients[loop] = (client, lifespan)
+        if lifespan is not None:
+            await anext(lifespan)
+        return entry[0]
+
+    async def close_with_loop(self, loop, client):
+        try:
+            yield
+        finally:
+            with self.async_clients_lock:
+                self.async_clients.pop(loop, None)
+            await client.aclose()
+
+    @staticmethod
+    def get_cache_key(source_currency, exchanged_currency, date_key='latest'):
+        return f"{source_currency}_{exchanged_currency}_'{date_key}'"
+
+    @staticmethod
+    def get_date_key(valuation_date):
+        if valuation_date is None or valuation_date >= timezone.now().date():
+            return 'latest'
+        return valuation_date.isoformat()
+
     def get_historical_exchange_rate(self, source_currency, from_date, symbols=None):
         url = self.base_url + '/historical'
         params = {
@@ -65,6 +255,47 @@ class CurrencyBeaconProvider:
     
 
     def get_timeseries_exchange_rate(self, source_currency, from_date, to_date, symbols):
+        data = {}
+        for window_data in self.iter_timeseries_exchange_rate(source_currency, from_date, to_date, symbols):
+            data.update(window_data)
+        return data, 200
+
+    def iter_timeseries_exchange_rate(self, source_currency, from_date, to_date, symbols):
+        """
+        Split the range into TIMESERIES_WINDOW_DAYS windows fetched concurrently by at most
+        TIMESERIES_MAX_WORKERS threads, yielding each window's {date: rates} in date order
+        as soon as it and the windows before it have arrived. A failed window does not stop
+        the others: it is reported by TimeseriesWindowsFailed once they are all yielded.
+        """
+        windows = get_date_windows(from_date, to_date, cached_config.TIMESERIES_WINDOW_DAYS)
+        timeout = cached_config.API_REQUEST_TIMEOUT
+        failed_windows = []
+
+        executor = ThreadPoolExecutor(max_workers=min(cached_config.TIMESERIES_MAX_WORKERS, len(windows)) or 1)
+        try:
+            futures = [
+                executor.submit(self.fetch_timeseries_window, source_currency, start_date, end_date, symbols, timeout)
+                for start_date, end_date in windows
+            ]
+            for window, future in zip(windows, futures):
+                try:
+                    window_data = future.result()
+                except CurrencyBeaconProviderException as e:
+                    failed_windows.append(window)
+                    error = e
+                    continue
+                yield window_data
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if failed_windows:
+            raise TimeseriesWindowsFailed(failed_windows, error)
+
+    def fetch_timeseries_window(self, source_currency, from_date, to_date, symbols, timeout):
+        """
+        One attempt per window: transient errors are already retried by the session's
+        urllib3 Retry, so a failure here is final and left to the provider manager.
+        """
         url = self.base_url + '/timeseries'
         params = {
             'api_key': self.api_key,
@@ -75,16 +306,12 @@ class CurrencyBeaconProvider:
         }
 
         try:
-            response = self.session.get(url, params=params)
+            response = self.session.get(url, params=params, timeout=timeout)
             response.raise_for_status()
-            code = response.json().get('meta').get('code') 
+            code = response.json().get('meta').get('code')
             if code == 200:
-                data = response.json()['response']
-                return data, code
-            return {}, code
-        except Exception as e:
-            raise e
-
-    
-
-
+                return response.json()['response']
+            error = f"status {code}"
+        except (requests.exceptions.RequestException, ValueError) as e:
+            error = e
+        raise CurrencyBeaconProviderException(f"Timeseries window {from_date}..{to_date} failed: {error}")
@@ -1,5 +1,12 @@
 import random
 
+from main.models import Currency
+
 class MockProvider:
     def get_exchange_rate_data(self, source_currency, exchanged_currency, valuation_date=None):
         return round(random.uniform(0.5, 1.5), 6)
+
+    def get_exchange_rates(self, source_currency, symbols, valuation_date=None):
+        if symbols is None:
+            symbols = Currency.objects.exclude(code=source_currency).values_list('code', flat=True)
+        return {symbol: self.get_exchange_rate_data(source_currency, symbol, valuation_date) for symbol in symbols}
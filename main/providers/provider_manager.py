@@ -1,11 +1,67 @@
+import asyncio
+import contextvars
 import importlib
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, timedelta
+from decimal import Decimal
+from statistics import median
+from django.db import close_old_connections
+
+from main.cache import cached_config, tiered_cache
+from main.coalescing import CoalescedFetchError, fetch_role, record_fetch_role
+from main.metrics import circuit_skips, provider_fallbacks, upstream_latency
 from main.models import Provider
+from main.providers.async_adapter import get_async_provider
+from main.providers.circuit_breaker import CircuitBreaker
+
+
+# One bounded pool per provider: calls stuck on a slow provider only queue behind each
+# other, so the hedge or quorum call to another provider starts at once however many of
+# them there are.
+PROVIDER_POOL_SIZE = 16
+provider_executors = {}
+provider_executors_lock = threading.Lock()
+
 
 class ProviderManager:
+    """
+    Use ProviderManager.get_instance() rather than instantiating per request: the shared
+    instance keeps provider objects (and their HTTP connection pools) alive for the life of
+    the process and is only rebuilt when the registry version in the cache changes.
+    """
+
+    _instance = None
+    _instance_version = None
+    _instance_lock = threading.Lock()
 
     def __init__(self):
         self.providers = self.load_providers_from_db()
 
+    @classmethod
+    def get_instance(cls):
+        version = tiered_cache.get_version('provider')
+        instance = cls._instance
+        if instance is not None and version == cls._instance_version:
+            return instance
+
+        with cls._instance_lock:
+            if cls._instance is None or version != cls._instance_version:
+                cls._instance = cls()
+                cls._instance_version = version
+            return cls._instance
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Bump the registry version so every process rebuilds its providers on next use.
+        """
+        tiered_cache.invalidate('provider')
+        cls._instance = None
+
     def load_providers_from_db(self):
         provider_entries = Provider.objects.filter(active=True).order_by('priority')
         provider_instances = []
@@ -18,8 +74,11 @@ class ProviderManager:
                 
                 provider_instance = provider_class()
                 provider_instances.append({
+                    "name": entry.name or entry.class_path,
                     "provider": provider_instance,
-                    "priority": entry.priority
+                    "async_provider": get_async_provider(provider_instance),
+                    "priority": entry.priority,
+                    "circuit_breaker": CircuitBreaker(entry.name or entry.class_path)
                 })
             except (ImportError, AttributeError) as e:
                 print(f"Error loading provider {entry.class_path}: {e}")
@@ -27,13 +86,454 @@ class ProviderManager:
 
         return provider_instances
 
+    def get_exchange_rates(self, source_currency, symbols, valuation_date=None):
+        """
+        Returns {symbol: rate} for every symbol any provider could resolve. With symbols=None
+        the first full snapshot a provider returns is used. How providers are consulted
+        depends on the PROVIDER_STRATEGY constance setting:
+
+        - failover: one provider at a time in priority order, each asked only for the
+          symbols the higher-priority providers did not return.
+        - hedged: like failover, but the next provider is also started once the current one
+          has not answered within PROVIDER_HEDGE_DELAY seconds; first complete answer wins.
+        - quorum: every provider is asked at once and a symbol's rate is the median of the
+          answers, provided at least PROVIDER_QUORUM providers returned it.
+
+        Providers whose circuit is open are skipped. Symbols the providers answered without
+        are remembered for NEGATIVE_CACHE_TIMEOUT seconds and not asked for again until
+        then, unless a provider failed or was skipped, as it might have had them.
+        """
+        if symbols is not None:
+            symbols = get_available_symbols(source_currency, symbols, valuation_date)
+            if not symbols:
+                return {}
+
+        strategy = cached_config.PROVIDER_STRATEGY
+        if strategy == 'hedged' and len(self.providers) > 1:
+            rates, answered = self.get_exchange_rates_hedged(source_currency, symbols, valuation_date)
+        elif strategy == 'quorum' and len(self.providers) > 1:
+            rates, answered = self.get_exchange_rates_quorum(source_currency, symbols, valuation_date)
+        else:
+            rates, answered = self.get_exchange_rates_failover(source_currency, symbols, valuation_date)
+
+        if symbols is not None and answered and len(rates) < len(symbols):
+            remember_unavailable_symbols(source_currency, symbols, rates, valuation_date)
+        return rates
+
+    async def aget_exchange_rates(self, source_currency, symbols, valuation_date=None):
+        """
+        Async counterpart of get_exchange_rates with the same strategies, circuit breakers
+        and negative caching. Providers are awaited through their aget_exchange_rates, sync
+        ones through AsyncProviderAdapter, so no thread waits on an async provider's call.
+        """
+        if symbols is not None:
+            symbols = await sync_to_async(get_available_symbols, thread_sensitive=False)(
+                source_currency, symbols, valuation_date
+            )
+            if not symbols:
+                return {}
+
+        strategy = await cached_config.aget('PROVIDER_STRATEGY')
+        if strategy == 'hedged' and len(self.providers) > 1:
+            rates, answered = await self.aget_exchange_rates_hedged(source_currency, symbols, valuation_date)
+        elif strategy == 'quorum' and len(self.providers) > 1:
+            rates, answered = await self.aget_exchange_rates_quorum(source_currency, symbols, valuation_date)
+        else:
+            rates, answered = await self.aget_exchange_rates_failover(source_currency, symbols, valuation_date)
+
+        if symbols is not None and answered and len(rates) < len(symbols):
+            await sync_to_async(remember_unavailable_symbols, thread_sensitive=False)(
+                source_currency, symbols, rates, valuation_date
+            )
+        return rates
+
+    # Every strategy returns (rates, answered), answered being False when a provider it
+    # consulted failed, was skipped or did not answer in time.
+
+    def get_exchange_rates_failover(self, source_currency, symbols, valuation_date=None):
+        rates = {}
+        answered = True
+        for index, provider_entry in enumerate(self.providers):
+            missing_symbols = get_missing_symbols(symbols, rates)
+            if missing_symbols == []:
+                break
+            if index:
+                provider_fallbacks.inc(provider_entry["name"])
+            provider_rates = call_provider(provider_entry, source_currency, missing_symbols, valuation_date)
+            if provider_rates is None:
+                answered = False
+            else:
+                rates.update(provider_rates)
+        return rates, answered
+
+    def get_exchange_rates_hedged(self, source_currency, symbols, valuation_date=None):
+        hedge_delay = cached_config.PROVIDER_HEDGE_DELAY
+        remaining_providers = iter(self.providers)
+        rates = {}
+        answered = True
+        pending = set()
+
+        def start_next_provider():
+            provider_entry = next(remaining_providers, None)
+            if provider_entry is not None:
+                if pending or rates:
+                    provider_fallbacks.inc(provider_entry["name"])
+                pending.add(submit_provider_call(
+                    provider_entry, source_currency, get_missing_symbols(symbols, rates), valuation_date
+                ))
+
+        start_next_provider()
+        while pending:
+            done, not_done = wait(pending, timeout=hedge_delay, return_when=FIRST_COMPLETED)
+            pending.intersection_update(not_done)
+
+            for future in done:
+                provider_rates = get_provider_result(future)
+                if provider_rates is None:
+                    answered = False
+                    continue
+                for symbol, rate in provider_rates.items():
+                    rates.setdefault(symbol, rate)
+
+            if get_missing_symbols(symbols, rates) == []:
+                break
+            start_next_provider()
+
+        return rates, answered
+
+    def get_exchange_rates_quorum(self, source_currency, symbols, valuation_date=None):
+        futures = [
+            submit_provider_call(provider_entry, source_currency, symbols, valuation_date)
+            for provider_entry in self.providers
+        ]
+        done, _ = wait(futures, timeout=cached_config.API_REQUEST_TIMEOUT)
+        return self.get_quorum_rates(
+            source_currency, [get_provider_result(future) for future in done], cached_config.PROVIDER_QUORUM
+        )
+
+    def get_quorum_rates(self, source_currency, provider_answers, quorum):
+        """
+        Returns (rates, answered) from the answers of the providers that finished in time,
+        None standing for a failed or skipped provider.
+        """
+        answers = {}
+        for provider_rates in filter(None, provider_answers):
+            for symbol, rate in provider_rates.items():
+                answers.setdefault(symbol, []).append(Decimal(str(rate)))
+
+        quorum = min(quorum, len(self.providers))
+        rates = {}
+        for symbol, values in answers.items():
+            if len(values) >= quorum:
+                rates[symbol] = median(values)
+            else:
+                print(f"No provider quorum for {source_currency}/{symbol}: {len(values)} of {quorum} answers")
+        answered = len(provider_answers) == len(self.providers) and None not in provider_answers
+        return rates, answered
+
+    async def aget_exchange_rates_failover(self, source_currency, symbols, valuation_date=None):
+        rates = {}
+        answered = True
+        for index, provider_entry in enumerate(self.providers):
+            missing_symbols = get_missing_symbols(symbols, rates)
+            if missing_symbols == []:
+                break
+            if index:
+                provider_fallbacks.inc(provider_entry["name"])
+            provider_rates = await acall_provider(provider_entry, source_currency, missing_symbols, valuation_date)
+            if provider_rates is None:
+                answered = False
+            else:
+                rates.update(provider_rates)
+        return rates, answered
+
+    async def aget_exchange_rates_hedged(self, source_currency, symbols, valuation_date=None):
+        hedge_delay = await cached_config.aget('PROVIDER_HEDGE_DELAY')
+        remaining_providers = iter(self.providers)
+        rates = {}
+        answered = True
+        pending = set()
+
+        def start_next_provider():
+            provider_entry = next(remaining_providers, None)
+            if provider_entry is not None:
+                if pending or rates:
+                    provider_fallbacks.inc(provider_entry["name"])
+                pending.add(asyncio.ensure_future(acall_provider_in_task(
+                    provider_entry, source_currency, get_missing_symbols(symbols, rates), valuation_date
+                )))
+
+        start_next_provider()
+        try:
+            while pending:
+                done, not_done = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                pending.intersection_update(not_done)
+
+                for task in done:
+                    provider_rates = get_provider_result(task)
+                    if provider_rates is None:
+                        answered = False
+                        continue
+                    for symbol, rate in provider_rates.items():
+                        rates.setdefault(symbol, rate)
+
+                if get_missing_symbols(symbols, rates) == []:
+                    break
+                start_next_provider()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return rates, answered
+
+    async def aget_exchange_rates_quorum(self, source_currency, symbols, valuation_date=None):
+        tasks = [
+            asyncio.ensure_future(acall_provider_in_task(provider_entry, source_currency, symbols, valuation_date))
+            for provider_entry in self.providers
+        ]
+        done, pending = await asyncio.wait(tasks, timeout=await cached_config.aget('API_REQUEST_TIMEOUT'))
+        for task in pending:
+            task.cancel()
+        return self.get_quorum_rates(
+            source_currency, [get_provider_result(task) for task in done], await cached_config.aget('PROVIDER_QUORUM')
+        )
+
+    def get_historical_rates(self, source_currency, valuation_date, symbols=None):
+        """
+        Returns {symbol: rate} for valuation_date from the first provider offering history.
+        """
+        joined_symbols = ','.join(symbols) if symbols else None
+        data = self.call_first_provider('get_historical_exchange_rate', source_currency, valuation_date, joined_symbols)
+        return data.get('rates') or {}
+
+    def iter_timeseries_rates(self, source_currency, from_date, to_date, symbols=None, unanswered=None):
+        """
+        Yields {date string: {symbol: rate}} windows as the providers deliver them. When a
+        provider fails part way, only what it left out is asked of the next providers, never
+        of the failed one again: the windows that failed if it reports them, else the dates
+        after the last window it yielded. Providers that cannot stream windows return each
+        range in one call. The (start, end) ranges no provider answered are appended to
+        unanswered.
+        """
+        joined_symbols = ','.join(symbols) if symbols else None
+        pending_ranges = [(from_date, to_date)]
+        for provider_entry in self.providers:
+            if not pending_ranges:
+                return
+            provider = provider_entry["provider"]
+            streams = hasattr(provider, 'iter_timeseries_exchange_rate')
+            if not streams and not hasattr(provider, 'get_timeseries_exchange_rate'):
+                continue
+            circuit_state = provider_entry["circuit_breaker"].before_call()
+            if circuit_state is None:
+                circuit_skips.inc(provider_entry["name"])
+                continue
+            started_at = time.perf_counter()
+            failed_ranges = []
+            failed = False
+            for range_from, range_to in pending_ranges:
+                resume_date = range_from
+                try:
+                    if streams:
+                        windows = provider.iter_timeseries_exchange_rate(source_currency, range_from, range_to, joined_symbols)
+                    else:
+                        data, code = provider.get_timeseries_exchange_rate(source_currency, range_from, range_to, joined_symbols)
+                        windows = [data] if code == 200 and data else []
+                        if not windows:
+                            failed_ranges.append((range_from, range_to))
+                    for window_data in windows:
+                        if window_data:
+                            yield window_data
+                            resume_date = date.fromisoformat(max(window_data)) + timedelta(days=1)
+                except Exception as e:
+                    failed = True
+                    print(f"Provider {provider} failed on {range_from}..{range_to}: {e}")
+                    if getattr(e, 'failed_windows', None):
+                        failed_ranges.extend(e.failed_windows)
+                    elif resume_date <= range_to:
+                        failed_ranges.append((resume_date, range_to))
+
+            outcome = 'error' if failed else 'ok'
+            upstream_latency.observe(time.perf_counter() - started_at, provider_entry["name"], 'timeseries', outcome)
+            if failed:
+                provider_entry["circuit_breaker"].record_failure(circuit_state)
+            else:
+                provider_entry["circuit_breaker"].record_success(circuit_state)
+            pending_ranges = failed_ranges
+
+        if unanswered is not None:
+            unanswered.extend(pending_ranges)
 
-    def get_exchange_rate_data(self, source_currency, exchanged_currency, valuation_date=None):
+    def call_first_provider(self, method_name, *args):
         for provider_entry in self.providers:
+            provider = provider_entry["provider"]
+            if not hasattr(provider, method_name):
+                continue
+            circuit_state = provider_entry["circuit_breaker"].before_call()
+            if circuit_state is None:
+                circuit_skips.inc(provider_entry["name"])
+                continue
+            started_at = time.perf_counter()
             try:
-                rate = provider_entry["provider"].get_exchange_rate_data(source_currency, exchanged_currency)
-                if rate is not None:
-                    return rate
+                data, code = getattr(provider, method_name)(*args)
             except Exception as e:
-                print(f"Provider {provider_entry['provider']} failed: {e}")
+                upstream_latency.observe(time.perf_counter() - started_at, provider_entry["name"], method_name, 'error')
+                provider_entry["circuit_breaker"].record_failure(circuit_state)
+                print(f"Provider {provider} failed: {e}")
+                continue
+            upstream_latency.observe(time.perf_counter() - started_at, provider_entry["name"], method_name, 'ok')
+            provider_entry["circuit_breaker"].record_success(circuit_state)
+            if code == 200 and data:
+                return data
+        return {}
+
+
+def get_missing_symbols(symbols, rates):
+    """
+    Symbols still unresolved, or None while a full snapshot is still wanted.
+    """
+    if symbols is None:
+        return [] if rates else None
+    return [symbol for symbol in symbols if symbol not in rates]
+
+
+def call_provider(provider_entry, source_currency, symbols, valuation_date=None):
+    """
+    Ask one provider for the given symbols, returning only non-empty rates. Failures and
+    providers with an open circuit are reported as None so callers can move on to the next
+    provider, and do not take the missing symbols for ones the provider does not have.
+    Only the leader of a coalesced call records its failure on the circuit.
+    """
+    provider = provider_entry["provider"]
+    circuit_breaker = provider_entry["circuit_breaker"]
+    circuit_state = circuit_breaker.before_call()
+    if circuit_state is None:
+        circuit_skips.inc(provider_entry["name"])
+        return None
+
+    started_at = time.perf_counter()
+    try:
+        provider_rates = request_provider_rates(provider, source_currency, symbols, valuation_date)
+    except CoalescedFetchError as e:
+        print(f"Provider {provider} failed: {e}")
+        return None
+    except Exception as e:
+        upstream_latency.observe(time.perf_counter() - started_at, provider_entry["name"], 'get_exchange_rates', 'error')
+        circuit_breaker.record_failure(circuit_state)
+        print(f"Provider {provider} failed: {e}")
+        return None
+
+    upstream_latency.observe(time.perf_counter() - started_at, provider_entry["name"], 'get_exchange_rates', 'ok')
+    circuit_breaker.record_success(circuit_state)
+    return filter_provider_rates(provider_rates, symbols)
+
+
+async def acall_provider(provider_entry, source_currency, symbols, valuation_date=None):
+    """
+    Async counterpart of call_provider.
+    """
+    provider = provider_entry["async_provider"]
+    circuit_breaker = provider_entry["circuit_breaker"]
+    circuit_state = await sync_to_async(circuit_breaker.before_call, thread_sensitive=False)()
+    if circuit_state is None:
+        circuit_skips.inc(provider_entry["name"])
+        return None
+
+    started_at = time.perf_counter()
+    try:
+        provider_rates = await provider.aget_exchange_rates(source_currency, symbols, valuation_date)
+    except CoalescedFetchError as e:
+        print(f"Provider {provider} failed: {e}")
         return None
+    except Exception as e:
+        upstream_latency.observe(time.perf_counter() - started_at, provider_entry["name"], 'aget_exchange_rates', 'error')
+        await sync_to_async(circuit_breaker.record_failure, thread_sensitive=False)(circuit_state)
+        print(f"Provider {provider} failed: {e}")
+        return None
+
+    upstream_latency.observe(time.perf_counter() - started_at, provider_entry["name"], 'aget_exchange_rates', 'ok')
+    await sync_to_async(circuit_breaker.record_success, thread_sensitive=False)(circuit_state)
+    return filter_provider_rates(provider_rates, symbols)
+
+
+def request_provider_rates(provider, source_currency, symbols, valuation_date=None):
+    if hasattr(provider, 'get_exchange_rates'):
+        return provider.get_exchange_rates(source_currency, symbols, valuation_date)
+    if symbols is None:
+        return {}
+    return {
+        symbol: provider.get_exchange_rate_data(source_currency, symbol, valuation_date)
+        for symbol in symbols
+    }
+
+
+def filter_provider_rates(provider_rates, symbols):
+    return {
+        symbol: rate for symbol, rate in provider_rates.items()
+        if rate is not None and (symbols is None or symbol in symbols)
+    }
+
+
+def get_negative_cache_keys(source_currency, symbols, valuation_date=None):
+    date_key = valuation_date.isoformat() if valuation_date else 'latest'
+    return {f"no_rate:{source_currency}_{symbol}_{date_key}": symbol for symbol in symbols}
+
+
+def get_available_symbols(source_currency, symbols, valuation_date=None):
+    """
+    Drops the symbols no provider could resolve within the last NEGATIVE_CACHE_TIMEOUT.
+    """
+    negative_keys = get_negative_cache_keys(source_currency, symbols, valuation_date)
+    unavailable = {negative_keys[key] for key in tiered_cache.get_many(negative_keys.keys())}
+    return [symbol for symbol in symbols if symbol not in unavailable]
+
+
+def remember_unavailable_symbols(source_currency, symbols, rates, valuation_date=None):
+    negative_keys = get_negative_cache_keys(source_currency, symbols, valuation_date)
+    tiered_cache.set_many(
+        {key: True for key, symbol in negative_keys.items() if symbol not in rates},
+        timeout=cached_config.NEGATIVE_CACHE_TIMEOUT
+    )
+
+
+def get_provider_executor(name):
+    with provider_executors_lock:
+        executor = provider_executors.get(name)
+        if executor is None:
+            executor = provider_executors[name] = ThreadPoolExecutor(
+                max_workers=PROVIDER_POOL_SIZE, thread_name_prefix=f'provider-{name}'
+            )
+        return executor
+
+
+def submit_provider_call(provider_entry, *args):
+    """
+    Run call_provider on the provider's own pool in a copy of the caller's context, so the
+    call sees the request's context variables.
+    """
+    return get_provider_executor(provider_entry["name"]).submit(
+        contextvars.copy_context().run, call_provider_in_thread, provider_entry, *args
+    )
+
+
+def call_provider_in_thread(*args):
+    try:
+        return call_provider(*args), fetch_role.get()
+    finally:
+        close_old_connections()
+
+
+async def acall_provider_in_task(*args):
+    return await acall_provider(*args), fetch_role.get()
+
+
+def get_provider_result(future):
+    """
+    Rates of a call run through submit_provider_call or acall_provider_in_task. The fetch
+    role the call recorded is set in its own copy of the context, so it is recorded again
+    in the caller's for the X-Rate-Fetch header.
+    """
+    rates, role = future.result()
+    if role:
+        record_fetch_role(role)
+    return rates
@@ -0,0 +1,138 @@
+import re
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+
+# Development and test aid: record the SQL of every request, compare the count with the
+# budget the view declares and flag statements repeated with only their parameters
+# changing, the signature of an N+1 loop. Enabled by QUERY_BUDGET_MODE ('off', 'warn' or
+# 'raise'); it defaults to 'warn' under DEBUG and to 'off' otherwise.
+
+REPEATED_QUERY_THRESHOLD = 3
+BUDGETED_STATUS_CODES = (200, 304)
+
+recorded_queries = ContextVar('recorded_queries', default=None)
+
+PLACEHOLDER_LIST = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r"\s+")
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryLog(list):
+    """
+    The statements of one request; exempt once the request had to fetch rates upstream.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.exempt = False
+
+
+def get_query_budget_mode():
+    return getattr(settings, 'QUERY_BUDGET_MODE', 'warn' if settings.DEBUG else 'off')
+
+
+def record_sql(execute, sql, params, many, context):
+    """
+    Database execute wrapper keeping the statements of the current request, if recording.
+    """
+    queries = recorded_queries.get()
+    if queries is not None:
+        queries.append(sql)
+    return execute(sql, params, many, context)
+
+
+def exempt_from_query_budget():
+    """
+    Mark the current request as having fetched and stored rates, which the budget of a
+    read does not cover. Repeated query shapes are still reported.
+    """
+    queries = recorded_queries.get()
+    if queries is not None:
+        queries.exempt = True
+
+
+def install_sql_recorder(sender, connection, **kwargs):
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+def normalize_sql(sql):
+    """
+    The shape of a statement: literals and IN lists of any length collapse to placeholders.
+    """
+    sql = PLACEHOLDER_LIST.sub('(%s, ...)', sql)
+    sql = STRING_LITERAL.sub('%s', sql)
+    sql = NUMBER_LITERAL.sub('%s', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def get_repeated_queries(queries, threshold=REPEATED_QUERY_THRESHOLD):
+    """
+    Returns {shape: count} for the statement shapes run at least threshold times.
+    Transaction control statements are not counted.
+    """
+    counts = Counter(normalize_sql(sql) for sql in queries if not sql.lstrip().upper().startswith(TRANSACTION_CONTROL))
+    return {shape: count for shape, count in counts.items() if count >= threshold}
+
+
+def get_query_budget(view_func, method):
+    """
+    The budget a view declares with a query_budget attribute: an int, or a dict keyed by
+    HTTP method. Class-based views declare it on the class.
+    """
+    view = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None) or view_func
+    budget = getattr(view, 'query_budget', None)
+    if isinstance(budget, dict):
+        return budget.get(method)
+    return budget
+
+
+def check_queries(label, queries, budget=None):
+    """
+    Returns the problems found in the statements a request or block ran.
+    """
+    problems = []
+    if budget is not None and not getattr(queries, 'exempt', False) and len(queries) > budget:
+        problems.append(f"{label} ran {len(queries)} queries, over its budget of {budget}.")
+    for shape, count in get_repeated_queries(queries).items():
+        problems.append(f"{label} ran the same query {count} times (possible N+1): {shape}")
+    return problems
+
+
+def report_problems(problems, mode):
+    if not problems:
+        return
+    if mode == 'raise':
+        raise QueryBudgetExceeded('\n'.join(problems))
+    for problem in problems:
+        print(f"Query budget: {problem}")
+
+
+@contextmanager
+def assert_max_queries(budget, label='Block'):
+    """
+    Test helper: fail when the block runs more than budget queries or repeats a shape.
+    """
+    for connection in connections.all():
+        install_sql_recorder(None, connection)
+    queries = QueryLog()
+    token = recorded_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        recorded_queries.reset(token)
+    problems = check_queries(label, queries, budget)
+    if problems:
+        raise AssertionError('\n'.join(problems))
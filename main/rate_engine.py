@@ -0,0 +1,96 @@
+import threading
+import time
+
+from decimal import Decimal
+from django.core.cache import cache
+from django.utils import timezone
+
+from main.cache import cached_config
+from main.coalescing import single_flight
+from main.providers.provider_manager import ProviderManager
+from main.utils import quantize_rate
+
+
+# Seconds a failed snapshot fetch is remembered before the next request tries again.
+FAILED_SNAPSHOT_TIMEOUT = 5
+
+
+class RateEngine:
+    """
+    Keeps one snapshot of rates against the anchor currency per valuation date and answers
+    any (source, exchanged) pair as a cross rate of that snapshot, so N currencies cost one
+    provider call per date instead of one per pair.
+    """
+
+    max_snapshots = 31
+
+    def __init__(self):
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def get_snapshot(self, valuation_date=None):
+        """
+        Concurrent misses for the same date share one upstream call through single_flight,
+        without holding up requests for other dates. A failed fetch is remembered for
+        FAILED_SNAPSHOT_TIMEOUT seconds so the requests queued behind it do not repeat it.
+        """
+        anchor_currency = cached_config.ANCHOR_CURRENCY
+        valuation_date = valuation_date or timezone.now().date()
+        snapshot_key = (anchor_currency, valuation_date)
+
+        entry = self.snapshots.get(snapshot_key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        cache_key = get_snapshot_cache_key(anchor_currency, valuation_date)
+        rates = cache.get(cache_key)
+        if not rates:
+            rates = single_flight(cache_key, lambda: fetch_snapshot(anchor_currency, valuation_date))
+        if not rates:
+            self.store(snapshot_key, {}, FAILED_SNAPSHOT_TIMEOUT)
+            return {}
+
+        snapshot = {code: Decimal(rate) for code, rate in rates.items()}
+        snapshot[anchor_currency] = Decimal(1)
+        self.store(snapshot_key, snapshot, cached_config.CACHE_TIMEOUT)
+        return snapshot
+
+    def store(self, snapshot_key, snapshot, timeout):
+        with self.lock:
+            if snapshot_key not in self.snapshots and len(self.snapshots) >= self.max_snapshots:
+                self.snapshots.pop(next(iter(self.snapshots)))
+            self.snapshots[snapshot_key] = (time.monotonic() + timeout, snapshot)
+
+    def get_rates(self, source_currency, exchanged_currencies, valuation_date=None):
+        """
+        Returns {exchanged currency code: quantized cross rate} for every code the anchor
+        snapshot covers.
+        """
+        snapshot = self.get_snapshot(valuation_date)
+        source_rate = snapshot.get(source_currency)
+        if not source_rate:
+            return {}
+
+        return {
+            code: quantize_rate(snapshot[code] / source_rate)
+            for code in exchanged_currencies if snapshot.get(code)
+        }
+
+    def get_rate(self, source_currency, exchanged_currency, valuation_date=None):
+        return self.get_rates(source_currency, [exchanged_currency], valuation_date).get(exchanged_currency)
+
+
+def fetch_snapshot(anchor_currency, valuation_date):
+    rates = ProviderManager.get_instance().get_exchange_rates(anchor_currency, None, valuation_date)
+    if not rates:
+        return {}
+    rates = {code: str(rate) for code, rate in rates.items()}
+    cache.set(get_snapshot_cache_key(anchor_currency, valuation_date), rates, timeout=cached_config.CACHE_TIMEOUT)
+    return rates
+
+
+def get_snapshot_cache_key(anchor_currency, valuation_date):
+    return f"snapshot_{anchor_currency}_{valuation_date.isoformat()}"
+
+
+rate_engine = RateEngine()
@@ -0,0 +1,75 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    One JSON object per line. stream() is used for row iterators handed to a
+    StreamingHttpResponse; render() covers ordinary (e.g. error) responses.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(self.stream(rows)).encode(self.charset)
+
+    def stream(self, rows):
+        for row in rows:
+            yield json.dumps(row, cls=JSONEncoder) + '\n'
+
+    async def astream(self, rows):
+        async for row in rows:
+            yield json.dumps(row, cls=JSONEncoder) + '\n'
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(self.stream(rows)).encode(self.charset)
+
+    def stream(self, rows):
+        buffer = LineBuffer()
+        writer = None
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(buffer, fieldnames=list(row.keys()))
+                writer.writeheader()
+                yield buffer.pop()
+            writer.writerow(row)
+            yield buffer.pop()
+
+    async def astream(self, rows):
+        buffer = LineBuffer()
+        writer = None
+        async for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(buffer, fieldnames=list(row.keys()))
+                writer.writeheader()
+            writer.writerow(row)
+            yield buffer.pop()
+
+
+class LineBuffer:
+    """
+    File-like target for csv.writer that hands back what was written since the last pop().
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, value):
+        self.lines.append(value)
+
+    def pop(self):
+        value = ''.join(self.lines)
+        self.lines = []
+        return value
@@ -0,0 +1,170 @@
+import threading
+
+from array import array
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+
+from main.models import CurrencyExchangeRate
+from main.utils import get_currency_registry, get_rate_changes
+
+
+# Stored rate history kept in process as one contiguous array('q') per (source, target)
+# pair: a day per slot, each rate as a fixed-point integer of 10**-6 units (the precision
+# of rate_value). A point costs 8 bytes instead of a row tuple, a date and a Decimal.
+
+SCALE_DIGITS = 6
+NO_RATE = -2 ** 63
+MAX_POINTS = 4000000
+LOAD_CHUNK_SIZE = 5000
+
+
+class RateSeries:
+    __slots__ = ('start', 'values', 'version')
+
+    def __init__(self, version=0):
+        self.start = None
+        self.values = array('q')
+        self.version = version
+
+    def set(self, ordinal, value):
+        if self.start is None:
+            self.start = ordinal
+        elif ordinal < self.start:
+            self.values[:0] = array('q', [NO_RATE]) * (self.start - ordinal)
+            self.start = ordinal
+        index = ordinal - self.start
+        if index >= len(self.values):
+            self.values.extend(array('q', [NO_RATE]) * (index + 1 - len(self.values)))
+        self.values[index] = value
+
+    def slice(self, from_ordinal, to_ordinal):
+        """
+        Returns (first ordinal, copy of the values) for the days inside the range.
+        """
+        first = max(from_ordinal, self.start or from_ordinal)
+        if self.start is None or to_ordinal < first:
+            return first, array('q')
+        return first, self.values[first - self.start:to_ordinal - self.start + 1]
+
+    def copy_before(self, ordinal, version):
+        """
+        A new series holding only the days before ordinal, to re-read the rest into.
+        """
+        series = RateSeries(version)
+        if self.start is not None and ordinal > self.start:
+            series.start = self.start
+            series.values = self.values[:ordinal - self.start]
+        return series
+
+
+class RateSeriesStore:
+    """
+    Pairs are loaded lazily, a whole history per query for all the requested targets of a
+    source, and evicted least recently used first once the store holds more than
+    max_points days. Every read first checks the source's rate change log (see
+    record_rate_changes) and re-reads the pairs from the earliest date written since they
+    were read, so rates inserted, updated or deleted by any worker are seen without
+    reloading whole histories. Re-read pairs are built aside and swapped in, never
+    modified in place.
+    """
+
+    def __init__(self, max_points=MAX_POINTS):
+        self.max_points = max_points
+        self.series = OrderedDict()
+        self.points = 0
+        self.lock = threading.Lock()
+
+    def get_slices(self, source_currency, from_date, to_date, symbols=None):
+        """
+        Returns [(code, first ordinal, values)] for the stored history of source_currency
+        against symbols (every other currency when None) between the two dates.
+        """
+        currency_registry = get_currency_registry()
+        if source_currency not in currency_registry:
+            return []
+        source_id = currency_registry[source_currency]['id']
+        codes = sorted(symbols) if symbols else sorted(code for code in currency_registry if code != source_currency)
+        target_ids = {currency_registry[code]['id']: code for code in codes if code in currency_registry}
+
+        with self.lock:
+            loaded = {target_id: self.series.get((source_id, target_id)) for target_id in target_ids}
+            for target_id, series in loaded.items():
+                if series is not None:
+                    self.series.move_to_end((source_id, target_id))
+        cached = {target_id: series for target_id, series in loaded.items() if series is not None}
+        if cached:
+            version, from_ordinal = get_rate_changes(source_id, min(series.version for series in cached.values()))
+            stale = {target_id: series for target_id, series in cached.items() if series.version != version}
+            if from_ordinal is not None and stale:
+                loaded.update(self.read(source_id, stale, from_ordinal, version))
+        missing_ids = [target_id for target_id, series in loaded.items() if series is None]
+        if missing_ids:
+            loaded.update(self.load(source_id, missing_ids))
+
+        # Sliced from the series read above, which stay usable even if evicted meanwhile.
+        from_ordinal, to_ordinal = from_date.toordinal(), to_date.toordinal()
+        return [(code, *loaded[target_id].slice(from_ordinal, to_ordinal)) for target_id, code in target_ids.items()]
+
+    def load(self, source_id, target_ids):
+        version, _ = get_rate_changes(source_id)
+        return self.read(source_id, dict.fromkeys(target_ids), date.min.toordinal(), version)
+
+    def read(self, source_id, series_by_target, from_ordinal, version):
+        """
+        Reads the rows from from_ordinal on into copies of the series (None for a pair not
+        loaded yet) and swaps them into the store. version is read before the rows, so
+        changes committed meanwhile are re-read on the next call.
+        """
+        refreshed = {
+            target_id: series.copy_before(from_ordinal, version) if series is not None else RateSeries(version)
+            for target_id, series in series_by_target.items()
+        }
+        rows = CurrencyExchangeRate.objects.filter(source_currency_id=source_id, exchanged_currency_id__in=list(refreshed))
+        if from_ordinal > date.min.toordinal():
+            rows = rows.filter(valuation_date__gte=date.fromordinal(from_ordinal))
+        for target_id, valuation_date, rate_value in rows.values_list(
+            'exchanged_currency_id', 'valuation_date', 'rate_value'
+        ).iterator(chunk_size=LOAD_CHUNK_SIZE):
+            refreshed[target_id].set(valuation_date.toordinal(), int(rate_value.scaleb(SCALE_DIGITS)))
+
+        with self.lock:
+            for target_id, series in refreshed.items():
+                previous = self.series.pop((source_id, target_id), None)
+                if previous is not None:
+                    self.points -= len(previous.values)
+                self.series[(source_id, target_id)] = series
+                self.points += len(series.values)
+            self.evict()
+        return refreshed
+
+    def evict(self):
+        while self.points > self.max_points and len(self.series) > 1:
+            _, series = self.series.popitem(last=False)
+            self.points -= len(series.values)
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+            self.points = 0
+
+
+def iter_slice_windows(slices):
+    """
+    Yields {date string: {code: Decimal}} per date, in date order, from get_slices output.
+    """
+    if not slices:
+        return
+    first_ordinal = min(first for _, first, _ in slices)
+    last_ordinal = max(first + len(values) - 1 for _, first, values in slices)
+    for ordinal in range(first_ordinal, last_ordinal + 1):
+        rates = {}
+        for code, first, values in slices:
+            index = ordinal - first
+            if 0 <= index < len(values) and values[index] != NO_RATE:
+                rates[code] = Decimal(values[index]).scaleb(-SCALE_DIGITS)
+        if rates:
+            yield {date.fromordinal(ordinal).isoformat(): rates}
+
+
+series_store = RateSeriesStore()
@@ -0,0 +1,247 @@
+import contextvars
+
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db import connections
+from django.db.models import F, Max, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from main.cache import cached_config
+from main.metrics import rate_sources
+from main.models import Currency, CurrencyExchangeRate
+from main.query_budget import exempt_from_query_budget
+from main.providers.provider_manager import ProviderManager
+from main.rate_engine import rate_engine
+from main.utils import get_currency_registry, quantize_rate, save_rates
+
+
+# (source, date) groups matched per get_dated_rates query; each adds a term to one OR.
+DATED_GROUPS_PER_QUERY = 300
+
+
+def get_rate(pair, valuation_date=None):
+    """
+    Returns the Decimal rate for a (source code, target code) pair, or None when neither
+    the stored rates nor any provider has it.
+    """
+    source_currency, exchanged_currency = pair
+    return get_rates(source_currency, [exchanged_currency], valuation_date).get(exchanged_currency.upper())
+
+
+def get_rates(base_currency, symbols, valuation_date=None):
+    """
+    Returns {code: Decimal} for every symbol against base_currency that can be resolved.
+    Stored rates are used first (the latest stored one when valuation_date is None); the
+    rest come from the rate engine or the providers, and are stored before returning.
+    """
+    base_currency = base_currency.upper()
+    symbols = [symbol.upper() for symbol in symbols]
+    rates = get_stored_rates(base_currency, symbols, valuation_date)
+    rate_sources.inc('stored', amount=len(rates))
+
+    missing_symbols = [symbol for symbol in symbols if symbol not in rates]
+    if missing_symbols:
+        rates.update(fetch_rates(base_currency, missing_symbols, valuation_date or timezone.now().date()))
+    return rates
+
+
+async def aget_rates(base_currency, symbols, valuation_date=None):
+    """
+    Async get_rates: missing symbols are fetched through the providers' async interface.
+    """
+    base_currency = base_currency.upper()
+    symbols = [symbol.upper() for symbol in symbols]
+    rates = await sync_to_async(get_stored_rates)(base_currency, symbols, valuation_date)
+    rate_sources.inc('stored', amount=len(rates))
+
+    missing_symbols = [symbol for symbol in symbols if symbol not in rates]
+    if missing_symbols:
+        rates.update(await afetch_rates(base_currency, missing_symbols, valuation_date or timezone.now().date()))
+    return rates
+
+
+def get_stored_rates(base_currency, symbols, valuation_date=None):
+    """
+    Returns {code: Decimal} for the symbols stored against base_currency on valuation_date,
+    or their latest stored rate when valuation_date is None.
+    """
+    currency_registry = get_currency_registry()
+    if base_currency not in currency_registry:
+        return {}
+    source_id = currency_registry[base_currency]['id']
+    codes_by_id = {currency_registry[symbol]['id']: symbol for symbol in symbols if symbol in currency_registry}
+
+    if valuation_date:
+        stored_rates = get_dated_rates({(source_id, target_id, valuation_date) for target_id in codes_by_id})
+        return {codes_by_id[target_id]: rate for (_, target_id, _), rate in stored_rates.items()}
+    stored_rates = get_latest_rates({(source_id, target_id) for target_id in codes_by_id})
+    return {codes_by_id[target_id]: rate for (_, target_id), (_, rate) in stored_rates.items()}
+
+
+def get_dated_rates(keys):
+    """
+    Returns {(source id, target id, date): rate} for the requested (source id, target id,
+    date) keys, matching each (source, date) group on its own targets only. Groups are
+    OR-ed together, DATED_GROUPS_PER_QUERY per query to stay within SQLite's expression
+    depth limit.
+    """
+    groups = {}
+    for source_id, target_id, valuation_date in keys:
+        groups.setdefault((source_id, valuation_date), set()).add(target_id)
+    groups = list(groups.items())
+
+    rates = {}
+    for start in range(0, len(groups), DATED_GROUPS_PER_QUERY):
+        condition = Q()
+        for (source_id, valuation_date), target_ids in groups[start:start + DATED_GROUPS_PER_QUERY]:
+            condition |= Q(source_currency_id=source_id, valuation_date=valuation_date, exchanged_currency_id__in=target_ids)
+        rates.update(
+            ((source_id, target_id, valuation_date), rate_value)
+            for source_id, target_id, valuation_date, rate_value in CurrencyExchangeRate.objects.filter(condition).values_list(
+                'source_currency_id', 'exchanged_currency_id', 'valuation_date', 'rate_value'
+            )
+        )
+    return rates
+
+
+def get_latest_rates(pairs, max_age_days=None):
+    """
+    Returns {(source id, target id): (date, rate)} with the most recent stored rate of every
+    requested (source id, target id) pair, in one query backed by exchange_rate_latest_idx.
+    Rates older than max_age_days (MAX_RATE_AGE_DAYS by default, 0 for no bound) are left
+    out, so callers fetch a fresh one instead of converting with a stale rate.
+    """
+    if not pairs:
+        return {}
+    if max_age_days is None:
+        max_age_days = cached_config.MAX_RATE_AGE_DAYS
+    candidates = CurrencyExchangeRate.objects.filter(
+        source_currency_id__in={source_id for source_id, _ in pairs},
+        exchanged_currency_id__in={target_id for _, target_id in pairs}
+    )
+    if max_age_days:
+        candidates = candidates.filter(valuation_date__gte=timezone.now().date() - timedelta(days=max_age_days))
+
+    features = connections[candidates.db].features
+    if features.can_distinct_on_fields:
+        rates = candidates.order_by('source_currency_id', 'exchanged_currency_id', '-valuation_date').distinct(
+            'source_currency_id', 'exchanged_currency_id'
+        )
+    elif features.supports_over_clause:
+        rates = candidates.annotate(row_number=Window(
+            RowNumber(), partition_by=[F('source_currency_id'), F('exchanged_currency_id')],
+            order_by=F('valuation_date').desc()
+        )).filter(row_number=1)
+    else:
+        return get_latest_rates_by_max_date(candidates, pairs)
+
+    rates = rates.values_list('source_currency_id', 'exchanged_currency_id', 'valuation_date', 'rate_value')
+    return {(source_id, target_id): (valuation_date, rate_value)
+            for source_id, target_id, valuation_date, rate_value in rates
+            if (source_id, target_id) in pairs}
+
+
+def get_latest_rates_by_max_date(candidates, pairs):
+    """
+    get_latest_rates for databases without DISTINCT ON or window functions (SQLite before
+    3.25): the latest date per pair first, then the rates on those dates.
+    """
+    latest_dates = candidates.values('source_currency_id', 'exchanged_currency_id').annotate(latest=Max('valuation_date'))
+    latest_dates = {
+        (row['source_currency_id'], row['exchanged_currency_id']): row['latest']
+        for row in latest_dates
+        if (row['source_currency_id'], row['exchanged_currency_id']) in pairs
+    }
+    if not latest_dates:
+        return {}
+
+    rates = candidates.filter(valuation_date__in=set(latest_dates.values())).values_list(
+        'source_currency_id', 'exchanged_currency_id', 'valuation_date', 'rate_value'
+    )
+    return {(source_id, target_id): (valuation_date, rate_value)
+            for source_id, target_id, valuation_date, rate_value in rates
+            if latest_dates.get((source_id, target_id)) == valuation_date}
+
+
+def fetch_rates(base_currency, symbols, valuation_date):
+    """
+    Resolve symbols from the rate engine snapshot first and the providers second, store
+    what was found and return it as {code: Decimal}.
+    """
+    exempt_from_query_budget()
+    rates = resolve_rates(ProviderManager.get_instance(), base_currency, symbols, valuation_date)
+    return store_fetched_rates(base_currency, rates, valuation_date)
+
+
+def fetch_rate_groups(groups):
+    """
+    fetch_rates for many {(base currency, date): symbols} groups, returning {(base currency,
+    date): rates}. Groups are resolved concurrently by at most BULK_FETCH_MAX_WORKERS
+    threads and stored from the calling thread, in its transaction.
+    """
+    exempt_from_query_budget()
+    if not groups:
+        return {}
+    provider_manager = ProviderManager.get_instance()
+
+    executor = ThreadPoolExecutor(max_workers=min(cached_config.BULK_FETCH_MAX_WORKERS, len(groups)) or 1)
+    try:
+        futures = {
+            (base_currency, valuation_date): executor.submit(
+                contextvars.copy_context().run, resolve_rates, provider_manager, base_currency, symbols, valuation_date
+            )
+            for (base_currency, valuation_date), symbols in groups.items()
+        }
+        return {
+            (base_currency, valuation_date): store_fetched_rates(base_currency, future.result(), valuation_date)
+            for (base_currency, valuation_date), future in futures.items()
+        }
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def resolve_rates(provider_manager, base_currency, symbols, valuation_date):
+    rates = rate_engine.get_rates(base_currency, symbols, valuation_date)
+    rate_sources.inc('rate_engine', amount=len(rates))
+    missing_symbols = [symbol for symbol in symbols if symbol not in rates]
+    if missing_symbols:
+        provider_rates = provider_manager.get_exchange_rates(base_currency, missing_symbols, valuation_date)
+        record_provider_sources(missing_symbols, provider_rates)
+        rates.update(provider_rates)
+    return rates
+
+
+def store_fetched_rates(base_currency, rates, valuation_date):
+    currency_registry = get_currency_registry()
+    if rates and base_currency in currency_registry:
+        save_rates(Currency(**currency_registry[base_currency]), rates, valuation_date)
+    return {code: quantize_rate(rate) for code, rate in rates.items()}
+
+
+async def afetch_rates(base_currency, symbols, valuation_date):
+    """
+    Async fetch_rates. The rate engine snapshot is normally in memory; the providers are
+    awaited without holding a thread.
+    """
+    exempt_from_query_budget()
+    rates = await sync_to_async(rate_engine.get_rates, thread_sensitive=False)(base_currency, symbols, valuation_date)
+    rate_sources.inc('rate_engine', amount=len(rates))
+    missing_symbols = [symbol for symbol in symbols if symbol not in rates]
+    if missing_symbols:
+        provider_manager = await sync_to_async(ProviderManager.get_instance)()
+        provider_rates = await provider_manager.aget_exchange_rates(base_currency, missing_symbols, valuation_date)
+        record_provider_sources(missing_symbols, provider_rates)
+        rates.update(provider_rates)
+
+    currency_registry = await sync_to_async(get_currency_registry)()
+    if rates and base_currency in currency_registry:
+        await sync_to_async(save_rates)(Currency(**currency_registry[base_currency]), rates, valuation_date)
+    return {code: quantize_rate(rate) for code, rate in rates.items()}
+
+
+def record_provider_sources(requested_symbols, provider_rates):
+    rate_sources.inc('provider', amount=len(provider_rates))
+    if len(provider_rates) < len(requested_symbols):
+        rate_sources.inc('unavailable', amount=len(requested_symbols) - len(provider_rates))
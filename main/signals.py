@@ -0,0 +1,43 @@
+from constance.signals import config_updated
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from main.cache import tiered_cache
+from main.metrics import install_query_recorder
+from main.models import Currency, CurrencyExchangeRate, Provider
+from main.query_budget import install_sql_recorder
+from main.providers.provider_manager import ProviderManager
+from main.utils import record_rate_changes
+
+
+PROVIDER_CONFIG_KEYS = ('BEACON_BASE_URL', 'CURRENCY_BEACON_API_KEY', 'MAX_RETRIES')
+
+
+@receiver(post_save, sender=Provider)
+@receiver(post_delete, sender=Provider)
+def invalidate_provider_registry(sender, **kwargs):
+    ProviderManager.invalidate()
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def invalidate_currency_registry(sender, **kwargs):
+    tiered_cache.invalidate('currency')
+
+
+@receiver(post_save, sender=CurrencyExchangeRate)
+@receiver(post_delete, sender=CurrencyExchangeRate)
+def log_rate_change(sender, instance, **kwargs):
+    record_rate_changes([(instance.source_currency_id, instance.valuation_date)])
+
+
+@receiver(config_updated)
+def invalidate_config(sender, key, old_value, new_value, **kwargs):
+    tiered_cache.invalidate('constance')
+    if key in PROVIDER_CONFIG_KEYS:
+        ProviderManager.invalidate()
+
+
+connection_created.connect(install_query_recorder)
+connection_created.connect(install_sql_recorder)
@@ -1,15 +1,57 @@
+from datetime import datetime
+from django.core.cache import cache
+from django.utils import timezone
+
 from backbase.celery_app import app
+from main.cache import cached_config, tiered_cache
 from main.providers.currency_beacon import CurrencyBeaconProvider
+from main.providers.provider_manager import ProviderManager
+from main.rate_engine import get_snapshot_cache_key
+from main.services import get_rate
 from main.utils import save_exchange_rates
 
 
-@app.task(name='Save Historical Data')
+@app.task(bind=True, name='Save Historical Data')
 def fetch_and_save_historical_exchange_rate(self, source_currency, exchanged_currency, date):
-    provider = CurrencyBeaconProvider()
-    result = provider.get_historical_exchange_rate(source_currency, exchanged_currency, date)
-    
-    if result:
-        save_exchange_rates(result)
-    else:
-        self.retry(countdown=60, max_retries=3)
+    valuation_date = datetime.strptime(date, "%Y-%m-%d").date() if isinstance(date, str) else date
+    rate = get_rate((source_currency, exchanged_currency), valuation_date)
+
+    if rate is None:
+        raise self.retry(countdown=60, max_retries=3)
+
+
+@app.task(bind=True, name='Prefetch Daily Snapshots')
+def prefetch_daily_snapshots(self):
+    """
+    Pull the full latest snapshot for every PREFETCH_BASE_CURRENCIES base, store it and
+    warm the cache keys the providers and the rate engine read, so the first request of
+    the day for any pair does not wait on an upstream call.
+    """
+    valuation_date = timezone.now().date()
+    provider_manager = ProviderManager.get_instance()
+    failed_currencies = []
+
+    for base_currency in cached_config.PREFETCH_BASE_CURRENCIES.split(','):
+        base_currency = base_currency.strip().upper()
+        if not base_currency:
+            continue
+
+        rates = provider_manager.get_exchange_rates(base_currency, None)
+        if not rates:
+            failed_currencies.append(base_currency)
+            continue
+
+        save_exchange_rates({'base': base_currency, 'date': valuation_date.isoformat(), 'rates': rates})
+        tiered_cache.set_many(
+            {CurrencyBeaconProvider.get_cache_key(base_currency, code): rate for code, rate in rates.items()},
+            timeout=cached_config.CACHE_TIMEOUT
+        )
+        if base_currency == cached_config.ANCHOR_CURRENCY:
+            cache.set(
+                get_snapshot_cache_key(base_currency, valuation_date),
+                {code: str(rate) for code, rate in rates.items()},
+                timeout=cached_config.CACHE_TIMEOUT
+            )
 
+    if failed_currencies:
+        raise self.retry(countdown=300, max_retries=3, exc=Exception(f"No snapshot for {', '.join(failed_currencies)}"))
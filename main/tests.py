@@ -1,3 +1,1294 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import math
+import os
+import requests
+import tempfile
+import threading
+import time
+import uuid
 
-# Create your tests here.
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from statistics import fmean, pstdev
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+
+from main.admin import CurrencyExchangeRateAdmin, parse_seek_cursor
+from main.analytics import SCALE, summarize_series
+from main.cache import cached_config, tiered_cache
+from main.coalescing import asingle_flight, fetch_role, get_fetch_role, in_flight, single_flight
+from main.fake_beacon import FakeCurrencyBeaconServer
+from main.history import get_timeseries_rates, iter_timeseries_rates
+from main.importers import detect_format, iter_records, parse_rate
+from main.management.commands.benchmark import get_percentile
+from main.metrics import circuit_skips
+from main.models import Currency, CurrencyExchangeRate, MissingExchangeRate, Provider
+from main.parsers import CSVParser
+from main.providers.circuit_breaker import CLOSED, DEGRADED, HALF_OPEN, OPEN, CircuitBreaker
+from main.providers.currency_beacon import CurrencyBeaconProvider, CurrencyBeaconProviderException
+from main.providers.provider_manager import ProviderManager, call_provider, get_available_symbols
+from main.query_budget import QueryBudgetExceeded, assert_max_queries, get_repeated_queries, normalize_sql
+from main.rate_engine import FAILED_SNAPSHOT_TIMEOUT, RateEngine, get_snapshot_cache_key
+from main.series_store import NO_RATE, series_store
+from main.services import get_dated_rates, get_latest_rates, get_rate
+from main.tasks import prefetch_daily_snapshots
+from main.utils import get_currency_registry, save_exchange_rates, upsert_rate_rows
+from main.views import ExchangeRateView
+
+
+CODES = ['USD', 'EUR', 'GBP', 'JPY', 'CHF', 'CAD', 'AUD', 'NZD', 'SEK', 'NOK', 'DKK', 'PLN', 'CZK', 'HUF']
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class QueryBudgetTests(TestCase):
+    """
+    Endpoints stay within the query budgets they declare, whatever the size of the request.
+    The budget middleware raises in this mode, so going over fails the request.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Currency.objects.bulk_create([Currency(code=code, name=code, symbol=code) for code in CODES])
+        currencies = Currency.objects.in_bulk(field_name='code')
+        today = timezone.now().date()
+        CurrencyExchangeRate.objects.bulk_create([
+            CurrencyExchangeRate(
+                source_currency=currencies['USD'], exchanged_currency=currencies[code],
+                valuation_date=today - timedelta(days=days_ago), rate_value=Decimal('1.5') + days_ago
+            )
+            for code in CODES[1:] for days_ago in range(3)
+        ])
+
+    def setUp(self):
+        tiered_cache.invalidate('currency')
+        tiered_cache.invalidate('exchange_rate')
+        # Budgets describe the steady state: the registry and config are already cached.
+        get_currency_registry()
+        cached_config.MAX_RATE_AGE_DAYS
+
+    def test_cached_exchange_rate(self):
+        with assert_max_queries(1):
+            response = self.client.get('/api/exchange-rate/USD/EUR/')
+        self.assertEqual(response.status_code, 200)
+        with assert_max_queries(0):
+            response = self.client.get('/api/exchange-rate/USD/EUR/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conversion_queries_do_not_grow_with_targets(self):
+        for target_currencies in (CODES[1:3], CODES[1:]):
+            body = {'source_currency': 'USD', 'target_currencies': target_currencies, 'amount': '10'}
+            with assert_max_queries(2):
+                response = self.client.post('/api/converter/', json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            results = response.json()['conversion_results']
+            self.assertEqual(len(results), len(target_currencies))
+            self.assertEqual(results[0]['converted_amount'], '15.00')
+
+    def test_latest_rates_skip_stale_rates(self):
+        registry = get_currency_registry()
+        usd, eur, gbp = registry['USD']['id'], registry['EUR']['id'], registry['GBP']['id']
+        CurrencyExchangeRate.objects.filter(
+            exchanged_currency_id=eur, valuation_date__gte=timezone.now().date() - timedelta(days=1)
+        ).delete()
+
+        with assert_max_queries(1):
+            latest_rates = get_latest_rates({(usd, eur), (usd, gbp)}, max_age_days=1)
+        self.assertEqual(latest_rates, {(usd, gbp): (timezone.now().date(), Decimal('1.5'))})
+        self.assertEqual(get_latest_rates({(usd, eur)}, max_age_days=0)[(usd, eur)][1], Decimal('3.5'))
+
+    def test_dated_rates_match_each_group_only(self):
+        registry = get_currency_registry()
+        usd, eur, gbp = registry['USD']['id'], registry['EUR']['id'], registry['GBP']['id']
+        today = timezone.now().date()
+        with assert_max_queries(1):
+            dated_rates = get_dated_rates({(usd, eur, today), (usd, gbp, today - timedelta(days=2))})
+        self.assertEqual(dated_rates, {
+            (usd, eur, today): Decimal('1.5'), (usd, gbp, today - timedelta(days=2)): Decimal('3.5')
+        })
+
+    def test_bulk_csv_upload(self):
+        upload = SimpleUploadedFile(
+            'rows.csv', f"source_currency,target_currency,amount,valuation_date\nUSD,EUR,10,{timezone.now().date()}\n".encode(),
+            content_type='text/csv'
+        )
+        with assert_max_queries(3):
+            response = self.client.post('/api/converter/bulk/', {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['conversion_results'][0]['converted_amount'], '15.00')
+
+    def test_csv_parser_edge_cases(self):
+        def parse(content, encoding='utf-8'):
+            return CSVParser().parse(BytesIO(content), parser_context={'encoding': encoding})
+
+        self.assertEqual(parse(b''), [])
+        self.assertEqual(parse(b' source_currency , amount \nUSD,10\n'), [{'source_currency': 'USD', 'amount': '10'}])
+        # Extra values are dropped and missing ones read as None.
+        self.assertEqual(parse(b'a,b\n1,2,3\n4\n'), [{'a': '1', 'b': '2'}, {'a': '4', 'b': None}])
+        self.assertEqual(parse('a\n\u00e9\n'.encode('latin-1'), 'latin-1'), [{'a': '\u00e9'}])
+        with self.assertRaises(ParseError):
+            parse(b'a\n\xff\n')
+
+    def test_bulk_csv_body_that_does_not_decode_is_rejected(self):
+        response = self.client.post('/api/converter/bulk/', b'source_currency\n\xff\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_missing_groups_are_fetched_concurrently(self):
+        # Both groups must be resolving at once for the barrier to let either through.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def get_rates(base_currency, symbols, valuation_date):
+            barrier.wait()
+            return {symbol: Decimal('2') for symbol in symbols}
+
+        today = timezone.now().date()
+        rows = [
+            {'source_currency': 'USD', 'target_currency': 'EUR', 'amount': '10', 'valuation_date': str(today - timedelta(days=days))}
+            for days in (10, 11)
+        ]
+        with mock.patch('main.services.rate_engine.get_rates', side_effect=get_rates), \
+                mock.patch.object(ProviderManager, 'get_instance', return_value=mock.Mock()):
+            response = self.client.post('/api/converter/bulk/', json.dumps(rows), content_type='application/json')
+        self.assertEqual([result['converted_amount'] for result in response.json()['conversion_results']], ['20.00', '20.00'])
+        self.assertEqual(CurrencyExchangeRate.objects.filter(valuation_date__lt=today - timedelta(days=9)).count(), 2)
+
+    def test_created_currencies_join_the_registry(self):
+        get_currency_registry()
+        with self.captureOnCommitCallbacks(execute=True):
+            save_exchange_rates({'base': 'USD', 'date': '2024-01-02', 'rates': {'XAU': '0.0005'}})
+        self.assertIn('XAU', get_currency_registry())
+
+    def test_converter_form_renders_from_registry(self):
+        with assert_max_queries(0):
+            response = self.client.get('/api/converter/')
+        self.assertContains(response, '<option value="%d">EUR</option>' % get_currency_registry()['EUR']['id'])
+
+    def test_authentication_queries_are_not_budgeted(self):
+        self.client.force_login(User.objects.create_user('budget', password='budget'))
+        self.client.get('/api/exchange-rate/USD/EUR/')
+        response = self.client.get('/api/exchange-rate/USD/EUR/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Query-Count'], '0')
+
+    def test_requests_over_budget_are_rejected(self):
+        url = f'/api/exchange-rate/USD/EUR/{timezone.now().date()}/'
+        with mock.patch.object(ExchangeRateView, 'query_budget', {'GET': 0}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, f"GET {url} ran 1 queries, over its budget of 0."):
+                self.client.get(url)
+
+            # Served from the cache now, within the budget.
+            tiered_cache.set(
+                f"USD_EUR_{timezone.now().date()}", {'rate_value': '1.5'}, timeout=60, namespace='exchange_rate'
+            )
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(QUERY_BUDGET_MODE='warn')
+    def test_warn_mode_only_reports(self):
+        with mock.patch.object(ExchangeRateView, 'query_budget', {'GET': 0}), \
+                mock.patch('builtins.print') as print_problem:
+            response = Client().get('/api/exchange-rate/USD/EUR/')
+        self.assertEqual(response.status_code, 200)
+        print_problem.assert_called_once()
+        self.assertIn('over its budget of 0', print_problem.call_args.args[0])
+
+    def test_repeated_query_shapes_are_flagged(self):
+        with self.assertRaisesMessage(AssertionError, 'possible N+1'):
+            with assert_max_queries(None):
+                for code in CODES[:4]:
+                    Currency.objects.get(code=code)
+
+    def test_normalize_sql_collapses_in_lists(self):
+        self.assertEqual(
+            normalize_sql('SELECT * FROM t WHERE id IN (%s, %s, %s) LIMIT 21'),
+            normalize_sql('SELECT * FROM t WHERE id IN (%s, %s) LIMIT 21'),
+        )
+        self.assertEqual(get_repeated_queries(['SELECT 1', 'SELECT 2'], threshold=2), {'SELECT %s': 2})
+
+
+class FakeProvider:
+
+    def __init__(self, rates=None, error=None, fetch=None):
+        self.rates = rates or {}
+        self.error = error
+        self.fetch = fetch
+        self.calls = 0
+        self.timeseries_calls = []
+
+    def iter_timeseries_exchange_rate(self, source_currency, from_date, to_date, symbols):
+        self.timeseries_calls.append((from_date, to_date, symbols))
+        valuation_date = from_date
+        while valuation_date <= to_date:
+            yield {valuation_date.isoformat(): dict(self.rates)}
+            valuation_date += timedelta(days=1)
+
+    def get_exchange_rates(self, source_currency, symbols, valuation_date=None):
+        self.calls += 1
+        if self.fetch:
+            return self.fetch()
+        if self.error:
+            raise self.error
+        return dict(self.rates)
+
+
+def get_provider_entry(provider):
+    name = f"test-{uuid.uuid4().hex}"
+    return {
+        "name": name, "provider": provider, "async_provider": provider, "priority": 1,
+        "circuit_breaker": CircuitBreaker(name),
+    }
+
+
+def get_test_currency():
+    # Negative cache keys are not namespaced, so each test quotes its own source currency.
+    return uuid.uuid4().hex[:8].upper()
+
+
+class ProviderFailureTests(TestCase):
+    """
+    Circuit breaker transitions and what provider failures leave behind in the caches.
+    """
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(f"test-{uuid.uuid4().hex}")
+
+    def open_circuit(self):
+        for _ in range(cached_config.CIRCUIT_FAILURE_THRESHOLD):
+            self.breaker.record_failure(self.breaker.before_call())
+
+    def expire_open_circuit(self):
+        cache.set(self.breaker.opened_at_key, time.time() - cached_config.CIRCUIT_RESET_TIMEOUT - 1, timeout=None)
+
+    def test_failures_open_the_circuit(self):
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.breaker.record_failure(self.breaker.before_call())
+        self.assertEqual(self.breaker.state(), DEGRADED)
+        self.open_circuit()
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertIsNone(self.breaker.before_call())
+
+    def test_half_open_circuit_lets_one_probe_through(self):
+        self.open_circuit()
+        self.expire_open_circuit()
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+        probe_state = self.breaker.before_call()
+        self.assertEqual(probe_state, HALF_OPEN)
+        self.assertIsNone(self.breaker.before_call())
+
+        self.breaker.record_success(probe_state)
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        self.open_circuit()
+        self.expire_open_circuit()
+        self.breaker.record_failure(self.breaker.before_call())
+        self.assertEqual(self.breaker.state(), OPEN)
+
+    def test_open_circuit_is_skipped_until_the_probe(self):
+        primary = FakeProvider(rates={'EUR': Decimal('0.9')})
+        secondary = FakeProvider(rates={'EUR': Decimal('0.8')})
+        primary_entry = get_provider_entry(primary)
+        self.breaker = primary_entry["circuit_breaker"]
+        provider_entries = [primary_entry, get_provider_entry(secondary)]
+        with mock.patch.object(ProviderManager, 'load_providers_from_db', return_value=provider_entries):
+            provider_manager = ProviderManager()
+        self.open_circuit()
+        skips = circuit_skips.values.get((primary_entry["name"],), 0)
+
+        with mock.patch('main.providers.provider_manager.cached_config', mock.Mock(PROVIDER_STRATEGY='failover')):
+            self.assertEqual(provider_manager.get_exchange_rates(get_test_currency(), ['EUR']), {'EUR': Decimal('0.8')})
+            self.assertEqual(primary.calls, 0)
+            self.assertEqual(circuit_skips.values[(primary_entry["name"],)], skips + 1)
+
+            self.expire_open_circuit()
+            self.assertEqual(provider_manager.get_exchange_rates(get_test_currency(), ['EUR']), {'EUR': Decimal('0.9')})
+        self.assertEqual(primary.calls, 1)
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+    def test_only_the_leader_records_a_coalesced_failure(self):
+        release = threading.Event()
+        flight_key = f"test-{uuid.uuid4().hex}"
+
+        def fetch():
+            release.wait(5)
+            raise ConnectionError("upstream down")
+
+        provider_entry = get_provider_entry(FakeProvider(fetch=lambda: single_flight(flight_key, fetch)))
+        threads = [threading.Thread(target=call_provider, args=(provider_entry, 'USD', ['EUR'])) for _ in range(3)]
+        threads[0].start()
+        while flight_key not in in_flight:
+            time.sleep(0.01)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(cache.get(provider_entry["circuit_breaker"].failures_key), 1)
+
+    def test_only_answered_symbols_are_negative_cached(self):
+        source_currency = get_test_currency()
+        failing_entry = get_provider_entry(FakeProvider(error=ConnectionError("upstream down")))
+        with mock.patch.object(ProviderManager, 'load_providers_from_db', return_value=[failing_entry]):
+            self.assertEqual(ProviderManager().get_exchange_rates(source_currency, ['EUR', 'GBP']), {})
+        self.assertEqual(get_available_symbols(source_currency, ['EUR', 'GBP']), ['EUR', 'GBP'])
+
+        answering_entry = get_provider_entry(FakeProvider(rates={'GBP': Decimal('0.8')}))
+        with mock.patch.object(ProviderManager, 'load_providers_from_db', return_value=[answering_entry]):
+            self.assertEqual(ProviderManager().get_exchange_rates(source_currency, ['EUR', 'GBP']), {'GBP': Decimal('0.8')})
+        self.assertEqual(get_available_symbols(source_currency, ['EUR', 'GBP']), ['GBP'])
+
+
+    def test_hedge_beats_a_slow_primary_under_load(self):
+        release = threading.Event()
+        slow_entry = get_provider_entry(FakeProvider(fetch=lambda: release.wait(5) and {'EUR': Decimal('1')}))
+        fast_entry = get_provider_entry(FakeProvider(rates={'EUR': Decimal('0.9')}))
+        hedge_config = mock.Mock(PROVIDER_STRATEGY='hedged', PROVIDER_HEDGE_DELAY=0.05)
+        with mock.patch.object(ProviderManager, 'load_providers_from_db', return_value=[slow_entry, fast_entry]):
+            provider_manager = ProviderManager()
+
+        # More concurrent requests than the slow provider has workers.
+        results = []
+        with mock.patch('main.providers.provider_manager.PROVIDER_POOL_SIZE', 2), \
+                mock.patch('main.providers.provider_manager.cached_config', hedge_config):
+            threads = [
+                threading.Thread(target=lambda: results.append(
+                    provider_manager.get_exchange_rates(get_test_currency(), ['EUR'])
+                ))
+                for _ in range(4)
+            ]
+            started_at = time.monotonic()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+            elapsed = time.monotonic() - started_at
+        release.set()
+
+        self.assertLess(elapsed, 2)
+        self.assertEqual(results, [{'EUR': Decimal('0.9')}] * 4)
+
+    def test_rejected_requests_are_failures(self):
+        source_currency = get_test_currency()
+        provider = CurrencyBeaconProvider(base_url='http://beacon.test', api_key='key')
+        provider_entry = get_provider_entry(provider)
+        for status_code in (401, 429):
+            with self.subTest(status_code), \
+                    mock.patch.object(provider.session, 'get', return_value=mock.Mock(status_code=status_code)):
+                self.assertIsNone(call_provider(provider_entry, source_currency, ['EUR']))
+        self.assertEqual(cache.get(provider_entry["circuit_breaker"].failures_key), 2)
+
+        with mock.patch.object(ProviderManager, 'load_providers_from_db', return_value=[provider_entry]), \
+                mock.patch.object(provider.session, 'get', return_value=mock.Mock(status_code=429)):
+            self.assertEqual(ProviderManager().get_exchange_rates(source_currency, ['EUR']), {})
+        self.assertEqual(get_available_symbols(source_currency, ['EUR']), ['EUR'])
+
+
+class ExchangeRateViewTests(TestCase):
+    """
+    Reading a rate never writes: no Currency is created and stored rates are only selected.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Currency.objects.bulk_create([Currency(code=code, name=code, symbol=code) for code in ('USD', 'EUR')])
+        cls.valuation_date = timezone.now().date() - timedelta(days=2)
+        CurrencyExchangeRate.objects.create(
+            source_currency=Currency.objects.get(code='USD'), exchanged_currency=Currency.objects.get(code='EUR'),
+            valuation_date=cls.valuation_date, rate_value=Decimal('0.9')
+        )
+
+    def setUp(self):
+        tiered_cache.invalidate('currency')
+        tiered_cache.invalidate('exchange_rate')
+        patcher = mock.patch.object(ProviderManager, 'get_instance')
+        self.get_instance = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stored_rate_is_only_selected(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/exchange-rate/usd/eur/{self.valuation_date}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.json()['rate_value']), Decimal('0.9'))
+        self.assertTrue(queries.captured_queries)
+        for query in queries.captured_queries:
+            self.assertTrue(query['sql'].upper().startswith('SELECT'), query['sql'])
+        self.get_instance.assert_not_called()
+
+    def test_unknown_currency_is_not_created(self):
+        response = self.client.get('/api/exchange-rate/USD/JPY/')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Currency.objects.filter(code='JPY').exists())
+        self.get_instance.assert_not_called()
+
+    def test_invalid_code_and_date_are_rejected(self):
+        self.assertEqual(self.client.get('/api/exchange-rate/USD/XXXX/').status_code, 400)
+        self.assertEqual(self.client.get('/api/exchange-rate/USD/EUR/2024-13-45/').status_code, 400)
+        self.get_instance.assert_not_called()
+
+
+class ConditionalGetTests(TestCase):
+    """
+    Rate and currency reads carry validators and answer a matching conditional GET with 304.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Currency.objects.bulk_create([Currency(code=code, name=code, symbol=code) for code in ('USD', 'EUR')])
+        usd, eur = Currency.objects.get(code='USD'), Currency.objects.get(code='EUR')
+        cls.past_date = timezone.now().date() - timedelta(days=2)
+        CurrencyExchangeRate.objects.bulk_create([
+            CurrencyExchangeRate(source_currency=usd, exchanged_currency=eur, valuation_date=valuation_date, rate_value=rate)
+            for valuation_date, rate in ((cls.past_date, Decimal('0.9')), (timezone.now().date(), Decimal('0.8')))
+        ])
+
+    def setUp(self):
+        tiered_cache.invalidate('currency')
+        tiered_cache.invalidate('exchange_rate')
+
+    def test_past_rate_is_immutable(self):
+        url = f'/api/exchange-rate/USD/EUR/{self.past_date}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+        for _ in range(2):
+            # Matched from the database, then from the cache.
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified.content, b'')
+            self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_todays_rate_may_change(self):
+        response = self.client.get('/api/exchange-rate/USD/EUR/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertIn(f'max-age={cached_config.CACHE_TIMEOUT}', response['Cache-Control'])
+
+    def test_currency_etag_changes_with_the_currencies(self):
+        response = self.client.get('/api/currencies/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get('/api/currencies/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertNotEqual(self.client.get('/api/currencies/EUR/')['ETag'], response['ETag'])
+
+        Currency.objects.filter(code='EUR').get().save()
+        changed = self.client.get('/api/currencies/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+
+class ProviderRegistryTests(TestCase):
+    """
+    One ProviderManager per process, rebuilt only when the Provider table changes.
+    """
+
+    def setUp(self):
+        ProviderManager.invalidate()
+        self.addCleanup(ProviderManager.invalidate)
+
+    def test_instance_is_shared_until_a_provider_changes(self):
+        manager = ProviderManager.get_instance()
+        with self.assertNumQueries(0):
+            self.assertIs(ProviderManager.get_instance(), manager)
+
+        provider = Provider.objects.create(name='mock', class_path='main.providers.mock_provider.MockProvider')
+        rebuilt = ProviderManager.get_instance()
+        self.assertIsNot(rebuilt, manager)
+        self.assertEqual([entry['name'] for entry in rebuilt.providers], ['mock'])
+        self.assertIs(ProviderManager.get_instance(), rebuilt)
+
+        provider.active = False
+        provider.save()
+        self.assertEqual(ProviderManager.get_instance().providers, [])
+
+    def test_other_processes_see_the_new_version(self):
+        manager = ProviderManager.get_instance()
+        # Another process changed a provider: only the shared version moved.
+        tiered_cache.invalidate('provider')
+        self.assertIsNot(ProviderManager.get_instance(), manager)
+
+
+class PrefetchTests(TestCase):
+    """
+    The daily prefetch stores each base's snapshot and warms the keys rate reads look up.
+    """
+
+    def setUp(self):
+        tiered_cache.invalidate('currency')
+        self.provider = FakeProvider(rates={'EUR': Decimal('0.9'), 'GBP': Decimal('0.8')})
+        with mock.patch.object(ProviderManager, 'load_providers_from_db', return_value=[get_provider_entry(self.provider)]):
+            self.provider_manager = ProviderManager()
+
+    def prefetch(self, base_currencies):
+        prefetch_config = mock.Mock(PREFETCH_BASE_CURRENCIES=base_currencies, ANCHOR_CURRENCY='USD', CACHE_TIMEOUT=60)
+        with mock.patch('main.tasks.cached_config', prefetch_config), \
+                mock.patch.object(ProviderManager, 'get_instance', return_value=self.provider_manager), \
+                self.captureOnCommitCallbacks(execute=True):
+            prefetch_daily_snapshots.run()
+
+    def test_snapshots_are_stored_and_cached(self):
+        today = timezone.now().date()
+        self.prefetch(' usd, ,')
+
+        self.assertEqual(self.provider.calls, 1)
+        self.assertEqual(
+            dict(CurrencyExchangeRate.objects.filter(source_currency__code='USD', valuation_date=today).values_list(
+                'exchanged_currency__code', 'rate_value'
+            )),
+            {'EUR': Decimal('0.9'), 'GBP': Decimal('0.8')}
+        )
+        self.assertEqual(tiered_cache.get(CurrencyBeaconProvider.get_cache_key('USD', 'EUR')), Decimal('0.9'))
+        self.assertEqual(cache.get(get_snapshot_cache_key('USD', today)), {'EUR': '0.9', 'GBP': '0.8'})
+
+    def test_bases_without_a_snapshot_are_retried(self):
+        self.provider.rates = {}
+        with self.assertRaisesMessage(Exception, "No snapshot for USD"):
+            self.prefetch('USD')
+        self.assertFalse(CurrencyExchangeRate.objects.exists())
+
+
+class CoalescingTests(TestCase):
+    """
+    Concurrent misses on one key make a single upstream fetch, within a process and across
+    workers sharing the cache.
+    """
+
+    def setUp(self):
+        self.key = f"test-{uuid.uuid4().hex}"
+        self.calls = 0
+        self.release = threading.Event()
+        # Roles are per request; the middleware resets them, the tests do it here.
+        self.addCleanup(fetch_role.reset, fetch_role.set(None))
+
+    def fetch(self):
+        self.calls += 1
+        self.release.wait(5)
+        return {'EUR': Decimal('0.9')}
+
+    def fetch_with_role(self, results):
+        results.append((single_flight(self.key, self.fetch), get_fetch_role()))
+
+    def test_concurrent_misses_share_one_fetch(self):
+        results = []
+        threads = [threading.Thread(target=self.fetch_with_role, args=(results,)) for _ in range(5)]
+        threads[0].start()
+        while self.key not in in_flight:
+            time.sleep(0.001)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([result for result, _ in results], [{'EUR': Decimal('0.9')}] * 5)
+        self.assertEqual(sorted(role for _, role in results), ['follower'] * 4 + ['leader'])
+        self.assertNotIn(self.key, in_flight)
+
+    def test_other_workers_result_is_reused(self):
+        # Another worker holds the lock and publishes its result shortly.
+        cache.add(f"single_flight:{self.key}:lock", 1)
+        threading.Timer(0.1, cache.set, (f"single_flight:{self.key}:result", {'EUR': Decimal('0.8')})).start()
+        self.release.set()
+
+        results = []
+        self.fetch_with_role(results)
+        self.assertEqual(results, [({'EUR': Decimal('0.8')}, 'follower')])
+        self.assertEqual(self.calls, 0)
+
+    def test_lock_released_without_a_result_fetches_again(self):
+        cache.add(f"single_flight:{self.key}:lock", 1)
+        threading.Timer(0.1, cache.delete, (f"single_flight:{self.key}:lock",)).start()
+        self.release.set()
+
+        results = []
+        self.fetch_with_role(results)
+        self.assertEqual(results, [({'EUR': Decimal('0.9')}, 'leader')])
+        self.assertEqual(self.calls, 1)
+
+    def test_async_misses_share_one_fetch(self):
+        # Read here, so the coroutines find the config in the cache.
+        cached_config.API_REQUEST_TIMEOUT
+
+        async def afetch():
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            return {'EUR': Decimal('0.9')}
+
+        async def fetch_all():
+            return await asyncio.gather(*(asingle_flight(self.key, afetch) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(fetch_all()), [{'EUR': Decimal('0.9')}] * 5)
+        self.assertEqual(self.calls, 1)
+
+
+class GapFillingTests(TestCase):
+    """
+    Past dates are fetched from the providers once, including the symbols they do not
+    publish.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # ZZZ is a stored currency no provider quotes.
+        Currency.objects.bulk_create([Currency(code=code, name=code, symbol=code) for code in ('USD', 'EUR', 'GBP', 'ZZZ')])
+
+    def setUp(self):
+        tiered_cache.invalidate('currency')
+        series_store.clear()
+        # Rate changes are logged on commit, which the test transaction never reaches.
+        patcher = mock.patch('main.utils.transaction.on_commit', side_effect=lambda callback: callback())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.provider = FakeProvider(rates={'EUR': Decimal('0.9'), 'GBP': Decimal('0.8')})
+        with mock.patch.object(ProviderManager, 'load_providers_from_db', return_value=[get_provider_entry(self.provider)]):
+            self.provider_manager = ProviderManager()
+
+    def get_timeseries_rates(self, from_date, to_date, symbols=None):
+        with mock.patch.object(ProviderManager, 'get_instance', return_value=self.provider_manager):
+            return get_timeseries_rates('USD', from_date, to_date, symbols)
+
+    def test_unpublished_symbols_are_not_fetched_again(self):
+        today = timezone.now().date()
+        from_date, to_date = today - timedelta(days=10), today - timedelta(days=3)
+
+        timeseries = self.get_timeseries_rates(from_date, to_date)
+        self.assertEqual(len(timeseries), 8)
+        self.assertEqual(timeseries[from_date.isoformat()], {'EUR': Decimal('0.9'), 'GBP': Decimal('0.8')})
+        self.assertEqual(len(self.provider.timeseries_calls), 1)
+        self.assertEqual(MissingExchangeRate.objects.count(), 8)
+
+        self.assertEqual(self.get_timeseries_rates(from_date, to_date), timeseries)
+        self.assertEqual(self.get_timeseries_rates(from_date, to_date, 'EUR,ZZZ'), {
+            valuation_date: {'EUR': rates['EUR']} for valuation_date, rates in timeseries.items()
+        })
+        self.assertEqual(len(self.provider.timeseries_calls), 1)
+
+    def test_windows_are_filled_as_they_are_streamed(self):
+        today = timezone.now().date()
+        from_date = today - timedelta(days=10)
+        # Chunks of two 2-day provider windows.
+        with mock.patch('main.history.cached_config', mock.Mock(TIMESERIES_WINDOW_DAYS=2, TIMESERIES_MAX_WORKERS=2)), \
+                mock.patch.object(ProviderManager, 'get_instance', return_value=self.provider_manager):
+            windows = iter_timeseries_rates('USD', from_date, today - timedelta(days=3))
+            self.assertEqual(next(windows), {from_date.isoformat(): {'EUR': Decimal('0.9'), 'GBP': Decimal('0.8')}})
+            self.assertEqual(
+                [call[:2] for call in self.provider.timeseries_calls], [(from_date, from_date + timedelta(days=3))]
+            )
+            self.assertEqual(len(list(windows)), 7)
+        self.assertEqual(len(self.provider.timeseries_calls), 2)
+        # Later reads of the range only check for gaps; the rates come from the series store.
+        self.assertTrue(series_store.series)
+        with mock.patch.object(ProviderManager, 'get_instance', return_value=self.provider_manager), \
+                self.assertNumQueries(3):
+            self.assertEqual(len(self.get_timeseries_rates(from_date, today - timedelta(days=3))), 8)
+
+    def test_a_failed_window_keeps_the_others(self):
+        today = timezone.now().date()
+        from_date, to_date = today - timedelta(days=9), today - timedelta(days=4)
+        failed_from = from_date + timedelta(days=2)
+        failing = [True]
+
+        def fetch_timeseries_window(source_currency, window_from, window_to, symbols, timeout):
+            if window_from == failed_from and failing[0]:
+                raise CurrencyBeaconProviderException("upstream down")
+            return {
+                (window_from + timedelta(days=offset)).isoformat(): {'EUR': Decimal('0.9'), 'GBP': Decimal('0.8')}
+                for offset in range((window_to - window_from).days + 1)
+            }
+
+        provider = CurrencyBeaconProvider(base_url='http://beacon.test', api_key='test')
+        provider.fetch_timeseries_window = mock.Mock(side_effect=fetch_timeseries_window)
+        with mock.patch.object(ProviderManager, 'load_providers_from_db', return_value=[get_provider_entry(provider)]):
+            self.provider_manager = ProviderManager()
+
+        # Three 2-day windows, the middle one failing.
+        beacon_config = mock.Mock(TIMESERIES_WINDOW_DAYS=2, TIMESERIES_MAX_WORKERS=3, API_REQUEST_TIMEOUT=5)
+        with mock.patch('main.providers.currency_beacon.cached_config', beacon_config):
+            timeseries = self.get_timeseries_rates(from_date, to_date)
+            self.assertEqual(len(timeseries), 4)
+            self.assertNotIn(failed_from.isoformat(), timeseries)
+            # ZZZ is remembered missing on the answered dates only.
+            self.assertEqual(MissingExchangeRate.objects.count(), 4)
+
+            failing[0] = False
+            provider.fetch_timeseries_window.reset_mock()
+            self.assertEqual(len(self.get_timeseries_rates(from_date, to_date)), 6)
+        self.assertEqual(
+            [call.args[1:3] for call in provider.fetch_timeseries_window.call_args_list],
+            [(failed_from, failed_from + timedelta(days=1))]
+        )
+
+    def test_failed_fetches_are_not_remembered(self):
+        today = timezone.now().date()
+        self.provider.iter_timeseries_exchange_rate = mock.Mock(side_effect=ConnectionError("upstream down"))
+
+        self.assertEqual(self.get_timeseries_rates(today - timedelta(days=10), today - timedelta(days=3)), {})
+        self.assertFalse(MissingExchangeRate.objects.exists())
+
+
+class SeriesStoreTests(TestCase):
+    """
+    The in-process rate series pick up every committed write, including updates of past
+    rates, rows committed after later ones were read and deletes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Currency.objects.bulk_create([Currency(code=code, name=code, symbol=code) for code in ('USD', 'EUR')])
+
+    def setUp(self):
+        tiered_cache.invalidate('currency')
+        series_store.clear()
+        currency_registry = get_currency_registry()
+        self.pair = (currency_registry['USD']['id'], currency_registry['EUR']['id'])
+        self.today = timezone.now().date()
+        # Ids left free below these rows for test_late_commits_below_the_read_rows_are_seen.
+        CurrencyExchangeRate.objects.bulk_create([
+            CurrencyExchangeRate(
+                id=100 + days, source_currency_id=self.pair[0], exchanged_currency_id=self.pair[1],
+                valuation_date=self.today - timedelta(days=days), rate_value=Decimal('0.9')
+            )
+            for days in range(5, 10)
+        ])
+
+    def save_rates(self, rates):
+        with self.captureOnCommitCallbacks(execute=True):
+            upsert_rate_rows([(*self.pair, valuation_date, rate) for valuation_date, rate in rates.items()])
+
+    def get_rates(self):
+        (_, first_ordinal, values), = series_store.get_slices('USD', self.today - timedelta(days=30), self.today, ['EUR'])
+        return {
+            date.fromordinal(first_ordinal + offset).isoformat(): value
+            for offset, value in enumerate(values) if value != NO_RATE
+        }
+
+    def test_unchanged_series_are_read_without_queries(self):
+        rates = self.get_rates()
+        self.assertEqual(len(rates), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_rates(), rates)
+
+    def test_updated_past_rates_are_seen(self):
+        self.get_rates()
+        self.save_rates({self.today - timedelta(days=8): Decimal('0.95')})
+        self.assertEqual(self.get_rates()[(self.today - timedelta(days=8)).isoformat()], 950000)
+
+    def test_late_commits_below_the_read_rows_are_seen(self):
+        self.get_rates()
+        # A row committed after higher ids were read, as a slower concurrent write would.
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyExchangeRate.objects.create(
+                id=1, source_currency_id=self.pair[0], exchanged_currency_id=self.pair[1],
+                valuation_date=self.today - timedelta(days=20), rate_value=Decimal('0.8')
+            )
+        self.assertEqual(self.get_rates()[(self.today - timedelta(days=20)).isoformat()], 800000)
+
+    def test_deleted_rates_are_dropped(self):
+        self.get_rates()
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyExchangeRate.objects.filter(valuation_date=self.today - timedelta(days=7)).delete()
+        rates = self.get_rates()
+        self.assertEqual(len(rates), 4)
+        self.assertNotIn((self.today - timedelta(days=7)).isoformat(), rates)
+
+
+
+class AdminSeekTests(TestCase):
+    """
+    The rate changelist seeks with ?before= under its default ordering only, links to older
+    rates only when there are some and keeps the cursor in its own links.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Currency.objects.bulk_create([Currency(code=code, name=code, symbol=code) for code in ('USD', 'EUR')])
+        currencies = Currency.objects.in_bulk(field_name='code')
+        today = timezone.now().date()
+        cls.rates = CurrencyExchangeRate.objects.bulk_create([
+            CurrencyExchangeRate(
+                source_currency=currencies['USD'], exchanged_currency=currencies['EUR'],
+                valuation_date=today - timedelta(days=days), rate_value=Decimal('0.9')
+            )
+            for days in range(5)
+        ])
+        cls.user = User.objects.create_superuser('admin', password='admin')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        patcher = mock.patch.object(CurrencyExchangeRateAdmin, 'list_per_page', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_changelist(self, query=''):
+        response = self.client.get(f'/admin/main/currencyexchangerate/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def get_dates(self, response):
+        return [rate.valuation_date for rate in response.context['cl'].result_list]
+
+    def test_older_rates_are_linked_until_the_last_row(self):
+        response = self.get_changelist()
+        pages = [self.get_dates(response)]
+        while response.context.get('seek_next_url'):
+            response = self.get_changelist(response.context['seek_next_url'])
+            pages.append(self.get_dates(response))
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), [rate.valuation_date for rate in self.rates])
+
+    def test_rates_of_one_date_are_paged_by_id(self):
+        # Seven rates, three of them dated today, so pages break within a date.
+        usd = Currency.objects.get(code='USD')
+        today = timezone.now().date()
+        for code in ('GBP', 'JPY'):
+            CurrencyExchangeRate.objects.create(
+                source_currency=usd, exchanged_currency=Currency.objects.create(code=code, name=code),
+                valuation_date=today, rate_value=Decimal('1.1')
+            )
+
+        response = self.get_changelist()
+        pages = [[rate.pk for rate in response.context['cl'].result_list]]
+        while response.context.get('seek_next_url'):
+            response = self.get_changelist(response.context['seek_next_url'])
+            pages.append([rate.pk for rate in response.context['cl'].result_list])
+        expected = list(CurrencyExchangeRate.objects.order_by('-valuation_date', '-id').values_list('pk', flat=True))
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_invalid_cursors_show_the_first_page(self):
+        first_page = self.get_dates(self.get_changelist())
+        for before in ('yesterday', '2024-01-02', '2024-13-01:1', '2024-01-02:x'):
+            with self.subTest(before):
+                self.assertIsNone(parse_seek_cursor(before))
+                self.assertEqual(self.get_dates(self.get_changelist(f'?before={before}')), first_page)
+        self.assertEqual(parse_seek_cursor('2024-01-02:7'), (date(2024, 1, 2), 7))
+
+    def test_links_keep_the_cursor_except_sort_links(self):
+        before = f"{self.rates[1].valuation_date.isoformat()}:{self.rates[1].pk}"
+        changelist = self.get_changelist(f'?before={before}').context['cl']
+        self.assertIn(urlencode({'before': before}), changelist.get_query_string({'p': 1}))
+        self.assertIn(urlencode({'before': before}), changelist.get_query_string({'exchanged_currency__id__exact': 1}))
+        self.assertNotIn('before=', changelist.get_query_string({'o': '3'}))
+
+    def test_cursor_is_ignored_under_another_ordering(self):
+        before = f"{self.rates[1].valuation_date.isoformat()}:{self.rates[1].pk}"
+        response = self.get_changelist(f'?o=3&before={before}')
+        self.assertEqual(self.get_dates(response), [rate.valuation_date for rate in self.rates[::-1][:2]])
+        self.assertNotIn('seek_next_url', response.context)
+        self.assertNotIn('before=', response.context['cl'].get_query_string({'p': 1}))
+        # The default ordering picked from the column header still seeks.
+        response = self.get_changelist(f'?o=-3&before={before}')
+        self.assertEqual(self.get_dates(response), [rate.valuation_date for rate in self.rates[2:4]])
+
+
+class ImportRatesTests(TestCase):
+    """
+    import_rates reads every supported format and resumes after its last committed chunk.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with (gzip.open(path, 'wt') if name.endswith('.gz') else open(path, 'w')) as file:
+            file.write(content)
+        return path
+
+    def import_rates(self, path, *args):
+        call_command('import_rates', path, *args, stdout=mock.Mock())
+
+    def get_rates(self):
+        return {
+            (base, code, valuation_date.isoformat()): rate_value
+            for base, code, valuation_date, rate_value in CurrencyExchangeRate.objects.values_list(
+                'source_currency__code', 'exchanged_currency__code', 'valuation_date', 'rate_value'
+            )
+        }
+
+    def test_formats(self):
+        expected = {
+            ('EUR', 'USD', '2024-01-02'): Decimal('1.1'),
+            ('EUR', 'GBP', '2024-01-02'): Decimal('0.86'),
+        }
+        files = [
+            ('long.csv', "base,currency,date,rate\nEUR,USD,2024-01-02,1.1\nEUR,GBP,2024-01-02,0.86\nEUR,JPY,2024-01-02,N/A\n"),
+            ('wide.csv.gz', "Date,USD,GBP,JPY\n2024-01-02,1.1,0.86,N/A\n"),
+            ('rows.ndjson', '{"base": "EUR", "currency": "USD", "date": "2024-01-02", "rate": 1.1}\n'
+                            '{"base": "EUR", "rates": {"GBP": 0.86}, "date": "2024-01-02"}\n'),
+            ('rows.json', '[{"base": "EUR", "currency": "USD", "date": "2024-01-02", "rate": 1.1},'
+                          ' {"base": "EUR", "currency": "GBP", "date": "2024-01-02", "rate": 0.86}]'),
+            ('dump.json', '{"response": {"base": "EUR", "rates": {"2024-01-02": {"USD": 1.1, "GBP": 0.86}}}}'),
+        ]
+        for name, content in files:
+            with self.subTest(name):
+                CurrencyExchangeRate.objects.all().delete()
+                self.import_rates(self.write(name, content), '--base', 'EUR')
+                self.assertEqual(self.get_rates(), expected)
+
+    def test_json_arrays_are_read_across_buffer_boundaries(self):
+        content = '[ {"base": "EUR", "currency": "USD", "date": "2024-01-02", "rate": 1.123456} ,\n' \
+                  '{"base": "EUR", "currency": "GBP", "date": "2024-01-02", "rate": 12345678}]'
+        # Small enough for elements and numbers to be split between reads.
+        for read_size in (1, 7, 64):
+            with self.subTest(read_size), mock.patch('main.importers.READ_SIZE', read_size):
+                self.assertEqual(list(iter_records(StringIO(content), 'json')), [
+                    [('EUR', 'USD', '2024-01-02', Decimal('1.123456'))], [('EUR', 'GBP', '2024-01-02', 12345678)],
+                ])
+        with self.assertRaisesMessage(ValueError, 'Unterminated JSON array'):
+            list(iter_records(StringIO('[{"rate": 1}, '), 'json'))
+        with self.assertRaisesMessage(ValueError, 'Expected a JSON array or object'):
+            list(iter_records(StringIO('"rates"'), 'json'))
+        with self.assertRaisesMessage(ValueError, 'Expected a JSON object'):
+            list(iter_records(StringIO('[1]'), 'json'))
+
+    def test_csv_edge_cases(self):
+        self.assertEqual(
+            list(iter_records(StringIO("Currency,Date,Rate\n\nusd,2024-01-02,1.1\n"), 'csv', 'EUR')),
+            [[('EUR', 'usd', '2024-01-02', '1.1')]]
+        )
+        with self.assertRaisesMessage(ValueError, 'Missing columns in CSV header: currency, rate'):
+            list(iter_records(StringIO("currency,rate\nUSD,1.1\n"), 'csv', 'EUR'))
+        with self.assertRaisesMessage(ValueError, 'need the base currency'):
+            list(iter_records(StringIO("Date,USD\n2024-01-02,1.1\n"), 'csv'))
+
+    def test_invalid_rates_are_skipped(self):
+        self.assertEqual(
+            parse_rate(' eur', 'usd ', '2024-01-02T16:00:00', ' 1.10 '), ('EUR', 'USD', date(2024, 1, 2), Decimal('1.10'))
+        )
+        for rate in (None, '', 'n/a', 'abc', '0', '-1.1', 'NaN', 'Infinity'):
+            with self.subTest(rate):
+                self.assertIsNone(parse_rate('EUR', 'USD', '2024-01-02', rate))
+        self.assertIsNone(parse_rate('EUR', 'USD', '02/01/2024', '1.1'))
+        self.assertIsNone(parse_rate(None, 'USD', '2024-01-02', '1.1'))
+
+    def test_formats_are_detected_from_the_name(self):
+        self.assertEqual(detect_format('rates.jsonl.gz'), 'ndjson')
+        self.assertEqual(detect_format('eurofxref-hist.CSV'), 'csv')
+        self.assertIsNone(detect_format('rates.xml'))
+        with self.assertRaisesMessage(CommandError, 'pass --format'):
+            self.import_rates(self.write('rates.txt', ''))
+
+    def test_resume_skips_committed_chunks(self):
+        line = '{"base": "EUR", "currency": "%s", "date": "2024-01-0%d", "rate": %s}\n'
+        lines = [line % ('USD', day, '1.10') for day in range(1, 5)]
+        content = ''.join(lines)
+        # Same size, so the checkpoint still matches once the broken record is repaired.
+        path = self.write('rows.ndjson', content.replace(lines[2], '!' + lines[2][1:]))
+
+        with self.assertRaisesMessage(CommandError, 'Import stopped after 2 records'):
+            self.import_rates(path, '--chunk-size', '1')
+        with open(f"{path}.checkpoint") as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)['records'], 2)
+
+        # Committed records are skipped: the change to the first one is not imported.
+        self.write('rows.ndjson', content.replace(lines[0], lines[0].replace('1.10', '1.20')))
+        self.import_rates(path, '--chunk-size', '1', '--resume')
+        self.assertEqual(
+            [rate for _, rate in sorted(self.get_rates().items())], [Decimal('1.1')] * 4
+        )
+        self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+
+    def test_resume_rejects_a_changed_file(self):
+        path = self.write('rows.csv', "base,currency,date,rate\nEUR,USD,2024-01-02,1.1\n")
+        with open(f"{path}.checkpoint", 'w') as checkpoint_file:
+            json.dump({'records': 1, 'size': 1}, checkpoint_file)
+        with self.assertRaisesMessage(CommandError, 'changed since the checkpoint'):
+            self.import_rates(path, '--resume')
+
+
+class RateServiceTests(TestCase):
+    """
+    Rates are resolved in process: stored rates first, then the rate engine and the
+    providers, with no HTTP call back into the app.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Currency.objects.bulk_create([Currency(code=code, name=code, symbol=code) for code in ('USD', 'EUR', 'GBP')])
+        cls.valuation_date = timezone.now().date() - timedelta(days=1)
+        CurrencyExchangeRate.objects.create(
+            source_currency=Currency.objects.get(code='USD'), exchanged_currency=Currency.objects.get(code='EUR'),
+            valuation_date=cls.valuation_date, rate_value=Decimal('0.9')
+        )
+
+    def setUp(self):
+        # Negative cache entries are not namespaced.
+        cache.clear()
+        tiered_cache.invalidate('currency')
+        self.provider = FakeProvider(rates={'GBP': Decimal('0.8')})
+        with mock.patch.object(ProviderManager, 'load_providers_from_db', return_value=[get_provider_entry(self.provider)]):
+            provider_manager = ProviderManager()
+        for patcher in (
+            mock.patch.object(ProviderManager, 'get_instance', return_value=provider_manager),
+            mock.patch('main.services.rate_engine.get_rates', return_value={}),
+            mock.patch('requests.Session.request', side_effect=AssertionError("unexpected HTTP call")),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_stored_rate_is_not_fetched(self):
+        self.assertEqual(get_rate(('usd', 'eur'), self.valuation_date), Decimal('0.9'))
+        self.assertEqual(self.provider.calls, 0)
+
+    def test_missing_rate_is_fetched_once_and_stored(self):
+        self.assertEqual(get_rate(('USD', 'GBP'), self.valuation_date), Decimal('0.8'))
+        self.assertTrue(CurrencyExchangeRate.objects.filter(
+            exchanged_currency__code='GBP', valuation_date=self.valuation_date
+        ).exists())
+        self.assertEqual(get_rate(('USD', 'GBP'), self.valuation_date), Decimal('0.8'))
+        self.assertEqual(self.provider.calls, 1)
+
+    def test_unknown_rate_is_none(self):
+        self.provider.rates = {}
+        self.assertIsNone(get_rate(('USD', 'GBP'), self.valuation_date))
+
+
+class RateEngineTests(TestCase):
+    """
+    Snapshots are fetched once per date, a failure is remembered briefly and a slow fetch
+    does not hold up other dates.
+    """
+
+    def setUp(self):
+        cache.clear()
+        # Read once here so the threads below find the config in the cache.
+        cached_config.ANCHOR_CURRENCY, cached_config.CACHE_TIMEOUT
+        self.rate_engine = RateEngine()
+        self.provider_manager = mock.Mock()
+        patcher = mock.patch.object(ProviderManager, 'get_instance', return_value=self.provider_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_snapshot_is_fetched_once(self):
+        self.provider_manager.get_exchange_rates.return_value = {'EUR': Decimal('0.9'), 'GBP': Decimal('0.8')}
+        valuation_date = timezone.now().date() - timedelta(days=3)
+
+        self.assertEqual(self.rate_engine.get_rates('EUR', ['GBP'], valuation_date), {'GBP': Decimal('0.888888')})
+        self.assertEqual(self.rate_engine.get_rates('USD', ['EUR', 'GBP'], valuation_date), {
+            'EUR': Decimal('0.9'), 'GBP': Decimal('0.8')
+        })
+        # Another worker finds the snapshot in the shared cache.
+        self.assertEqual(RateEngine().get_rates('USD', ['EUR'], valuation_date), {'EUR': Decimal('0.9')})
+        self.provider_manager.get_exchange_rates.assert_called_once_with('USD', None, valuation_date)
+
+    def test_failed_snapshot_is_remembered_briefly(self):
+        self.provider_manager.get_exchange_rates.return_value = {}
+        valuation_date = timezone.now().date() - timedelta(days=3)
+
+        self.assertEqual(self.rate_engine.get_rates('USD', ['EUR'], valuation_date), {})
+        self.assertEqual(self.rate_engine.get_rates('USD', ['EUR'], valuation_date), {})
+        self.assertEqual(self.provider_manager.get_exchange_rates.call_count, 1)
+
+        later = time.monotonic() + FAILED_SNAPSHOT_TIMEOUT + 1
+        with mock.patch('main.rate_engine.time.monotonic', return_value=later):
+            self.rate_engine.get_rates('USD', ['EUR'], valuation_date)
+        self.assertEqual(self.provider_manager.get_exchange_rates.call_count, 2)
+
+    def test_slow_snapshot_does_not_block_other_dates(self):
+        today = timezone.now().date()
+        slow_date, fast_date = today - timedelta(days=3), today - timedelta(days=4)
+        started, release = threading.Event(), threading.Event()
+
+        def get_exchange_rates(source_currency, symbols, valuation_date):
+            if valuation_date == slow_date:
+                started.set()
+                release.wait(5)
+            return {'EUR': Decimal('0.9')}
+
+        self.provider_manager.get_exchange_rates.side_effect = get_exchange_rates
+        slow_fetch = threading.Thread(target=self.rate_engine.get_rates, args=('USD', ['EUR'], slow_date))
+        slow_fetch.start()
+        try:
+            self.assertTrue(started.wait(5))
+            self.assertEqual(self.rate_engine.get_rates('USD', ['EUR'], fast_date), {'EUR': Decimal('0.9')})
+            self.assertTrue(slow_fetch.is_alive())
+        finally:
+            release.set()
+            slow_fetch.join()
+        self.assertEqual(self.rate_engine.get_rates('USD', ['EUR'], slow_date), {'EUR': Decimal('0.9')})
+
+
+class MetricsTests(TestCase):
+    """
+    What the /metrics endpoint exposes after a few requests.
+    """
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        return {
+            line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in response.content.decode().splitlines() if not line.startswith('#')
+        }
+
+    def test_failed_requests_are_logged_and_counted(self):
+        errors = 'rates_http_request_errors_total{endpoint="currency-rates-analytics"}'
+        requests = 'rates_http_request_seconds_count{endpoint="currency-rates-analytics",method="GET",status="500"}'
+        before = self.scrape()
+        query = urlencode({'source_currency': 'USD', 'from_date': '2024-01-01', 'to_date': '2024-01-31'})
+
+        with mock.patch('main.views.get_rate_analytics', side_effect=RuntimeError("boom")), \
+                self.assertLogs('main.views', 'ERROR') as logs:
+            response = self.client.get(f'/api/currency-rates-analytics/?{query}')
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('RuntimeError: boom', logs.output[0])
+
+        after = self.scrape()
+        self.assertEqual(after[errors] - before.get(errors, 0), 1)
+        self.assertEqual(after[requests] - before.get(requests, 0), 1)
+
+
+class AnalyticsTests(TestCase):
+    """
+    summarize_series checked against the statistics module, and the endpoint serving it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Currency.objects.bulk_create([Currency(code=code, name=code, symbol=code) for code in ('USD', 'EUR')])
+
+    def setUp(self):
+        tiered_cache.invalidate('currency')
+        series_store.clear()
+
+    def test_summary_statistics(self):
+        # Jan 30, Jan 31, no rate on Feb 1, Feb 2.
+        rates = [1.0, 1.1, 1.0]
+        values = [int(rate * SCALE) for rate in rates]
+        values.insert(2, NO_RATE)
+        log_returns = [math.log(1.1), math.log(1 / 1.1)]
+
+        summary = summarize_series(date(2024, 1, 30).toordinal(), values, 2, 'month')
+
+        self.assertEqual(summary['points'], 3)
+        self.assertEqual(summary['max'], {'date': '2024-01-31', 'rate': Decimal('1.1')})
+        self.assertEqual(summary['last'], {'date': '2024-02-02', 'rate': Decimal('1')})
+        self.assertAlmostEqual(summary['mean'], fmean(rates), places=6)
+        self.assertAlmostEqual(summary['std'], pstdev(rates), places=6)
+        self.assertAlmostEqual(summary['volatility']['daily'], pstdev(log_returns), places=6)
+        self.assertAlmostEqual(
+            summary['volatility']['annualized'], pstdev(log_returns) * math.sqrt(2 / 3 * 365.25), places=6
+        )
+
+        january, february = summary['periods']
+        self.assertEqual((january['period'], january['open'], january['close']), ('2024-01', Decimal('1'), Decimal('1.1')))
+        self.assertEqual(january['change_pct'], 10.0)
+        self.assertAlmostEqual(january['rolling_mean'], 1.05, places=6)
+        self.assertAlmostEqual(january['rolling_std'], 0.05, places=6)
+        # Only one return by the end of January.
+        self.assertIsNone(january['rolling_volatility'])
+        self.assertEqual((february['period'], february['open'], february['close']), ('2024-02', Decimal('1'), Decimal('1')))
+        self.assertAlmostEqual(february['change_pct'], -9.0909, places=4)
+        self.assertAlmostEqual(february['rolling_mean'], fmean(rates[1:]), places=6)
+        self.assertAlmostEqual(february['rolling_std'], pstdev(rates[1:]), places=6)
+        self.assertAlmostEqual(february['rolling_volatility'], pstdev(log_returns), places=6)
+
+    def test_weeks_follow_iso_numbering(self):
+        # Sunday 2023-12-31 closes ISO week 52, Monday 2024-01-01 opens week 1.
+        summary = summarize_series(date(2023, 12, 30).toordinal(), [SCALE, SCALE * 2, SCALE * 4], 2, 'week')
+        self.assertEqual(
+            [(period['period'], period['open'], period['close']) for period in summary['periods']],
+            [('2023-W52', Decimal('1'), Decimal('2')), ('2024-W01', Decimal('4'), Decimal('4'))]
+        )
+        self.assertEqual(summary['periods'][1]['change_pct'], 100.0)
+
+    def test_endpoint(self):
+        usd, eur = Currency.objects.get(code='USD'), Currency.objects.get(code='EUR')
+        CurrencyExchangeRate.objects.bulk_create([
+            CurrencyExchangeRate(
+                source_currency=usd, exchanged_currency=eur, valuation_date=date(2024, 1, day), rate_value=rate
+            )
+            for day, rate in ((1, Decimal('0.9')), (2, Decimal('0.99')), (3, Decimal('0.9')))
+        ])
+        query = urlencode({
+            'source_currency': 'usd', 'from_date': '2024-01-01', 'to_date': '2024-01-03', 'symbols': 'EUR',
+            'window': 2, 'period': 'year',
+        })
+
+        with mock.patch.object(ProviderManager, 'get_instance') as get_instance:
+            response = self.client.get(f'/api/currency-rates-analytics/?{query}')
+        get_instance.return_value.iter_timeseries_rates.assert_not_called()
+
+        self.assertEqual(response.status_code, 200)
+        analytics = response.json()
+        self.assertEqual((analytics['base'], analytics['window'], analytics['period']), ('USD', 2, 'year'))
+        summary = analytics['rates']['EUR']
+        self.assertEqual(summary['points'], 3)
+        self.assertAlmostEqual(summary['mean'], 0.93, places=6)
+        self.assertEqual([period['period'] for period in summary['periods']], ['2024'])
+        self.assertAlmostEqual(summary['periods'][0]['rolling_mean'], 0.945, places=6)
+
+    def test_invalid_window_is_rejected(self):
+        query = urlencode({'source_currency': 'USD', 'from_date': '2024-01-01', 'to_date': '2024-01-03', 'window': 1})
+        response = self.client.get(f'/api/currency-rates-analytics/?{query}')
+        self.assertEqual(response.status_code, 400)
+
+
+class BenchmarkTests(TestCase):
+    """
+    The fake CurrencyBeacon server benchmarks run against, and the report helpers.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeCurrencyBeaconServer(symbol_count=5).start()
+        cls.addClassCleanup(cls.fake.stop)
+
+    def test_provider_reads_the_fake_server(self):
+        provider = CurrencyBeaconProvider(base_url=self.fake.base_url, api_key='test')
+        symbols = self.fake.symbols[:2]
+
+        data, code = provider.get_historical_exchange_rate('USD', '2024-01-02', ','.join(symbols))
+        self.assertEqual(code, 200)
+        self.assertEqual(data['rates'], {symbol: self.fake.get_rate('USD', symbol, '2024-01-02') for symbol in symbols})
+        self.assertEqual(self.fake.get_rate('USD', 'USD', '2024-01-02'), 1.0)
+
+        windows = list(provider.iter_timeseries_exchange_rate('USD', date(2024, 1, 1), date(2024, 1, 3), symbols[0]))
+        timeseries = {valuation_date: rates for window in windows for valuation_date, rates in window.items()}
+        self.assertEqual(list(timeseries), ['2024-01-01', '2024-01-02', '2024-01-03'])
+        self.assertEqual(timeseries['2024-01-03'], {symbols[0]: self.fake.get_rate('USD', symbols[0], '2024-01-03')})
+
+        calls = self.fake.get_calls()
+        self.assertEqual(calls['/v1/historical'], 1)
+        self.assertIn('/v1/timeseries', calls)
+
+    def test_errors_and_unknown_paths(self):
+        self.assertEqual(requests.get(f"{self.fake.base_url}/convert").status_code, 404)
+        self.fake.error_rate = 1.0
+        self.addCleanup(setattr, self.fake, 'error_rate', 0.0)
+        response = requests.get(f"{self.fake.base_url}/latest")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['meta']['code'], 500)
+
+    def test_percentiles(self):
+        latencies = [index / 1000 for index in range(1, 101)]
+        self.assertEqual(get_percentile(latencies, 50), 50.0)
+        self.assertEqual(get_percentile(latencies, 99), 99.0)
+        self.assertEqual(get_percentile(latencies[:1], 95), 1.0)
+        self.assertIsNone(get_percentile([], 50))
+
+    def test_unknown_scenarios_are_rejected(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('benchmark', scenarios='currencies,latest', stdout=stdout, stderr=stderr)
+        self.assertIn('Unknown scenarios: latest', stderr.getvalue())
+        self.assertEqual(stdout.getvalue(), '')
@@ -1,14 +1,21 @@
 from django.urls import path
-from main.views import ExchangeRateView, CurrencyConverterAPIView, get_target_currencies, HistoricalCurrencyRate, TimeseriesCurrencyRate, CurrencyAPIView
+from main.async_views import AsyncCurrencyConverterView, AsyncExchangeRateView, AsyncTimeseriesCurrencyRate
+from main.views import ExchangeRateView, CurrencyConverterAPIView, BulkCurrencyConverterAPIView, get_target_currencies, HistoricalCurrencyRate, TimeseriesCurrencyRate, CurrencyAPIView, CurrencyRateAnalytics
 
 
 urlpatterns = [
     path('currencies/', CurrencyAPIView.as_view(), name='currency_list_create'),
     path('currencies/<str:code>/', CurrencyAPIView.as_view(), name='currency_detail'),
     path('converter/', CurrencyConverterAPIView.as_view(), name='currency_converter'),
+    path('converter/bulk/', BulkCurrencyConverterAPIView.as_view(), name='bulk_currency_converter'),
     path('get-target-currencies/', get_target_currencies, name='get_target_currencies'),
     path('historical-rate/', HistoricalCurrencyRate.as_view(), name='historical_rate'),
     path('currency-rates-list/', TimeseriesCurrencyRate.as_view(), name='currency-rates-list'),
+    path('currency-rates-analytics/', CurrencyRateAnalytics.as_view(), name='currency-rates-analytics'),
     path('exchange-rate/<str:source_currency>/<str:exchanged_currency>/', ExchangeRateView.as_view(), name='exchange_rate'),
     path('exchange-rate/<str:source_currency>/<str:exchanged_currency>/<str:valuation_date>/', ExchangeRateView.as_view(), name='exchange_rate_with_date'),
+    path('async/converter/', AsyncCurrencyConverterView.as_view(), name='async_currency_converter'),
+    path('async/currency-rates-list/', AsyncTimeseriesCurrencyRate.as_view(), name='async-currency-rates-list'),
+    path('async/exchange-rate/<str:source_currency>/<str:exchanged_currency>/', AsyncExchangeRateView.as_view(), name='async_exchange_rate'),
+    path('async/exchange-rate/<str:source_currency>/<str:exchanged_currency>/<str:valuation_date>/', AsyncExchangeRateView.as_view(), name='async_exchange_rate_with_date'),
 ]
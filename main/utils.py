@@ -1,36 +1,241 @@
 import json
 
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_DOWN
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from main.cache import cached_config, tiered_cache
 from main.models import Currency, CurrencyExchangeRate
 
 
+def quantize_rate(rate):
+    return Decimal(str(rate)).quantize(Decimal('1.000000'), rounding=ROUND_DOWN)
+
+
+UPSERT_BATCH_SIZE = 500
+# Rate writes are logged per source currency as a counter and one entry per write holding
+# the earliest date it touched, so every worker's RateSeriesStore re-reads what changed.
+RATE_CHANGES_KEY = 'rate_changes:{}'
+RATE_CHANGE_TIMEOUT = 60 * 60 * 24
+MAX_RATE_CHANGES = 1000
+
+
+def get_currency_registry():
+    """
+    Returns {code: {'id', 'code', 'name', 'symbol'}} for every Currency, served from the
+    in-process cache and rebuilt whenever a Currency is saved or deleted. Do not mutate it.
+    """
+    return tiered_cache.get_or_set(
+        'registry',
+        lambda: {currency['code']: currency for currency in Currency.objects.values('id', 'code', 'name', 'symbol')},
+        timeout=cached_config.CACHE_TIMEOUT,
+        namespace='currency'
+    )
+
+
+def get_or_create_currencies(codes):
+    """
+    Returns {code: Currency} for every code, creating the unknown ones in a single insert.
+    """
+    codes = set(codes)
+    currencies = Currency.objects.in_bulk(codes, field_name='code')
+    missing_codes = codes - currencies.keys()
+
+    if missing_codes:
+        Currency.objects.bulk_create([Currency(code=code, name=code) for code in missing_codes], ignore_conflicts=True)
+        currencies.update(Currency.objects.in_bulk(missing_codes, field_name='code'))
+        # bulk_create sends no post_save, so the registry is invalidated here: at once for
+        # this transaction, and again on commit as other workers may have rebuilt it since.
+        tiered_cache.invalidate('currency')
+        transaction.on_commit(lambda: tiered_cache.invalidate('currency'))
+    return currencies
+
+
+def upsert_exchange_rates(exchange_rates):
+    """
+    Insert CurrencyExchangeRate objects, updating rate_value where a row for the same
+    (source, exchanged, valuation_date) already exists. Every write path goes through here
+    or, for bulk imports, through upsert_rate_rows.
+    """
+    exchange_rates = CurrencyExchangeRate.objects.bulk_create(
+        exchange_rates,
+        batch_size=UPSERT_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['source_currency', 'exchanged_currency', 'valuation_date'],
+        update_fields=['rate_value']
+    )
+    record_rate_changes(
+        (exchange_rate.source_currency_id, exchange_rate.valuation_date) for exchange_rate in exchange_rates
+    )
+    return exchange_rates
+
+
+def upsert_rate_rows(rows):
+    """
+    upsert_exchange_rates for (source id, target id, date, rate) tuples. Where the database
+    supports INSERT ... ON CONFLICT (PostgreSQL, SQLite) this is one executemany with no
+    model instances, several times faster on imports of millions of rows.
+    """
+    connection = connections[router.db_for_write(CurrencyExchangeRate)]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        return upsert_exchange_rates([
+            CurrencyExchangeRate(
+                source_currency_id=source_id, exchanged_currency_id=target_id, valuation_date=valuation_date, rate_value=rate
+            )
+            for source_id, target_id, valuation_date, rate in rows
+        ])
+
+    quote_name = connection.ops.quote_name
+    fields = CurrencyExchangeRate._meta
+    table = quote_name(fields.db_table)
+    source, target, valuation_date, rate = (
+        quote_name(fields.get_field(name).column)
+        for name in ('source_currency', 'exchanged_currency', 'valuation_date', 'rate_value')
+    )
+    sql = (
+        f"INSERT INTO {table} ({source}, {target}, {valuation_date}, {rate}) VALUES (%s, %s, %s, %s) "
+        f"ON CONFLICT ({source}, {target}, {valuation_date}) DO UPDATE SET {rate} = EXCLUDED.{rate}"
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE * 10):
+            cursor.executemany(sql, rows[start:start + UPSERT_BATCH_SIZE * 10])
+    record_rate_changes((source_id, valuation_date) for source_id, _, valuation_date, _ in rows)
+
+
+def record_rate_changes(rates):
+    """
+    Logs the (source id, valuation date) pairs written, inserted, updated or deleted, once
+    the transaction commits: logging earlier would let a reader mark itself current before
+    the rows are visible.
+    """
+    changes = {}
+    for source_id, valuation_date in rates:
+        changes[source_id] = min(changes.get(source_id, valuation_date), valuation_date)
+    if changes:
+        transaction.on_commit(lambda: log_rate_changes(changes))
+
+
+def log_rate_changes(changes):
+    for source_id, from_date in changes.items():
+        key = RATE_CHANGES_KEY.format(source_id)
+        cache.add(key, 0, timeout=None)
+        version = cache.incr(key)
+        cache.set(f"{key}:{version}", from_date.toordinal(), timeout=RATE_CHANGE_TIMEOUT)
+
+
+def get_rate_changes(source_id, since=None):
+    """
+    Returns (current version, earliest date ordinal changed since the since version). The
+    ordinal is None when nothing changed, and that of date.min, a full reload, when the
+    log no longer covers the changes since then.
+    """
+    key = RATE_CHANGES_KEY.format(source_id)
+    version = cache.get(key) or 0
+    if since is None or version == since:
+        return version, None
+    if version < since or version - since > MAX_RATE_CHANGES:
+        return version, date.min.toordinal()
+    from_ordinals = cache.get_many([f"{key}:{number}" for number in range(since + 1, version + 1)])
+    if len(from_ordinals) < version - since:
+        return version, date.min.toordinal()
+    return version, min(from_ordinals.values())
+
+
+def save_rates(source_currency, rates, valuation_date):
+    """
+    Persist {exchanged currency code: rate} for source_currency in a single bulk upsert.
+    Codes without a matching Currency row are skipped.
+    """
+    currencies = Currency.objects.in_bulk(list(rates.keys()), field_name='code')
+    exchange_rates = [
+        CurrencyExchangeRate(
+            source_currency=source_currency,
+            exchanged_currency=currencies[code],
+            valuation_date=valuation_date,
+            rate_value=quantize_rate(rate)
+        )
+        for code, rate in rates.items() if code in currencies
+    ]
+    return upsert_exchange_rates(exchange_rates)
+
+
 def save_exchange_rates(response):
     base_currency_code = response['base']
     rates = response['rates']
-    valuation_date = response['date']
-
-    base_currency, _ = Currency.objects.get_or_create(code=base_currency_code)
+    valuation_date = datetime.strptime(response['date'], "%Y-%m-%d").date()
 
-    for target_currency_code, rate_value in rates.items():
-        target_currency, _ = Currency.objects.get_or_create(code=target_currency_code)
+    currencies = get_or_create_currencies([base_currency_code, *rates.keys()])
+    base_currency = currencies[base_currency_code]
 
-        CurrencyExchangeRate.objects.update_or_create(
+    return upsert_exchange_rates([
+        CurrencyExchangeRate(
             source_currency=base_currency,
-            exchanged_currency=target_currency,
-            valuation_date=datetime.strptime(valuation_date, "%Y-%m-%d"),
-            defaults={'rate_value': rate_value}
+            exchanged_currency=currencies[target_currency_code],
+            valuation_date=valuation_date,
+            rate_value=quantize_rate(rate_value)
         )
+        for target_currency_code, rate_value in rates.items()
+    ])
 
 
+def save_timeseries_rates(source_currency_code, data):
+    """
+    Persist a timeseries response ({date string: {code: rate}}) with a single bulk upsert.
+    """
+    codes = {code for rates in data.values() for code in rates}
+    currencies = get_or_create_currencies([source_currency_code, *codes])
+    source_currency = currencies[source_currency_code]
+
+    return upsert_exchange_rates([
+        CurrencyExchangeRate(
+            source_currency=source_currency,
+            exchanged_currency=currencies[code],
+            valuation_date=datetime.strptime(rate_date, "%Y-%m-%d").date(),
+            rate_value=quantize_rate(rate)
+        )
+        for rate_date, rates in data.items()
+        for code, rate in rates.items() if rate is not None
+    ])
+
+
+def get_date_windows(from_date, to_date, window_days):
+    """
+    Splits the range into [(start, end)] windows of at most window_days days.
+    """
+    if isinstance(from_date, str):
+        from_date = date.fromisoformat(from_date)
+    if isinstance(to_date, str):
+        to_date = date.fromisoformat(to_date)
+
+    windows = []
+    while from_date <= to_date:
+        end_date = min(from_date + timedelta(days=window_days - 1), to_date)
+        windows.append((from_date, end_date))
+        from_date = end_date + timedelta(days=1)
+    return windows
+
 
 def transform_data(data, source_currency):
-    result = []
-    for date, rates in data.items():
-        for currency, rate in rates.items():
-            result.append({
-                "base": source_currency,
-                "currency": currency,
-                "date": date,
-                "rate": rate
-            })
-    return result
\ No newline at end of file
+    """
+    Lazily flatten {date: {currency: rate}} into rows. data may also be an iterable of such
+    windows (e.g. straight from iter_timeseries_exchange_rate), consumed as they arrive.
+    """
+    windows = [data] if isinstance(data, dict) else data
+    for window in windows:
+        for rate_date, rates in window.items():
+            for currency, rate in rates.items():
+                yield {
+                    "base": source_currency,
+                    "currency": currency,
+                    "date": rate_date,
+                    "rate": rate
+                }
+
+
+async def atransform_data(windows, source_currency):
+    """
+    transform_data for an async iterable of {date: {currency: rate}} windows.
+    """
+    async for window in windows:
+        for row in transform_data(window, source_currency):
+            yield row
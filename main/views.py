@@ -1,41 +1,78 @@
+import logging
+
 from datetime import datetime
+from django.conf import settings
 from django.db import DatabaseError
-import requests
-from decimal import Decimal, ROUND_DOWN
-from django.http import JsonResponse
+from decimal import Decimal
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.shortcuts import render
-from django.urls import reverse
 from django.utils import timezone
 from django.utils.dateparse import parse_date
 
 from rest_framework import status
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
+from main.analytics import DEFAULT_WINDOW, MAX_WINDOW, PERIODS, get_rate_analytics
+from main.cache import cached_config, tiered_cache
+from main.conditional import (
+    IMMUTABLE_MAX_AGE, conditional_response, get_currency_version, make_etag, set_cache_headers
+)
+from main.conversion import MAX_BULK_ROWS, convert_rows
 from main.forms import CurrencyConverterForm
+from main.history import get_historical_rates, iter_timeseries_rates
+from main.iso4217 import ISO_4217_CODES
+from main.metrics import render_metrics, request_errors
 from main.models import CurrencyExchangeRate, Currency
-from main.providers.currency_beacon import CurrencyBeaconProvider
-from main.providers.provider_manager import ProviderManager
+from main.parsers import CSVParser
+from main.renderers import CSVRenderer, NDJSONRenderer
 from main.serializers import CurrencyExchangeRateSerializer, CurrencyExchangeRateCreateSerializer, CurrencySerializer
-from main.utils import transform_data
+from main.services import fetch_rates, get_rates
+from main.utils import get_currency_registry, transform_data
 \
 
+logger = logging.getLogger(__name__)
+
+
+def report_error(request, message):
+    """
+    Log the exception being handled, traceback included, and count it against the endpoint.
+    """
+    resolver_match = request.resolver_match
+    request_errors.inc((resolver_match.view_name if resolver_match else None) or 'unmatched')
+    logger.exception(message)
+
+
 class CurrencyAPIView(APIView):
     """
     Handle all CRUD operations for Currency using APIView.
     """
+    query_budget = {'GET': 1}
 
     def get(self, request, code=None):
         try:
+            version = get_currency_version()
+            etag = make_etag('currency', version, code or '')
+            last_modified = version // 10 ** 9
+            max_age = cached_config.CACHE_TIMEOUT
+
+            not_modified = conditional_response(request, etag, last_modified)
+            if not_modified is not None:
+                return set_cache_headers(not_modified, etag, max_age, last_modified=last_modified)
+
+            currency_registry = get_currency_registry()
             if code:
-                currency = get_object_or_404(Currency, code=code)
+                currency = currency_registry.get(code)
+                if currency is None:
+                    raise Currency.DoesNotExist
                 serializer = CurrencySerializer(currency)
-                return Response(serializer.data, status=status.HTTP_200_OK)
             else:
-                currencies = Currency.objects.all()
-                serializer = CurrencySerializer(currencies, many=True)
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                serializer = CurrencySerializer(currency_registry.values(), many=True)
+            response = Response(serializer.data, status=status.HTTP_200_OK)
+            return set_cache_headers(response, etag, max_age, last_modified=last_modified)
         except Currency.DoesNotExist:
             return Response({"status":"failed", "error": "Currency not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
@@ -90,74 +127,107 @@ class CurrencyAPIView(APIView):
 
 
 class ExchangeRateView(APIView):
-    
-    def get(self, request, source_currency, exchanged_currency, valuation_date=None):
-
-        source_currency_obj, created = Currency.objects.get_or_create(code=source_currency.upper(), defaults={'name': source_currency.upper()})
-        exchanged_currency_obj, created = Currency.objects.get_or_create(code=exchanged_currency.upper(), defaults={'name': exchanged_currency.upper()})
-
-        if valuation_date:
-            valuation_date = parse_date(valuation_date)
-        else:
-            valuation_date = timezone.now().date()
+    """
+    Read path: codes are resolved from the cached currency registry and a stored rate is
+    served from the cache or with one indexed query. Only a missing rate reaches the
+    providers, and nothing here ever creates a Currency.
+    """
+    query_budget = {'GET': 1}
 
-        existing_rate = CurrencyExchangeRate.objects.filter(
-            source_currency=source_currency_obj,
-            exchanged_currency=exchanged_currency_obj,
+    def get(self, request, source_currency, exchanged_currency, valuation_date=None):
+        source_currency, exchanged_currency = source_currency.upper(), exchanged_currency.upper()
+        error = validate_currency_codes([source_currency, exchanged_currency])
+        if error:
+            return Response({"status": "failed", "error": error}, status=400)
+
+        currency_registry = get_currency_registry()
+        source_currency_data = currency_registry.get(source_currency)
+        exchanged_currency_data = currency_registry.get(exchanged_currency)
+        if source_currency_data is None or exchanged_currency_data is None:
+            return Response({"status": "failed", "error": "Currency not found"}, status=404)
+
+        valuation_date = parse_valuation_date(valuation_date)
+        if valuation_date is None:
+            return Response({"status": "failed", "error": "Invalid date format"}, status=400)
+        max_age, immutable = get_rate_cache_policy(valuation_date)
+
+        cache_key = f"{source_currency}_{exchanged_currency}_{valuation_date.isoformat()}"
+        cached_data = tiered_cache.get(cache_key, namespace='exchange_rate')
+        if cached_data:
+            etag = make_etag(cache_key, cached_data['rate_value'])
+            response = conditional_response(request, etag) or Response(cached_data)
+            return set_cache_headers(response, etag, max_age, immutable)
+
+        rate_value = CurrencyExchangeRate.objects.filter(
+            source_currency_id=source_currency_data['id'],
+            exchanged_currency_id=exchanged_currency_data['id'],
             valuation_date=valuation_date
-        ).first()
-
-        if existing_rate:
-            serializer = CurrencyExchangeRateSerializer(existing_rate)
-            return Response(serializer.data)
-
-        provider_manager = ProviderManager()
-        rate = provider_manager.get_exchange_rate_data(source_currency, exchanged_currency, valuation_date)
-
-        if rate:
-            rounded_rate = Decimal(rate).quantize(Decimal('1.000000'), rounding=ROUND_DOWN)
-
+        ).values_list('rate_value', flat=True).first()
+
+        created = rate_value is None
+        if created:
+            rate_value = fetch_rates(source_currency, [exchanged_currency], valuation_date).get(exchanged_currency)
+            if rate_value is None:
+                return Response({"error": "Unable to fetch exchange rate"}, status=400)
+
+        data = get_exchange_rate_data(source_currency_data, exchanged_currency_data, valuation_date, rate_value, created)
+        etag = make_etag(cache_key, data['rate_value'])
+        if created:
+            response = Response(data, status=status.HTTP_201_CREATED)
+        else:
+            tiered_cache.set(cache_key, data, timeout=cached_config.CACHE_TIMEOUT, namespace='exchange_rate')
+            response = conditional_response(request, etag) or Response(data)
+        return set_cache_headers(response, etag, max_age, immutable)
 
-            create_data = {
-                'source_currency': source_currency_obj.code,
-                'exchanged_currency': exchanged_currency_obj.code,
-                'rate_value': rounded_rate,
-                'valuation_date': valuation_date
-            }
 
+def validate_currency_codes(codes):
+    for code in codes:
+        if code not in ISO_4217_CODES:
+            return f"'{code}' is not an ISO 4217 currency code."
+    return None
 
-            create_serializer = CurrencyExchangeRateCreateSerializer(data=create_data)
-            if create_serializer.is_valid():
-                create_serializer.save()
-                return Response(create_serializer.data, status=201)
-            else:
-                return Response(create_serializer.errors, status=400)
 
-        return Response({"error": "Unable to fetch exchange rate"}, status=400)
+def parse_valuation_date(valuation_date):
+    """
+    Returns today for an empty value and None for an invalid one.
+    """
+    if not valuation_date:
+        return timezone.now().date()
+    try:
+        return parse_date(valuation_date)
+    except ValueError:
+        return None
 
 
-def fetch_exchange_rate_from_api(request, source_currency_code, target_currency_code):
+def get_rate_cache_policy(valuation_date, cache_timeout=None):
+    """
+    Returns (max_age, immutable): a past rate never changes, today's may until the day is
+    over. Coroutines pass CACHE_TIMEOUT in rather than have it read on the event loop.
+    """
+    if valuation_date < timezone.now().date():
+        return IMMUTABLE_MAX_AGE, True
+    return cache_timeout if cache_timeout is not None else cached_config.CACHE_TIMEOUT, False
 
-    try:
-        relative_url = reverse('exchange_rate', kwargs={
-            'source_currency': source_currency_code,
-            'exchanged_currency': target_currency_code
-        })
-        
-        api_url = request.build_absolute_uri(relative_url)
-        
-        response = requests.get(api_url)
-        if response.status_code == 201:
-            return response.json()
-        else:
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling ExchangeRateView API: {e}")
-        return None
 
+def get_exchange_rate_data(source_currency_data, exchanged_currency_data, valuation_date, rate_value, created=False):
+    """
+    Serialize a rate from registry entries without touching the database; a freshly
+    fetched rate uses the create serializer's flat shape.
+    """
+    exchange_rate = CurrencyExchangeRate(
+        source_currency=Currency(**source_currency_data),
+        exchanged_currency=Currency(**exchanged_currency_data),
+        valuation_date=valuation_date,
+        rate_value=rate_value
+    )
+    serializer_class = CurrencyExchangeRateCreateSerializer if created else CurrencyExchangeRateSerializer
+    return serializer_class(exchange_rate).data
 
 
 class CurrencyConverterAPIView(APIView):
+    # Rates for all targets are read together, whatever their number.
+    query_budget = {'GET': 1, 'POST': 2}
+
     def get(self, request):
         form = CurrencyConverterForm()
         return render(request, 'admin/converter.html', {'form': form})
@@ -167,9 +237,9 @@ class CurrencyConverterAPIView(APIView):
             source_currency_code = request.data.get('source_currency', "").upper()
             target_currency_codes = request.data.get('target_currencies', [])
 
-            try:
-                source_currency = Currency.objects.get(code=source_currency_code)
-            except Currency.DoesNotExist:
+            currency_registry = get_currency_registry()
+            source_currency = currency_registry.get(source_currency_code)
+            if source_currency is None:
                 return Response(
                     {"source_currency": [f"Currency with code '{source_currency_code}' does not exist."]}, 
                     status=status.HTTP_400_BAD_REQUEST
@@ -178,17 +248,16 @@ class CurrencyConverterAPIView(APIView):
             target_currencies = []
             for code in target_currency_codes:
                 code_upper = code.strip().upper()
-                try:
-                    target_currency = Currency.objects.get(code=code_upper)
-                    target_currencies.append(target_currency.pk)
-                except Currency.DoesNotExist:
+                target_currency = currency_registry.get(code_upper)
+                if target_currency is None:
                     return Response(
                         {"target_currencies": [f"Currency with code '{code_upper}' does not exist."]}, 
                         status=status.HTTP_400_BAD_REQUEST
                     )
+                target_currencies.append(target_currency['id'])
 
             form_data = {
-                'source_currency': source_currency.pk,
+                'source_currency': source_currency['id'],
                 'target_currencies': target_currencies,
                 'amount': request.data.get('amount')
             }
@@ -215,64 +284,82 @@ class CurrencyConverterAPIView(APIView):
         target_currencies = form.cleaned_data['target_currencies']
         amount = form.cleaned_data['amount']
 
-        conversion_results = []
+        rates = get_rates(source_currency['code'], [target_currency['code'] for target_currency in target_currencies])
 
-        def get_exchange_rate_and_convert(target_currency, rate):
-            converted_amount = round(Decimal(str(amount)) * rate, 2)
-            conversion_results.append({
-                'target_currency': target_currency.name,
-                'converted_amount': str(converted_amount),
-                'rate_value': str(round(rate, 6)),
-                'symbol': target_currency.symbol
-            })
+        return [
+            get_conversion_result(target_currency['name'], target_currency['symbol'], amount, rates.get(target_currency['code']))
+            for target_currency in target_currencies
+        ]
 
-        def fetch_exchange_rate_from_provider(target_currency):
-            provider_manager = ProviderManager()
-            rate = provider_manager.get_exchange_rate_data(source_currency.code, target_currency.code)
 
-            if rate:
-                rounded_rate = Decimal(rate).quantize(Decimal('1.000000'), rounding=ROUND_DOWN)
+def get_conversion_result(target_currency_name, target_currency_symbol, amount, rate):
+    if rate is None:
+        return {
+            'target_currency': target_currency_name,
+            'converted_amount': "N/A",
+            'rate_value': "N/A",
+            'symbol': target_currency_symbol
+        }
+    return {
+        'target_currency': target_currency_name,
+        'converted_amount': str(round(Decimal(str(amount)) * rate, 2)),
+        'rate_value': str(round(rate, 6)),
+        'symbol': target_currency_symbol
+    }
 
-                create_data = {
-                    'source_currency': source_currency.code,
-                    'exchanged_currency': target_currency.code,
-                    'rate_value': rounded_rate,
-                    'valuation_date': timezone.now().date()
-                }
 
-                create_serializer = CurrencyExchangeRateCreateSerializer(data=create_data)
-                if create_serializer.is_valid():
-                    create_serializer.save()
 
-                get_exchange_rate_and_convert(target_currency, rate)
-            else:
-                conversion_results.append({
-                    'target_currency': target_currency.name,
-                    'converted_amount': "N/A",
-                    'rate_value': "N/A",
-                    'symbol': target_currency.symbol
-                })
-
-        for target_currency in target_currencies:
-            exchange_rate = CurrencyExchangeRate.objects.filter(
-                source_currency=source_currency,
-                exchanged_currency=target_currency
-            ).order_by('-valuation_date').first()
-
-            if exchange_rate:
-                get_exchange_rate_and_convert(target_currency, exchange_rate.rate_value)
-            else:
-                fetch_exchange_rate_from_provider(target_currency)
+class BulkCurrencyConverterAPIView(APIView):
+    """
+    Convert many rows in one request. The body is a JSON list (or {"rows": [...]}) or a CSV
+    file, sent as the body or as the "file" part of a multipart upload, with
+    source_currency, target_currency, amount and an optional valuation_date column; rows
+    without a date use the latest stored rate. Ask for CSV or NDJSON through the Accept
+    header or ?format= to get the results streamed back.
+    """
+    query_budget = {'POST': 3}
+    parser_classes = [JSONParser, CSVParser, MultiPartParser]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer, CSVRenderer]
+
+    def post(self, request):
+        rows = request.data
+        if request.FILES:
+            upload = request.FILES.get('file') or next(iter(request.FILES.values()))
+            rows = CSVParser().parse(upload, parser_context={'encoding': request.encoding or settings.DEFAULT_CHARSET})
+        if isinstance(rows, dict):
+            rows = rows.get('rows')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            return Response({'status': 'failed', 'error': 'Expected a list of rows.'}, status.HTTP_400_BAD_REQUEST)
+        if len(rows) > MAX_BULK_ROWS:
+            return Response(
+                {'status': 'failed', 'error': f'At most {MAX_BULK_ROWS} rows per request.'},
+                status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            conversion_results = convert_rows(rows)
+        except Exception:
+            report_error(request, 'Bulk conversion failed')
+            return Response({'status': 'failed', 'error': 'An error occurred.'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        renderer = request.accepted_renderer
+        if hasattr(renderer, 'stream'):
+            content_type = f"{renderer.media_type}; charset={renderer.charset}"
+            return StreamingHttpResponse(renderer.stream(conversion_results), content_type=content_type)
+        return Response({'conversion_results': conversion_results}, status.HTTP_200_OK)
 
-        return conversion_results
 
+def metrics(request):
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 def get_target_currencies(request):
     source_currency_id = request.GET.get('source_currency')
     if source_currency_id:
-        target_currencies = Currency.objects.exclude(id=source_currency_id)
-        data = [{'id': currency.id, 'name': currency.name} for currency in target_currencies]
+        data = [
+            {'id': currency['id'], 'name': currency['name']}
+            for currency in get_currency_registry().values() if str(currency['id']) != source_currency_id
+        ]
         return JsonResponse({'target_currencies': data})
     return JsonResponse({'target_currencies': []})
 
@@ -293,14 +380,13 @@ class HistoricalCurrencyRate(APIView):
             except ValueError:
                 return Response({'status':'failed', 'error': 'Invalid date format'}, status.HTTP_400_BAD_REQUEST)
 
-            cbp = CurrencyBeaconProvider()
-            result, code = cbp.get_historical_exchange_rate(source_currency, from_date, symbols)
+            source_currency = source_currency.upper()
+            rates = get_historical_rates(source_currency, from_date, symbols)
+            result = {'date': from_date.isoformat(), 'base': source_currency, 'rates': rates}
 
-            if not code == 200:
-                raise
             return Response(result, status.HTTP_200_OK)
-        except Exception as ex:
-            print(str(ex))
+        except Exception:
+            report_error(request, 'Historical rates request failed')
             return Response({'status': 'failed', 'error': 'An error occurred.'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
         
 
@@ -308,6 +394,11 @@ class HistoricalCurrencyRate(APIView):
 
 
 class TimeseriesCurrencyRate(APIView):
+    """
+    Rows are streamed when NDJSON or CSV is requested, through the Accept header or
+    ?format=ndjson|csv, so memory use does not depend on the size of the range.
+    """
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer, CSVRenderer]
 
     def get(self, request, *args, **kwargs):
         try:
@@ -325,16 +416,61 @@ class TimeseriesCurrencyRate(APIView):
             except ValueError:
                 return Response({'status':'failed', 'error': 'Invalid date format'}, status.HTTP_400_BAD_REQUEST)
 
-            cbp = CurrencyBeaconProvider()
-            data, code = cbp.get_timeseries_exchange_rate(source_currency, from_date, to_date, symbols)
+            source_currency = source_currency.upper()
+            windows = iter_timeseries_rates(source_currency, from_date, to_date, symbols)
+            rows = transform_data(windows, source_currency)
+
+            renderer = request.accepted_renderer
+            if hasattr(renderer, 'stream'):
+                content_type = f"{renderer.media_type}; charset={renderer.charset}"
+                return StreamingHttpResponse(renderer.stream(rows), content_type=content_type)
+            return Response(list(rows), status.HTTP_200_OK)
+        except Exception:
+            report_error(request, 'Timeseries request failed')
+            return Response({'status': 'failed', 'error': f'An error occurred'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            result = transform_data(data, source_currency)
 
-            if not code == 200:
-                raise
-            return Response(result, status.HTTP_200_OK)
-        except Exception as ex:
-            print(str(ex))
-            return Response({'status': 'failed', 'error': f'An error occurred'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+class CurrencyRateAnalytics(APIView):
+    """
+    Statistics over a range instead of its raw points: per symbol the rolling mean, standard
+    deviation and volatility over the last ?window observations, min/max with their dates,
+    overall and per ?period (week, month or year) change. Parameters come from the query
+    string or, like the timeseries endpoint, from a JSON body.
+    """
+
+    def get(self, request, *args, **kwargs):
+        data = {**request.query_params.dict(), **request.data}
+        source_currency = data.get('source_currency')
+        from_date = data.get('from_date')
+        to_date = data.get('to_date')
+        symbols = data.get('symbols')
+        period = data.get('period', 'month')
+
+        if not (source_currency and from_date and to_date):
+            return Response({'status': 'failed', 'error': 'Invalid input parameters.'}, status.HTTP_400_BAD_REQUEST)
+
+        try:
+            from_date = datetime.strptime(from_date, "%Y-%m-%d").date()
+            to_date = datetime.strptime(to_date, "%Y-%m-%d").date()
+        except ValueError:
+            return Response({'status': 'failed', 'error': 'Invalid date format'}, status.HTTP_400_BAD_REQUEST)
 
-        
\ No newline at end of file
+        try:
+            window = int(data.get('window', DEFAULT_WINDOW))
+        except (TypeError, ValueError):
+            window = 0
+        if not 2 <= window <= MAX_WINDOW:
+            return Response(
+                {'status': 'failed', 'error': f'window must be between 2 and {MAX_WINDOW}.'}, status.HTTP_400_BAD_REQUEST
+            )
+        if period not in PERIODS:
+            return Response(
+                {'status': 'failed', 'error': f"period must be one of {', '.join(PERIODS)}."}, status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            analytics = get_rate_analytics(source_currency.upper(), from_date, to_date, symbols, window, period)
+        except Exception:
+            report_error(request, 'Rate analytics request failed')
+            return Response({'status': 'failed', 'error': 'An error occurred.'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(analytics, status.HTTP_200_OK)